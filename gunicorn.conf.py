@@ -0,0 +1,60 @@
+"""
+gunicorn settings for both deployment modes; SERVER_MODE picks the entry point
+
+    wsgi (default)  sync workers serving src/wsgi.py
+    asgi            uvicorn workers serving src/asgi.py (needs uvicorn, greenlet and
+                    asyncpg or aiosqlite for the database)
+
+The app is preloaded in the master (GUNICORN_PRELOAD=0 turns that off): workers fork with it
+already imported and share those pages copy-on-write, so a new worker is ready almost at once.
+Database pools are replaced in each child after fork (api.db_pool.dispose_engines_after_fork).
+"""
+import gc
+import os
+import sys
+
+chdir = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'src')
+# The hooks below import from api in the master, before or without the app being loaded
+if chdir not in sys.path:
+    sys.path.insert(0, chdir)
+
+SERVER_MODE = os.getenv('SERVER_MODE', 'wsgi')
+if SERVER_MODE == 'asgi':
+    wsgi_app = 'asgi:application'
+    worker_class = os.getenv('ASGI_WORKER_CLASS', 'uvicorn.workers.UvicornWorker')
+elif SERVER_MODE == 'wsgi':
+    wsgi_app = 'wsgi:application'
+else:
+    raise ValueError(f"Unknown SERVER_MODE: {SERVER_MODE}")
+
+preload_app = os.getenv('GUNICORN_PRELOAD', '1') == '1'
+multiproc_dir = os.getenv('PROMETHEUS_MULTIPROC_DIR')
+
+
+def on_starting(server):
+    # Counters from a previous run's workers must not be summed into this one's
+    if multiproc_dir:
+        from api.metrics import clear_multiproc_dir
+        clear_multiproc_dir(multiproc_dir)
+
+
+def when_ready(server):
+    # Move everything loaded so far out of the collector's generations; otherwise the first
+    # collection in each worker touches every object header and un-shares the pages
+    if preload_app:
+        gc.freeze()
+
+
+def post_worker_init(worker):
+    if SERVER_MODE == 'wsgi':
+        from api.bloom import email_filter
+
+        # Per worker, after fork: the build thread and its connection belong to this process
+        email_filter.start()
+
+
+def child_exit(server, worker):
+    # Keep the exited worker's counts, but not a file a later worker with the same pid would reuse
+    if multiproc_dir:
+        from api.metrics import mark_process_dead
+        mark_process_dead(multiproc_dir, worker.pid)
@@ -0,0 +1,29 @@
+"""Track last login in its own table
+
+Revision ID: 5b1f0c2e9a41
+Revises: e3d3da7d24b7
+Create Date: 2026-10-17 09:12:31.402118
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = '5b1f0c2e9a41'
+down_revision = 'e3d3da7d24b7'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    op.create_table('user_last_logins',
+    sa.Column('user_id', sa.Integer(), nullable=False),
+    sa.Column('last_login_at', sa.DateTime(), nullable=False),
+    sa.ForeignKeyConstraint(['user_id'], ['users.id'], ondelete='CASCADE'),
+    sa.PrimaryKeyConstraint('user_id')
+    )
+
+
+def downgrade():
+    op.drop_table('user_last_logins')
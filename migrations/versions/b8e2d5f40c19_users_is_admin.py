@@ -0,0 +1,26 @@
+"""Add users.is_admin
+
+Revision ID: b8e2d5f40c19
+Revises: d4a8f2c61e07
+Create Date: 2026-10-17 18:05:13.772014
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = 'b8e2d5f40c19'
+down_revision = 'd4a8f2c61e07'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    # Not batch mode: on SQLite that rebuilds users and cannot copy the generated email_canonical
+    # column, while ADD COLUMN with a constant default works everywhere
+    op.add_column('users', sa.Column('is_admin', sa.Boolean(), server_default=sa.false(), nullable=False))
+
+
+def downgrade():
+    op.drop_column('users', 'is_admin')
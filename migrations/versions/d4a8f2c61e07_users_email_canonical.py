@@ -0,0 +1,40 @@
+"""Add generated users.email_canonical and a covering login index
+
+Revision ID: d4a8f2c61e07
+Revises: 9c4e7a1d2b53
+Create Date: 2026-10-17 17:52:41.204519
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = 'd4a8f2c61e07'
+down_revision = '9c4e7a1d2b53'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    # Generated (STORED) column: PostgreSQL rewrites the table once, SQLite batch mode recreates it
+    with op.batch_alter_table('users', schema=None) as batch_op:
+        batch_op.add_column(sa.Column('email_canonical', sa.String(length=120),
+                                      sa.Computed('lower(trim(email))', persisted=True), nullable=False))
+
+    if op.get_bind().dialect.name == 'postgresql':
+        op.create_index('ix_users_email_canonical', 'users', ['email_canonical'], unique=True,
+                        postgresql_include=['id', 'password', 'is_active'])
+    else:
+        with op.batch_alter_table('users', schema=None) as batch_op:
+            batch_op.create_index('ix_users_email_canonical', ['email_canonical'], unique=True)
+            batch_op.create_index('ix_users_login', ['email_canonical', 'id', 'password', 'is_active'],
+                                  unique=False)
+
+
+def downgrade():
+    with op.batch_alter_table('users', schema=None) as batch_op:
+        if op.get_bind().dialect.name != 'postgresql':
+            batch_op.drop_index('ix_users_login')
+        batch_op.drop_index('ix_users_email_canonical')
+        batch_op.drop_column('email_canonical')
@@ -0,0 +1,288 @@
+"""
+ASGI deployment mode: the hot auth endpoints run on an event loop, every other route is the Flask app
+
+/api/login, /api/validate-token, /api/protected and /api/user/profile run on the loop itself. They
+drive the same flows the Flask views do (api.routes.login_steps, check_token_steps,
+check_auth_steps), awaiting each database step on SQLAlchemy's asyncio engine (asyncpg or
+aiosqlite) and each hash on the hash executor's pool, so one worker keeps many logins in flight
+without a thread apiece. Those reads go to the primary; the rare password rehash runs on a thread.
+Everything else is handed to the Flask app on a thread pool and behaves exactly as under the sync
+workers. Served by src/asgi.py.
+"""
+import asyncio
+import contextvars
+import io
+import logging
+import sys
+import time
+from concurrent.futures import ThreadPoolExecutor
+from flask import current_app
+from api.bloom import email_filter
+from api.cors import cors
+from api.db_pool import async_database_url, async_engine_options
+from api.hashing import hash_executor
+from api.logs import REQUEST_ID_HEADER, request_context, request_id_from
+from api.metrics import REQUESTS, REQUEST_LATENCY, PHASE_LATENCY, phase_times
+from api.models import db, User, RefreshToken
+from api.routes import check_auth_steps, check_token_steps, login_steps
+from api.steps import ReadRow, VerifyPassword, UpgradePasswordHash, IssueRefreshToken
+from api.utils import APIException
+
+logger = logging.getLogger(__name__)
+
+
+async def read_body(receive):
+    chunks = []
+    while True:
+        message = await receive()
+        if message['type'] == 'http.disconnect':
+            break
+        chunks.append(message.get('body', b''))
+        if not message.get('more_body'):
+            break
+    return b''.join(chunks)
+
+
+def wsgi_environ(scope, body):
+    """Build a WSGI environ from an ASGI http scope"""
+    server = scope.get('server') or ('localhost', 80)
+    environ = {
+        'REQUEST_METHOD': scope['method'],
+        'SCRIPT_NAME': scope.get('root_path', '').encode('utf-8').decode('latin-1'),
+        'PATH_INFO': scope['path'].encode('utf-8').decode('latin-1'),
+        'QUERY_STRING': scope.get('query_string', b'').decode('latin-1'),
+        'SERVER_NAME': server[0],
+        'SERVER_PORT': str(server[1]),
+        'SERVER_PROTOCOL': f"HTTP/{scope.get('http_version', '1.1')}",
+        'CONTENT_LENGTH': str(len(body)),
+        'wsgi.version': (1, 0),
+        'wsgi.url_scheme': scope.get('scheme', 'http'),
+        'wsgi.input': io.BytesIO(body),
+        'wsgi.errors': sys.stderr,
+        'wsgi.multithread': True,
+        'wsgi.multiprocess': True,
+        'wsgi.run_once': False,
+    }
+    if scope.get('client'):
+        environ['REMOTE_ADDR'] = scope['client'][0]
+    for name, value in scope['headers']:
+        name = name.decode('latin-1')
+        if name == 'content-length':
+            continue
+        key = 'CONTENT_TYPE' if name == 'content-type' else 'HTTP_' + name.upper().replace('-', '_')
+        value = value.decode('latin-1')
+        environ[key] = f"{environ[key]},{value}" if key in environ else value
+    return environ
+
+
+def run_wsgi(app, environ):
+    """Call a WSGI app and collect its whole response as (status, headers, body)"""
+    started = {}
+
+    def start_response(status, headers, exc_info=None):
+        started['status'] = int(status.split(' ', 1)[0])
+        started['headers'] = headers
+
+    chunks = app(environ, start_response)
+    try:
+        body = b''.join(chunks)
+    finally:
+        if hasattr(chunks, 'close'):
+            chunks.close()
+    return started['status'], started['headers'], body
+
+
+class AsyncRequest:
+    """The parts of an ASGI http scope the native handlers read"""
+
+    def __init__(self, scope, body):
+        self.scope = scope
+        self.method = scope['method']
+        self.client = scope.get('client')
+        self.headers = {name.decode('latin-1'): value.decode('latin-1')
+                        for name, value in scope['headers']}
+        self.body = body
+        self.phase_times = {}
+
+    def get_json(self):
+        if not self.body:
+            return None
+        try:
+            return current_app.json.loads(self.body)
+        except ValueError:
+            return None
+
+    def client_ip(self):
+        """routes.client_ip() for a raw scope: the X-Forwarded-For entry PROXY_FIX_X_FOR hops from the right"""
+        hops = current_app.config.get('PROXY_FIX_X_FOR', 0)
+        forwarded = self.headers.get('x-forwarded-for')
+        if hops and forwarded:
+            values = [value.strip() for value in forwarded.split(',')]
+            if len(values) >= hops:
+                return values[-hops]
+        return self.client[0] if self.client else None
+
+
+class AsyncAuthAPI:
+    """ASGI application wrapping the Flask app; configured from the same app.config"""
+
+    def __init__(self, app):
+        self.app = app
+        self.engine = None
+        self.wsgi_executor = ThreadPoolExecutor(
+            max_workers=int(app.config.get('ASGI_WSGI_THREADS', 16)), thread_name_prefix='wsgi')
+        self.routes = {
+            ('POST', '/api/login'): ('api.login', self.login),
+            ('POST', '/api/validate-token'): ('api.validate_token', self.validate_token),
+            ('GET', '/api/protected'): ('api.protected', self.protected),
+            ('GET', '/api/user/profile'): ('api.get_profile', self.get_profile),
+        }
+
+    def get_engine(self):
+        """Async engine, created in the serving process so each worker gets its own pool"""
+        if self.engine is None:
+            try:
+                from sqlalchemy.ext.asyncio import create_async_engine
+            except ImportError:
+                raise RuntimeError("ASGI mode needs SQLAlchemy's asyncio extension (greenlet)")
+            db_url = self.app.config.get('ASGI_DATABASE_URL') or async_database_url(
+                self.app.config['SQLALCHEMY_DATABASE_URI'])
+            self.engine = create_async_engine(db_url, **async_engine_options(db_url))
+        return self.engine
+
+    async def __call__(self, scope, receive, send):
+        if scope['type'] == 'lifespan':
+            return await self.lifespan(receive, send)
+        if scope['type'] != 'http':
+            return
+
+        path = scope['path'].rstrip('/') or '/'  # like url_map.strict_slashes = False
+        endpoint, handler = self.routes.get((scope['method'], path), (None, None))
+        body = await read_body(receive)
+        if handler is None:
+            return await self.call_wsgi(scope, body, send)
+
+        started = time.perf_counter()
+        request = AsyncRequest(scope, body)
+        request_id = request_id_from(request.headers.get(REQUEST_ID_HEADER.lower()))
+        # Each request runs in its own task, so the context var is this request's alone
+        request_context.set((request_id, endpoint))
+        phase_times.set(request.phase_times)
+        with self.app.app_context():
+            try:
+                status, payload, headers = await handler(request)
+            except APIException as error:
+                status, payload, headers = error.status_code, error.to_dict(), getattr(error, 'headers', None)
+            except Exception:
+                logger.exception("ASGI %s error", endpoint)
+                status, payload, headers = 500, {"message": "Internal server error"}, None
+            body = current_app.json.dumps_bytes(payload) + b'\n'
+
+        response_headers = [(b'content-type', b'application/json'),
+                            (b'content-length', str(len(body)).encode('latin-1')),
+                            (REQUEST_ID_HEADER.lower().encode('latin-1'), request_id.encode('latin-1'))]
+        origin = request.headers.get('origin')
+        extra = list((headers or {}).items()) + (cors.response_headers(origin) if origin else [])
+        for name, value in extra:
+            response_headers.append((name.lower().encode('latin-1'), str(value).encode('latin-1')))
+        await send({'type': 'http.response.start', 'status': status, 'headers': response_headers})
+        await send({'type': 'http.response.body', 'body': body})
+
+        REQUESTS.inc(endpoint=endpoint, method=request.method, status=status)
+        REQUEST_LATENCY.observe(time.perf_counter() - started, endpoint=endpoint)
+        for phase, seconds in request.phase_times.items():
+            PHASE_LATENCY.observe(seconds, endpoint=endpoint, phase=phase)
+
+    async def lifespan(self, receive, send):
+        while True:
+            message = await receive()
+            if message['type'] == 'lifespan.startup':
+                try:
+                    self.get_engine()
+                    # Started here rather than at import so a preloading master holds no threads
+                    email_filter.start()
+                except Exception as e:
+                    await send({'type': 'lifespan.startup.failed', 'message': str(e)})
+                    return
+                await send({'type': 'lifespan.startup.complete'})
+            elif message['type'] == 'lifespan.shutdown':
+                if self.engine is not None:
+                    await self.engine.dispose()
+                self.wsgi_executor.shutdown(wait=False)
+                await send({'type': 'lifespan.shutdown.complete'})
+                return
+
+    async def call_wsgi(self, scope, body, send):
+        """Hand the request to the Flask app on the WSGI thread pool"""
+        status, headers, body = await asyncio.get_running_loop().run_in_executor(
+            self.wsgi_executor, run_wsgi, self.app, wsgi_environ(scope, body))
+        await send({
+            'type': 'http.response.start',
+            'status': status,
+            'headers': [(name.lower().encode('latin-1'), value.encode('latin-1')) for name, value in headers],
+        })
+        await send({'type': 'http.response.body', 'body': body})
+
+    def in_app_context(self, func, *args):
+        """Run sync app code (ORM session and all) on a worker thread"""
+        with self.app.app_context():
+            return func(*args)
+
+    async def perform(self, step):
+        """api.steps.perform() with the database and hashing awaited"""
+        if isinstance(step, ReadRow):
+            async with self.get_engine().connect() as connection:
+                result = await connection.execute(step.statement, step.params)
+                return result.first()
+        if isinstance(step, VerifyPassword):
+            if step.pwhash is None:
+                return await hash_executor.verify_dummy_async(step.password)
+            return await hash_executor.verify_password_async(step.pwhash, step.password)
+        if isinstance(step, UpgradePasswordHash):
+            if not hash_executor.needs_rehash(step.stored_hash):
+                return None
+            context = contextvars.copy_context()
+            return await asyncio.get_running_loop().run_in_executor(
+                self.wsgi_executor, context.run, self.in_app_context, User.upgrade_password_hash, *step)
+        if isinstance(step, IssueRefreshToken):
+            refresh_token, values = RefreshToken.new_values(step.user_id)
+            async with self.get_engine().begin() as connection:
+                await connection.execute(db.insert(RefreshToken), values)
+            return refresh_token
+        raise TypeError(f"Unknown step {step!r}")
+
+    async def run_steps(self, flow):
+        """api.steps.run_steps() for the event loop"""
+        value, error = None, None
+        while True:
+            try:
+                step = flow.throw(error) if error is not None else flow.send(value)
+            except StopIteration as done:
+                return done.value
+            try:
+                value, error = await self.perform(step), None
+            except Exception as e:
+                value, error = None, e
+
+    async def login(self, request):
+        body, status = await self.run_steps(login_steps(request.get_json(), request.client_ip()))
+        return status, body, None
+
+    async def validate_token(self, request):
+        body, status = await self.run_steps(check_token_steps(request.get_json()))
+        return status, body, None
+
+    async def protected(self, request):
+        user, error = await self.run_steps(check_auth_steps(request.headers.get('authorization')))
+        if error:
+            body, status = error
+            return status, body, None
+        return 200, {"message": "Access granted to protected route", "user": user}, None
+
+    async def get_profile(self, request):
+        user, error = await self.run_steps(
+            check_auth_steps(request.headers.get('authorization'), active_only=False))
+        if error:
+            body, status = error
+            return status, body, None
+        return 200, {"user": user}, None
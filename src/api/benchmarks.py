@@ -0,0 +1,199 @@
+"""
+Micro-benchmarks for the auth hot paths, exposed through the flask CLI in commands.py
+"""
+import random
+import time
+from datetime import datetime
+from flask import current_app, g
+from flask.json.provider import DefaultJSONProvider
+from api.models import db, User
+from api.token_cache import token_cache
+from api.hashing import verify_password
+
+
+def time_per_call(func, iterations):
+    """Average wall time of func() in microseconds"""
+    started = time.perf_counter()
+    for _ in range(iterations):
+        func()
+    return (time.perf_counter() - started) / iterations * 1e6
+
+
+def bench_auth_resolution(iterations=1000):
+    """Per-request cost of resolving a token to a serialized user, before and after require_auth"""
+    from api.routes import authenticate
+
+    user = User.query.first()
+    if not user:
+        return None
+    token = user.generate_token()
+    db.session.remove()
+
+    def legacy():
+        # decode + full ORM load, as protected() did before require_auth
+        payload = User.decode_token(token)
+        User.query.get(payload['user_id']).serialize()
+        db.session.remove()
+
+    def cold():
+        # decode + column-only load, cache miss
+        token_cache.clear()
+        g.pop('auth_token', None)
+        authenticate(token)
+        db.session.remove()
+
+    def warm():
+        # verified-token cache hit
+        g.pop('auth_token', None)
+        authenticate(token)
+
+    legacy()
+    cold()
+    results = {
+        "legacy_orm_lookup": time_per_call(legacy, iterations),
+        "require_auth_cold": time_per_call(cold, iterations),
+        "require_auth_warm": time_per_call(warm, iterations),
+    }
+    token_cache.clear()
+    g.pop('auth_token', None)
+    return results
+
+
+def bench_serialization(iterations=1000, page_size=100):
+    """Cost of encoding one /api/users page and of User.serialize(), stdlib jsonify vs the fast path"""
+    rows = User.get_page(0, page_size)
+    user = User.query.first()
+    if not rows or not user:
+        return None
+    stdlib = DefaultJSONProvider(current_app)
+    fast = current_app.json
+
+    def legacy_page():
+        # serialize_fields per row, then jsonify through the stdlib provider
+        stdlib.response({"users": [User.serialize_fields(row) for row in rows], "next_after_id": None})
+
+    def provider_page():
+        # same dicts, encoded by the app's provider
+        fast.response({"users": [User.serialize_fields(row) for row in rows], "next_after_id": None})
+
+    def bytes_page():
+        # raw rows straight to bytes, as list_users does
+        fast.bytes_response(fast.dumps_bytes(
+            {"users": [row._asdict() for row in rows], "next_after_id": None}, iso_datetimes=True))
+
+    def legacy_serialize():
+        User.serialize_fields(user)
+
+    def memoized_serialize():
+        user.serialize()
+
+    results = {
+        "page_stdlib_jsonify": time_per_call(legacy_page, iterations),
+        f"page_{fast.backend}_jsonify": time_per_call(provider_page, iterations),
+        f"page_{fast.backend}_bytes": time_per_call(bytes_page, iterations),
+        "user_serialize_fields": time_per_call(legacy_serialize, iterations),
+        "user_serialize_memo": time_per_call(memoized_serialize, iterations),
+    }
+    db.session.remove()
+    return len(rows), results
+
+
+SEED_PASSWORD_HASH = "pbkdf2:sha256:1$seed$" + "0" * 64
+
+
+def seed_users_table(total, batch_size=10000):
+    """Top the users table up to total rows of seedN@seed.test, with a placeholder hash and no hashing
+
+    Returns (rows in the table, seed users in it).
+    """
+    from api.importer import insert_rows
+
+    existing = db.session.execute(db.select(db.func.count(User.id))).scalar()
+    next_id = db.session.execute(db.select(db.func.count(User.id)).where(
+        User.email.like('seed%@seed.test'))).scalar()
+    now = datetime.utcnow()
+    while existing < total:
+        count = min(batch_size, total - existing)
+        insert_rows([{"email": f"seed{next_id + i}@seed.test", "password": SEED_PASSWORD_HASH,
+                      "is_active": True, "created_at": now, "updated_at": now} for i in range(count)])
+        db.session.commit()
+        existing += count
+        next_id += count
+    return existing, next_id
+
+
+def explain(statement, params):
+    """The database's plan for a statement: EXPLAIN (ANALYZE, BUFFERS) on PostgreSQL, EXPLAIN QUERY PLAN on SQLite"""
+    connection = db.session.connection()
+    compiled = statement.compile(dialect=connection.dialect)
+    bound = compiled.construct_params(params)
+    parameters = tuple(bound[name] for name in compiled.positiontup) if compiled.positional else bound
+    if connection.dialect.name == 'postgresql':
+        prefix = 'EXPLAIN (ANALYZE, BUFFERS) '
+    else:
+        prefix = 'EXPLAIN QUERY PLAN '
+    return [str(row[-1]) for row in connection.exec_driver_sql(prefix + str(compiled), parameters)]
+
+
+def bench_login_lookup(seed_rows=0, iterations=2000):
+    """Plans and per-lookup latency of the login query, full ORM row by email vs the covering index
+
+    Seeds users and runs VACUUM ANALYZE, so it refuses to run unless BENCH_DATABASE is set.
+    """
+    from api.models import LOGIN_USER_BY_EMAIL
+
+    if not current_app.config.get('BENCH_DATABASE'):
+        raise RuntimeError("Refusing to seed a database not marked as a benchmark database (set BENCH_DATABASE=1)")
+
+    total, seeded = seed_users_table(seed_rows)
+    if db.engine.dialect.name == 'postgresql':
+        # Fresh statistics, and a visibility map so the planner can choose an index-only scan
+        with db.engine.connect().execution_options(isolation_level='AUTOCOMMIT') as connection:
+            connection.exec_driver_sql('VACUUM ANALYZE users')
+
+    rng = random.Random(42)
+    emails = [f"seed{rng.randrange(max(seeded, 1))}@seed.test" for _ in range(iterations)]
+    legacy_statement = db.select(User).where(User.email == db.bindparam('email'))
+    plans = {
+        "legacy_orm_row": explain(legacy_statement, {"email": emails[0]}),
+        "covering_index": explain(LOGIN_USER_BY_EMAIL, {"email": emails[0]}),
+    }
+
+    lookups = iter(emails * 2)
+
+    def legacy():
+        # what login did before: the whole ORM row by email
+        User.query.filter_by(email=next(lookups)).first()
+        db.session.expunge_all()
+
+    def covering():
+        User.get_login_row(next(lookups))
+
+    results = {
+        "legacy_orm_row": time_per_call(legacy, iterations),
+        "covering_index": time_per_call(covering, iterations),
+    }
+    db.session.remove()
+    return total, plans, results
+
+
+def bench_password_hashers(schemes, costs=None, rounds=3):
+    """Average seconds per hash for each scheme and cost, to pick parameters against a latency budget"""
+    from api.hashing import PASSWORD_HASHERS
+
+    results = []
+    for scheme in schemes:
+        for cost in costs or [None]:
+            hasher = PASSWORD_HASHERS[scheme](cost)
+            pwhash = hasher.hash("benchmark-password")
+            hash_time = time_per_call(
+                lambda: hasher.hash("benchmark-password"), rounds) / 1e6
+            verify_time = time_per_call(
+                lambda: verify_password(pwhash, "benchmark-password"), rounds) / 1e6
+            results.append({
+                "scheme": scheme,
+                "method": hasher.method,
+                "hash_seconds": hash_time,
+                "verify_seconds": verify_time,
+            })
+    return results
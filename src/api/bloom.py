@@ -0,0 +1,251 @@
+"""
+Negative-lookup cache over users.email_canonical, so logins for unknown emails skip the database
+
+Each process builds its filter and then keeps it current from a background thread, so a login
+never waits on the database for it. Ids are allocated at insert but become visible at commit,
+so a lower id can show up after a higher one was scanned: ids a scan skipped over are looked up
+again on every refresh for EMAIL_FILTER_GAP_SECONDS.
+
+Users created by another process since the last refresh are not in the filter yet, so a "no"
+only rules out ids up to unseen_after(): login still looks the email up among newer ids, and a
+filter miss is never a false negative.
+"""
+import hashlib
+import logging
+import math
+import os
+import threading
+import time
+from api.models import canonical_email
+
+logger = logging.getLogger(__name__)
+
+
+class CountingBloomFilter:
+    """Bloom filter with 8-bit counters, so entries can be removed as well as added"""
+
+    def __init__(self, capacity, error_rate=0.01):
+        capacity = max(int(capacity), 1)
+        self.size = max(int(-capacity * math.log(error_rate) / (math.log(2) ** 2)), 8)
+        self.hash_count = max(int(round(self.size / capacity * math.log(2))), 1)
+        self.counters = bytearray(self.size)
+        self.count = 0
+
+    def _positions(self, item):
+        digest = hashlib.blake2b(item.encode('utf-8'), digest_size=16).digest()
+        first = int.from_bytes(digest[:8], 'little')
+        second = int.from_bytes(digest[8:], 'little') | 1
+        return [(first + i * second) % self.size for i in range(self.hash_count)]
+
+    def add(self, item):
+        for position in self._positions(item):
+            if self.counters[position] < 255:
+                self.counters[position] += 1
+        self.count += 1
+
+    def remove(self, item):
+        positions = self._positions(item)
+        if not all(self.counters[position] for position in positions):
+            return
+        for position in positions:
+            # A saturated counter no longer knows its true count, so it stays put
+            if self.counters[position] < 255:
+                self.counters[position] -= 1
+        self.count -= 1
+
+    def __contains__(self, item):
+        counters = self.counters
+        return all(counters[position] for position in self._positions(item))
+
+
+class EmailFilter:
+    """Bloom filter over registered emails; built by a streaming scan and kept current by id high-water mark"""
+
+    def __init__(self, app=None):
+        self.app = None
+        self.enabled = True
+        self.capacity = 1000000
+        self.error_rate = 0.01
+        self.refresh_seconds = 5.0
+        self.gap_seconds = 60.0
+        self.max_gaps = 10000
+        self.batch_size = 10000
+        self._filter = None
+        self._high_water_id = 0
+        # Every committed user with an id up to this is in the filter
+        self._unseen_after = 0
+        # id skipped over by a scan -> when it was first seen missing
+        self._gaps = {}
+        self._lock = threading.Lock()
+        self._refresh_lock = threading.Lock()
+        self._pid = None
+        self._counters = {"rejected": 0, "false_positives": 0, "rebuilds": 0, "late_commits": 0}
+        if app is not None:
+            self.init_app(app)
+
+    def init_app(self, app):
+        self.app = app
+        self.enabled = bool(app.config.get('EMAIL_FILTER_ENABLED', True))
+        self.capacity = int(app.config.get('EMAIL_FILTER_CAPACITY', self.capacity))
+        self.error_rate = float(app.config.get('EMAIL_FILTER_ERROR_RATE', self.error_rate))
+        self.refresh_seconds = float(app.config.get(
+            'EMAIL_FILTER_REFRESH_SECONDS', self.refresh_seconds))
+        self.gap_seconds = float(app.config.get('EMAIL_FILTER_GAP_SECONDS', self.gap_seconds))
+        app.extensions['email_filter'] = self
+
+    @property
+    def ready(self):
+        return self._filter is not None and self._pid == os.getpid()
+
+    def start(self):
+        """Build the filter in the background; until it is ready every email goes to the database"""
+        if not self.enabled or self.app is None or self._pid == os.getpid():
+            return
+        with self._lock:
+            if self._pid == os.getpid():
+                return
+            self._pid = os.getpid()
+            self._filter = None
+        threading.Thread(target=self._run_in_background,
+                         name='email-filter', daemon=True).start()
+
+    def _run_in_background(self):
+        pid = os.getpid()
+        try:
+            with self.app.app_context():
+                self.rebuild()
+        except Exception:
+            logger.exception("Email filter rebuild error")
+            # Let a later login try again
+            self._pid = None
+            return
+        while self._pid == pid:
+            time.sleep(self.refresh_seconds)
+            try:
+                with self.app.app_context():
+                    self.refresh()
+            except Exception:
+                logger.exception("Email filter refresh error")
+
+    def _record_gaps(self, after_id, next_id, seen_at):
+        # Only the newest ids can still be uncommitted, so a long run of missing ids is capped
+        for missing in range(max(after_id + 1, next_id - self.max_gaps), next_id):
+            self._gaps.setdefault(missing, seen_at)
+
+    def _trim_gaps(self):
+        if len(self._gaps) > self.max_gaps:
+            for missing in sorted(self._gaps)[:len(self._gaps) - self.max_gaps]:
+                del self._gaps[missing]
+
+    def _scan(self, bloom, after_id):
+        """Add every email with id > after_id, one keyset batch at a time; returns the last id seen"""
+        from api.models import db, User
+
+        statement = db.select(User.id, User.email_canonical).where(
+            User.id > db.bindparam('after_id')).order_by(User.id).limit(self.batch_size)
+        connection = db.session.connection()
+        seen_at = time.monotonic()
+        while True:
+            rows = connection.execute(statement, {"after_id": after_id}).all()
+            for row in rows:
+                bloom.add(row.email_canonical)
+                if row.id > after_id + 1:
+                    self._record_gaps(after_id, row.id, seen_at)
+                after_id = row.id
+            self._trim_gaps()
+            if len(rows) < self.batch_size:
+                return after_id
+
+    def _fill_gaps(self, bloom):
+        """Add users whose ids were skipped by an earlier scan and have committed since"""
+        from api.models import db, User
+
+        expired = time.monotonic() - self.gap_seconds
+        for missing in [missing for missing, seen_at in self._gaps.items() if seen_at < expired]:
+            del self._gaps[missing]
+        pending = sorted(self._gaps)
+        connection = db.session.connection()
+        for start in range(0, len(pending), 1000):
+            rows = connection.execute(db.select(User.id, User.email_canonical).where(
+                User.id.in_(pending[start:start + 1000]))).all()
+            for row in rows:
+                bloom.add(row.email_canonical)
+                del self._gaps[row.id]
+            self._counters["late_commits"] += len(rows)
+
+    def _publish_unseen_after(self, high_water_id):
+        self._unseen_after = min([high_water_id] + [missing - 1 for missing in self._gaps])
+
+    def rebuild(self):
+        """Build a fresh filter from the users table and swap it in"""
+        from api.models import db
+
+        bloom = CountingBloomFilter(self.capacity, self.error_rate)
+        with self._refresh_lock:
+            self._gaps = {}
+            try:
+                high_water_id = self._scan(bloom, 0)
+            finally:
+                db.session.remove()
+            with self._lock:
+                self._filter = bloom
+                self._high_water_id = high_water_id
+                self._publish_unseen_after(high_water_id)
+                self._counters["rebuilds"] += 1
+
+    def refresh(self):
+        """Pick up users created by other processes since the last scan, including late commits"""
+        from api.models import db
+
+        if not self._refresh_lock.acquire(blocking=False):
+            return
+        try:
+            bloom = self._filter
+            if bloom is None:
+                return
+            self._fill_gaps(bloom)
+            high_water_id = self._scan(bloom, self._high_water_id)
+            with self._lock:
+                if self._filter is bloom:
+                    self._high_water_id = max(self._high_water_id, high_water_id)
+                    self._publish_unseen_after(self._high_water_id)
+        finally:
+            db.session.remove()
+            self._refresh_lock.release()
+
+    def might_exist(self, email):
+        """False when no user with an id up to unseen_after() has the email; never touches the database"""
+        if not self.enabled:
+            return True
+        if not self.ready:
+            self.start()
+            return True
+        if canonical_email(email) in self._filter:
+            return True
+        self._counters["rejected"] += 1
+        return False
+
+    def unseen_after(self):
+        """Users with a higher id may have been created since the last refresh and are not in the filter"""
+        return self._unseen_after
+
+    def add(self, email):
+        if self.ready:
+            with self._lock:
+                self._filter.add(canonical_email(email))
+
+    def record_false_positive(self):
+        if self.ready:
+            self._counters["false_positives"] += 1
+
+    def stats(self):
+        stats = dict(self._counters)
+        stats["ready"] = self.ready
+        stats["entries"] = self._filter.count if self._filter is not None else 0
+        stats["high_water_id"] = self._high_water_id
+        stats["unseen_after"] = self._unseen_after
+        stats["gaps"] = len(self._gaps)
+        return stats
+
+
+email_filter = EmailFilter()
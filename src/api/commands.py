@@ -1,6 +1,11 @@
 import click
+import csv
+import json
+import sys
 from api.models import db, User
+from api.replica import replica_router
 from flask.cli import with_appcontext
+from sqlalchemy.exc import OperationalError
 
 
 def setup_commands(app):
@@ -98,16 +103,22 @@ def setup_commands(app):
     @click.argument("password")
     @with_appcontext
     def create_admin(email, password):
-        """Create an admin user"""
+        """Create an admin user, or make an existing user an admin"""
         print(f"Creating admin user: {email}")
 
-        # Check if user already exists
-        if User.get_user_by_email(email):
-            print(f"User {email} already exists!")
-            return
-
         try:
+            user = User.get_user_by_email(email)
+            if user:
+                if user.is_admin:
+                    print(f"User {email} is already an admin!")
+                    return
+                user.is_admin = True
+                db.session.commit()
+                print(f"User {email} is now an admin!")
+                return
+
             user = User.create_user(email, password)
+            user.is_admin = True
             db.session.add(user)
             db.session.commit()
             print(f"Admin user {email} created successfully!")
@@ -116,25 +127,60 @@ def setup_commands(app):
             print(f"Error creating admin user: {e}")
 
     @app.cli.command("list-users")
+    @click.option("--format", "fmt", type=click.Choice(["table", "csv", "jsonl"]), default="table")
+    @click.option("--after-id", default=0, help="Only list users with a greater id")
+    @click.option("--batch-size", default=1000, help="Rows fetched per query")
+    @click.option("--primary", is_flag=True, help="Read from the primary even when replicas are configured")
     @with_appcontext
-    def list_users():
-        """List all users in the database"""
+    def list_users(fmt, after_id, batch_size, primary):
+        """List all users in the database, streaming in id order (from a replica when one is healthy)"""
+
+        def routed_rows():
+            key = '' if primary else replica_router.pick_replica()
+            last_id = after_id
+            try:
+                for row in User.iter_rows(after_id, batch_size, bind=replica_router.engine(key) if key else None):
+                    last_id = row.id
+                    yield row
+            except OperationalError:
+                if not key:
+                    raise
+                # Carry on from the primary where the replica stopped
+                db.session.rollback()
+                replica_router.mark_down(key)
+                yield from User.iter_rows(last_id, batch_size)
+
         try:
-            users = User.query.all()
-            if not users:
-                print("No users found in database.")
-                return
+            count = 0
+            writer = csv.writer(sys.stdout) if fmt == "csv" else None
+            if writer:
+                writer.writerow(["id", "email", "is_active", "created_at", "updated_at"])
 
-            print(f"Found {len(users)} users:")
-            print("-" * 50)
-            for user in users:
-                status = "Active" if user.is_active else "Inactive"
-                created = user.created_at.strftime(
-                    "%Y-%m-%d %H:%M:%S") if user.created_at else "Unknown"
-                print(
-                    f"ID: {user.id} | Email: {user.email} | Status: {status} | Created: {created}")
+            for row in routed_rows():
+                count += 1
+                if fmt == "jsonl":
+                    print(json.dumps(User.serialize_fields(row)))
+                elif writer:
+                    user = User.serialize_fields(row)
+                    writer.writerow([user["id"], user["email"], user["is_active"],
+                                     user["created_at"] or "", user["updated_at"] or ""])
+                else:
+                    if count == 1:
+                        print("-" * 50)
+                    status = "Active" if row.is_active else "Inactive"
+                    created = row.created_at.strftime(
+                        "%Y-%m-%d %H:%M:%S") if row.created_at else "Unknown"
+                    print(
+                        f"ID: {row.id} | Email: {row.email} | Status: {status} | Created: {created}")
+
+            if fmt == "table":
+                if not count:
+                    print("No users found in database.")
+                else:
+                    print("-" * 50)
+                    print(f"Listed {count} users.")
         except Exception as e:
-            print(f"Error listing users: {e}")
+            print(f"Error listing users: {e}", file=sys.stderr)
 
     @app.cli.command("delete-user")
     @click.argument("email")
@@ -153,3 +199,264 @@ def setup_commands(app):
         except Exception as e:
             db.session.rollback()
             print(f"Error deleting user: {e}")
+
+    @app.cli.command("import-users")
+    @click.argument("path")
+    @click.option("--format", "fmt", type=click.Choice(["csv", "jsonl"]), default=None,
+                  help="File format (guessed from the extension by default)")
+    @click.option("--chunk-size", default=5000, help="Records per batch")
+    @click.option("--workers", default=None, type=int, help="Hashing processes (defaults to CPU count)")
+    @click.option("--checkpoint", default=None, help="Checkpoint file (defaults to PATH.checkpoint)")
+    @with_appcontext
+    def import_users_command(path, fmt, chunk_size, workers, checkpoint):
+        """Bulk import users from a CSV or JSONL file"""
+        from api.importer import import_users
+
+        print(f"Importing users from {path}...")
+        try:
+            state = import_users(path, fmt=fmt, chunk_size=chunk_size, workers=workers,
+                                 checkpoint_path=checkpoint or f"{path}.checkpoint")
+            print(f"{state['imported']} users imported, {state['skipped']} skipped, "
+                  f"{state['invalid_hashes']} rejected for unsupported password hashes.")
+        except Exception as e:
+            print(f"Error importing users: {e}")
+            print("Run the same command again to resume from the last checkpoint.")
+
+    @app.cli.command("generate-jwt-key")
+    @click.option("--algorithm", type=click.Choice(["EdDSA", "RS256", "ES256"]), default="EdDSA")
+    @click.option("--kid", default=None, help="Key id (defaults to today's date, so newer keys sort last)")
+    @click.option("--keys-dir", default=None, help="Defaults to JWT_KEYS_DIR")
+    def generate_jwt_key(algorithm, kid, keys_dir):
+        """Write a new token signing key to <keys-dir>/<kid>.pem"""
+        import os
+        import time
+        from api.keys import generate_pem
+
+        keys_dir = keys_dir or app.config.get('JWT_KEYS_DIR')
+        if not keys_dir:
+            print("Set JWT_KEYS_DIR or pass --keys-dir.")
+            return
+        kid = kid or time.strftime("%Y-%m-%d")
+        path = os.path.join(keys_dir, f"{kid}.pem")
+        if os.path.exists(path):
+            print(f"{path} already exists.")
+            return
+
+        try:
+            os.makedirs(keys_dir, exist_ok=True)
+            fd = os.open(path, os.O_WRONLY | os.O_CREAT | os.O_EXCL, 0o600)
+            with os.fdopen(fd, "wb") as f:
+                f.write(generate_pem(algorithm))
+            print(f"{algorithm} key written to {path}.")
+            print("Restart the app to start signing with it; keep the old key's public half published until its tokens expire.")
+        except Exception as e:
+            print(f"Error generating key: {e}")
+
+    @app.cli.command("compress-static")
+    @click.option("--min-size", default=1024, help="Skip files smaller than this many bytes")
+    @with_appcontext
+    def compress_static(min_size):
+        """Write precompressed .gz/.br siblings of the front-end files (run after npm run build)"""
+        from api.static_files import static_files
+
+        try:
+            written = static_files.compress(min_size)
+        except Exception as e:
+            print(f"Error compressing static files: {e}")
+            return
+        print(f"{written} precompressed files written to {static_files.directory}.")
+
+    @app.cli.command("bench-auth")
+    @click.argument("iterations", default=1000)
+    @with_appcontext
+    def bench_auth(iterations):
+        """Compare per-request token resolution cost before and after require_auth"""
+        from api.benchmarks import bench_auth_resolution
+
+        results = bench_auth_resolution(int(iterations))
+        if results is None:
+            print("No users found in database. Run insert-test-users first.")
+            return
+
+        print(f"Token resolution over {iterations} iterations:")
+        print("-" * 50)
+        for name, micros in results.items():
+            print(f"{name:<20} {micros:10.1f} us/request")
+
+    @app.cli.command("bench-json")
+    @click.argument("iterations", default=1000)
+    @click.option("--page-size", default=100, help="Users per encoded page")
+    @with_appcontext
+    def bench_json(iterations, page_size):
+        """Compare stdlib jsonify against the fast JSON provider and byte responses"""
+        from api.benchmarks import bench_serialization
+
+        measured = bench_serialization(int(iterations), page_size)
+        if measured is None:
+            print("No users found in database. Run insert-test-users first.")
+            return
+
+        rows, results = measured
+        print(f"Serialization over {iterations} iterations ({rows}-user page, {app.json.backend} backend):")
+        print("-" * 50)
+        for name, micros in results.items():
+            print(f"{name:<24} {micros:10.1f} us/call")
+
+    @app.cli.command("bench-login-lookup")
+    @click.option("--seed", "seed_rows", default=0,
+                  help="Fill the users table up to this many rows first, e.g. 1000000")
+    @click.option("--iterations", default=2000, help="Lookups per measurement")
+    @with_appcontext
+    def bench_login_lookup(seed_rows, iterations):
+        """Show the login lookup's query plan and latency against a large users table
+
+        Writes to the database, so it only runs with BENCH_DATABASE=1.
+        """
+        from api.benchmarks import bench_login_lookup
+
+        if seed_rows:
+            print(f"Seeding users up to {seed_rows} rows (placeholder hashes, no hashing)...")
+        try:
+            total, plans, results = bench_login_lookup(seed_rows, iterations)
+        except Exception as e:
+            print(f"Error benchmarking login lookup: {e}")
+            sys.exit(1)
+
+        for name, plan in plans.items():
+            print("-" * 50)
+            print(f"{name} plan:")
+            for line in plan:
+                print(f"  {line}")
+        print("-" * 50)
+        print(f"Lookup latency over {iterations} random emails in {total} users:")
+        for name, micros in results.items():
+            print(f"{name:<20} {micros:10.1f} us/lookup")
+
+    @app.cli.command("bench-hash")
+    @click.option("--scheme", "schemes", multiple=True,
+                  help="Scheme to measure (repeatable, defaults to every installed one)")
+    @click.option("--cost", "costs", multiple=True, type=int,
+                  help="Cost to measure (repeatable, defaults to each scheme's default)")
+    @click.option("--rounds", default=3, help="Hashes per measurement")
+    @with_appcontext
+    def bench_hash(schemes, costs, rounds):
+        """Measure password hash time per scheme and cost"""
+        from api.benchmarks import bench_password_hashers
+        from api.hashing import available_hashers, hash_executor
+
+        schemes = list(schemes) or available_hashers()
+        print(f"Current scheme: {hash_executor.hasher.method}")
+        print("-" * 50)
+        try:
+            for result in bench_password_hashers(schemes, list(costs), rounds):
+                print(f"{result['method']:<28} hash {result['hash_seconds'] * 1000:8.1f} ms"
+                      f" | verify {result['verify_seconds'] * 1000:8.1f} ms")
+        except Exception as e:
+            print(f"Error benchmarking hashers: {e}")
+
+    @app.cli.command("bench-api")
+    @click.option("--users", default=20, help="Test users to seed through insert-test-users")
+    @click.option("--concurrency", default=8, help="Concurrent client threads")
+    @click.option("--requests", "total_requests", default=2000, help="Total requests across all threads")
+    @click.option("--mix", default=None,
+                  help="Weighted traffic mix, e.g. login=20,protected=80 (operations: signup, login, validate-token, protected, profile)")
+    @click.option("--base-url", default=None, help="Benchmark a running server instead of the app in-process")
+    @click.option("--hash-cost", default=None, type=int, help="Override the password hash cost for this run")
+    @click.option("--rate-limit/--no-rate-limit", default=False,
+                  help="Keep login throttling on (all benchmark traffic comes from one IP)")
+    @click.option("--alloc-requests", default=50, help="Requests per operation for the allocation pass (0 to skip)")
+    @click.option("--output", default=None, help="Write the results to this JSON file")
+    @click.option("--compare", "baseline_path", default=None, help="Compare against a previous JSON baseline")
+    @with_appcontext
+    def bench_api(users, concurrency, total_requests, mix, base_url, hash_cost, rate_limit, alloc_requests,
+                  output, baseline_path):
+        """Load-test the /api endpoints and record a JSON baseline
+
+        Seeds users into this app's database, so it only runs with BENCH_DATABASE=1.
+        """
+        from api.hashing import hash_executor
+        from api.loadtest import DEFAULT_MIX, compare, run_benchmark
+        from api.ratelimit import login_limiter
+
+        if hash_cost:
+            hash_executor.hasher = type(hash_executor.hasher)(hash_cost)
+        login_limiter.enabled = login_limiter.enabled and rate_limit
+
+        print(f"Benchmarking {total_requests} requests with {concurrency} threads...")
+        try:
+            results = run_benchmark(app, users=users, concurrency=concurrency, requests=total_requests,
+                                    mix=mix or DEFAULT_MIX, base_url=base_url, alloc_requests=alloc_requests)
+        except Exception as e:
+            print(f"Error running benchmark: {e}")
+            return
+
+        print("-" * 78)
+        print(f"{'operation':<16}{'count':>7}{'errors':>8}{'req/s':>10}{'p50 ms':>10}{'p95 ms':>10}{'p99 ms':>10}")
+        for name, result in list(results["operations"].items()) + [("total", results["total"])]:
+            print(f"{name:<16}{result['count']:>7}{result['errors']:>8}{result['throughput_rps']:>10}"
+                  f"{result['p50_ms']:>10}{result['p95_ms']:>10}{result['p99_ms']:>10}")
+
+        if baseline_path:
+            with open(baseline_path) as f:
+                baseline = json.load(f)
+            print("-" * 78)
+            print(f"Change vs {baseline_path} ({baseline['meta'].get('commit')}):")
+            for name, changes in compare(baseline, results).items():
+                print(f"{name:<16}" + "  ".join(f"{metric} {value:+.1f}%" for metric, value in changes.items()))
+
+        if output:
+            with open(output, "w") as f:
+                json.dump(results, f, indent=2)
+            print(f"Results written to {output}")
+
+    @app.cli.command("bench-capacity")
+    @click.option("--target", "targets", multiple=True, required=True,
+                  help="label=URL of a running single-worker server (repeatable), e.g. asgi=http://localhost:8002")
+    @click.option("--levels", default="8,32,128,256", help="Concurrent connection counts to ramp through")
+    @click.option("--mix", default=None, help="Weighted traffic mix (defaults to the read-heavy capacity mix)")
+    @click.option("--users", default=20, help="Test users to seed through insert-test-users")
+    @click.option("--requests-per-connection", default=20, help="Requests each connection sends per level")
+    @click.option("--p99-budget-ms", default=500.0, help="Highest p99 latency a sustained level may have")
+    @click.option("--output", default=None, help="Write the results to this JSON file")
+    @with_appcontext
+    def bench_capacity(targets, levels, mix, users, requests_per_connection, p99_budget_ms, output):
+        """Compare how many concurrent connections one WSGI and one ASGI worker sustain
+
+        Start each server with a single worker first, e.g.
+        SERVER_MODE=wsgi gunicorn -c gunicorn.conf.py -w 1 -b :8001 and
+        SERVER_MODE=asgi gunicorn -c gunicorn.conf.py -w 1 -b :8002
+
+        Seeds users into this app's database, which the servers must share, so it only runs with
+        BENCH_DATABASE=1.
+        """
+        from api.loadtest import CAPACITY_MIX, run_capacity
+
+        try:
+            parsed = dict(target.split("=", 1) for target in targets)
+            steps = [int(level) for level in levels.split(",")]
+        except ValueError:
+            print("Error: targets must be label=URL and levels a comma-separated list of numbers")
+            return
+
+        try:
+            results = run_capacity(app, parsed, steps, mix or CAPACITY_MIX, users,
+                                   requests_per_connection, p99_budget_ms)
+        except Exception as e:
+            print(f"Error running capacity benchmark: {e}")
+            return
+
+        print("-" * 78)
+        print(f"{'target':<10}{'conns':>7}{'req/s':>10}{'p50 ms':>10}{'p99 ms':>10}{'errors':>9}  sustained")
+        for label, report in results["targets"].items():
+            for step in report["levels"]:
+                print(f"{label:<10}{step['connections']:>7}{step['throughput_rps']:>10}{step['p50_ms']:>10}"
+                      f"{step['p99_ms']:>10}{step['errors']:>9}  {'yes' if step['sustained'] else 'no'}")
+        print("-" * 78)
+        for label, report in results["targets"].items():
+            print(f"{label}: {report['capacity_connections']} concurrent connections per process "
+                  f"within p99 {p99_budget_ms:g} ms")
+
+        if output:
+            with open(output, "w") as f:
+                json.dump(results, f, indent=2)
+            print(f"Results written to {output}")
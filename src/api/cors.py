@@ -0,0 +1,135 @@
+"""
+CORS as one WSGI layer: header sets are built per allowed origin up front and preflights never reach Flask
+"""
+import re
+import threading
+
+DEFAULT_ORIGINS = (
+    "http://localhost:3000",
+    "https://*.gitpod.io",
+    "https://*.github.dev",
+    # Your specific Codespaces URL (fixed spelling)
+    "https://fuzzy-enigma-q7xp59vrgwggcwx6-3000.app.github.dev",
+)
+ALLOW_METHODS = 'GET,PUT,POST,DELETE,OPTIONS'
+ALLOW_HEADERS = 'Content-Type,Authorization'
+
+
+def compile_wildcards(patterns):
+    """One anchored regex for every 'https://*.example.com' style pattern; '*' spans subdomain labels"""
+    if not patterns:
+        return None
+    alternatives = [re.escape(pattern).replace(r'\*', r'[A-Za-z0-9-]+(?:\.[A-Za-z0-9-]+)*')
+                    for pattern in patterns]
+    return re.compile('|'.join(f'(?:{alternative})' for alternative in alternatives), re.IGNORECASE)
+
+
+class Cors:
+    """Allowed origins from CORS_ORIGINS, applied by wrapping app.wsgi_app"""
+
+    def __init__(self, app=None):
+        self.allow_all = False
+        self.max_age = 600
+        self.credentials = True
+        self._exact = set()
+        self._wildcards = None
+        self._headers = {}
+        self._preflight = {}
+        self._lock = threading.Lock()
+        self.max_cached_origins = 1024
+        if app is not None:
+            self.init_app(app)
+
+    def init_app(self, app):
+        origins = app.config.get('CORS_ORIGINS') or DEFAULT_ORIGINS
+        self.max_age = int(app.config.get('CORS_MAX_AGE', self.max_age))
+        self.credentials = bool(app.config.get('CORS_ALLOW_CREDENTIALS', self.credentials))
+        self.allow_all = '*' in origins
+        self._exact = {origin.lower() for origin in origins if '*' not in origin}
+        self._wildcards = compile_wildcards([origin for origin in origins if '*' in origin and origin != '*'])
+        self._headers = {}
+        self._preflight = {}
+        for origin in self._exact:
+            self._build(origin)
+        app.wsgi_app = CorsMiddleware(app.wsgi_app, self)
+        app.extensions['cors'] = self
+
+    def _build(self, origin):
+        if origin is None:
+            # '*' may not be combined with credentials, so wildcard-only origins go without
+            headers = [('Access-Control-Allow-Origin', '*')]
+        else:
+            headers = [('Access-Control-Allow-Origin', origin), ('Vary', 'Origin')]
+            if self.credentials:
+                headers.append(('Access-Control-Allow-Credentials', 'true'))
+        preflight = headers + [
+            ('Access-Control-Allow-Methods', ALLOW_METHODS),
+            ('Access-Control-Allow-Headers', ALLOW_HEADERS),
+            ('Access-Control-Max-Age', str(self.max_age)),
+            ('Content-Length', '0'),
+        ]
+        with self._lock:
+            if len(self._headers) >= self.max_cached_origins + len(self._exact):
+                # Wildcard matches are cached as seen; start over rather than grow without bound
+                for key in [key for key in self._headers if key not in self._exact]:
+                    self._headers.pop(key, None)
+                    self._preflight.pop(key, None)
+            self._headers[origin] = headers
+            self._preflight[origin] = preflight
+        return headers, preflight
+
+    def _key(self, origin):
+        """The cache key for an Origin header, '' when it is not allowed"""
+        origin = origin.lower()
+        if origin in self._exact:
+            return origin
+        if self._wildcards is not None and self._wildcards.fullmatch(origin):
+            return origin
+        if self.allow_all:
+            return None
+        return ''
+
+    def response_headers(self, origin):
+        """Headers to add to a response for this Origin; empty when the origin is not allowed"""
+        key = self._key(origin)
+        if key == '':
+            return []
+        headers = self._headers.get(key)
+        return headers if headers is not None else self._build(key)[0]
+
+    def preflight_headers(self, origin):
+        key = self._key(origin)
+        if key == '':
+            return None
+        # Read once: another thread's _build may evict the entry between a check and a lookup
+        preflight = self._preflight.get(key)
+        return preflight if preflight is not None else self._build(key)[1]
+
+
+class CorsMiddleware:
+    """Answers preflights itself and appends the precomputed headers to every other response"""
+
+    def __init__(self, wsgi_app, cors):
+        self.wsgi_app = wsgi_app
+        self.cors = cors
+
+    def __call__(self, environ, start_response):
+        origin = environ.get('HTTP_ORIGIN')
+        if not origin:
+            return self.wsgi_app(environ, start_response)
+
+        if environ['REQUEST_METHOD'] == 'OPTIONS' and 'HTTP_ACCESS_CONTROL_REQUEST_METHOD' in environ:
+            start_response('204 No Content', list(self.cors.preflight_headers(origin) or [('Content-Length', '0')]))
+            return [b'']
+
+        headers = self.cors.response_headers(origin)
+        if not headers:
+            return self.wsgi_app(environ, start_response)
+
+        def cors_start_response(status, response_headers, exc_info=None):
+            return start_response(status, response_headers + headers, exc_info)
+
+        return self.wsgi_app(environ, cors_start_response)
+
+
+cors = Cors()
@@ -0,0 +1,170 @@
+"""
+SQLAlchemy engine pool settings from the environment, plus checkout wait and in-use counters
+"""
+import logging
+import os
+import threading
+import time
+import weakref
+from sqlalchemy.exc import TimeoutError as PoolTimeoutError
+from sqlalchemy.pool import NullPool, QueuePool
+
+logger = logging.getLogger(__name__)
+
+
+def _env_bool(name, default):
+    value = os.getenv(name)
+    if value is None or value == '':
+        return default
+    return value.strip().lower() in ('1', 'true', 'yes', 'on')
+
+
+class TimedQueuePool(QueuePool):
+    """QueuePool that records how long checkouts wait for a free connection"""
+
+    def __init__(self, *args, **kwargs):
+        QueuePool.__init__(self, *args, **kwargs)
+        self._stats_lock = threading.Lock()
+        self.checkouts = 0
+        self.timeouts = 0
+        self.wait_seconds = 0.0
+        self.max_wait_seconds = 0.0
+
+    def _do_get(self):
+        started = time.perf_counter()
+        try:
+            return QueuePool._do_get(self)
+        except PoolTimeoutError:
+            with self._stats_lock:
+                self.timeouts += 1
+            raise
+        finally:
+            waited = time.perf_counter() - started
+            with self._stats_lock:
+                self.checkouts += 1
+                self.wait_seconds += waited
+                if waited > self.max_wait_seconds:
+                    self.max_wait_seconds = waited
+
+
+def engine_options(db_url):
+    """Build SQLALCHEMY_ENGINE_OPTIONS from DB_* environment variables"""
+    if not db_url or db_url.startswith('sqlite'):
+        # SQLite picks its own pool; sizing options do not apply
+        return {"pool_pre_ping": _env_bool('DB_POOL_PRE_PING', True)}
+
+    options = {"pool_pre_ping": _env_bool('DB_POOL_PRE_PING', True)}
+    if _env_bool('DB_USE_NULLPOOL', False):
+        # Behind PgBouncer the bouncer does the pooling; hold no connections here
+        options["poolclass"] = NullPool
+    else:
+        options.update({
+            "poolclass": TimedQueuePool,
+            "pool_size": int(os.getenv('DB_POOL_SIZE', 5)),
+            "max_overflow": int(os.getenv('DB_MAX_OVERFLOW', 10)),
+            "pool_timeout": float(os.getenv('DB_POOL_TIMEOUT', 30)),
+            "pool_recycle": int(os.getenv('DB_POOL_RECYCLE', 1800)),
+        })
+
+    statement_timeout = os.getenv('DB_STATEMENT_TIMEOUT_MS')
+    if statement_timeout and db_url.startswith('postgresql'):
+        options["connect_args"] = {
+            "options": f"-c statement_timeout={int(statement_timeout)}"}
+    return options
+
+
+def replica_binds(db_urls):
+    """SQLALCHEMY_BINDS entries replica_0, replica_1, ... for a comma-separated list of replica URLs"""
+    binds = {}
+    for index, db_url in enumerate(url.strip() for url in (db_urls or '').split(',') if url.strip()):
+        if db_url.startswith("postgres://"):
+            db_url = db_url.replace("postgres://", "postgresql://", 1)
+        # Binds do not inherit SQLALCHEMY_ENGINE_OPTIONS, so each gets the same pool settings here
+        options = engine_options(db_url)
+        if db_url.startswith('postgresql'):
+            # A hung replica must fail fast so the read can go to the primary instead
+            options["connect_args"] = {
+                "connect_timeout": int(os.getenv('REPLICA_CONNECT_TIMEOUT', 3)),
+                "options": f"-c statement_timeout={int(os.getenv('REPLICA_STATEMENT_TIMEOUT_MS', 5000))}",
+            }
+        binds[f'replica_{index}'] = {"url": db_url, **options}
+    return binds
+
+
+ASYNC_DRIVERS = {
+    'postgresql': 'postgresql+asyncpg',
+    'sqlite': 'sqlite+aiosqlite',
+}
+
+
+def async_database_url(db_url):
+    """The same database through its async driver, e.g. postgresql:// -> postgresql+asyncpg://"""
+    scheme, sep, rest = db_url.partition('://')
+    dialect = scheme.split('+')[0]
+    if dialect not in ASYNC_DRIVERS:
+        raise ValueError(f"No async driver configured for {scheme}://")
+    return ASYNC_DRIVERS[dialect] + sep + rest
+
+
+def async_engine_options(db_url):
+    """engine_options() for create_async_engine, which needs its own queue pool class"""
+    options = engine_options(db_url)
+    if options.get("poolclass") is TimedQueuePool:
+        del options["poolclass"]
+    connect_args = options.pop("connect_args", None)
+    if connect_args:
+        # asyncpg takes server settings instead of a libpq options string
+        timeout = connect_args["options"].rpartition('=')[2]
+        options["connect_args"] = {"server_settings": {"statement_timeout": timeout}}
+    return options
+
+
+def pool_stats(engine):
+    """Current pool usage; wait counters are only available with TimedQueuePool"""
+    pool = engine.pool
+    stats = {"pool": type(pool).__name__}
+    if isinstance(pool, QueuePool):
+        stats.update({
+            "size": pool.size(),
+            "max_overflow": pool._max_overflow,
+            "in_use": pool.checkedout(),
+            "idle": pool.checkedin(),
+            "overflow": max(pool.overflow(), 0),
+        })
+    if isinstance(pool, TimedQueuePool):
+        with pool._stats_lock:
+            stats.update({
+                "checkouts": pool.checkouts,
+                "timeouts": pool.timeouts,
+                "wait_seconds": pool.wait_seconds,
+                "max_wait_seconds": pool.max_wait_seconds,
+            })
+    return stats
+
+
+# Apps whose pools are replaced after fork; one fork handler serves however many apps are built
+_fork_disposed_apps = weakref.WeakSet()
+
+
+def dispose_engines_after_fork(app):
+    """Give each forked process fresh pools, for gunicorn --preload
+
+    The master may have connected while loading the app; dispose(close=False) drops the inherited
+    connections without closing them, so the sockets stay usable by the parent and no two
+    processes ever talk over the same one.
+    """
+    _fork_disposed_apps.add(app)
+
+
+def _dispose_engines_in_child():
+    for app in list(_fork_disposed_apps):
+        try:
+            with app.app_context():
+                for engine in app.extensions['sqlalchemy'].engines.values():
+                    engine.dispose(close=False)
+        except Exception:
+            logger.exception("Engine dispose after fork error")
+
+
+if hasattr(os, 'register_at_fork'):
+    os.register_at_fork(after_in_child=_dispose_engines_in_child)
@@ -0,0 +1,111 @@
+"""
+Revocation list of access-token jti values, each kept only until the token would expire anyway
+
+Logout records the jti in the revoked_tokens table (api.models.RevokedToken) as well as here, and
+every worker pulls rows revoked since its last look at most every TOKEN_DENYLIST_SYNC_SECONDS, so
+a token logged out on one worker stops working on all of them within that window. Checks
+themselves stay in memory.
+"""
+import calendar
+import heapq
+import logging
+import os
+import threading
+import time
+from datetime import datetime, timedelta
+from flask import has_app_context
+
+logger = logging.getLogger(__name__)
+
+# Rows are re-read this far behind the last sync, for commits that land late or clocks that differ
+SYNC_OVERLAP_SECONDS = 5
+
+
+class TokenDenylist:
+    """jti -> exp, stored as 16-byte keys and purged in expiry order"""
+
+    def __init__(self):
+        self._entries = {}
+        self._expiry_heap = []
+        self._lock = threading.Lock()
+        self._sync_lock = threading.Lock()
+        self.revoked_total = 0
+        self.sync_seconds = 5.0
+        self._synced_at = None
+        self._watermark = None
+
+    def init_app(self, app):
+        self.sync_seconds = float(app.config.get('TOKEN_DENYLIST_SYNC_SECONDS', self.sync_seconds))
+        self._synced_at = None
+        self._watermark = None
+        app.extensions['token_denylist'] = self
+
+    def reset_after_fork(self):
+        self._lock = threading.Lock()
+        self._sync_lock = threading.Lock()
+
+    @staticmethod
+    def _key(jti):
+        try:
+            return bytes.fromhex(jti)
+        except (TypeError, ValueError):
+            return str(jti).encode('utf-8')
+
+    def _purge(self, now):
+        heap = self._expiry_heap
+        while heap and heap[0][0] <= now:
+            exp, key = heapq.heappop(heap)
+            if self._entries.get(key) == exp:
+                del self._entries[key]
+
+    def _add(self, jti, exp):
+        now = time.time()
+        if not jti or exp <= now:
+            return False
+        key = self._key(jti)
+        with self._lock:
+            self._purge(now)
+            self._entries[key] = exp
+            heapq.heappush(self._expiry_heap, (exp, key))
+        return True
+
+    def revoke(self, jti, exp):
+        """Deny a token in this worker until its exp (seconds since the epoch); RevokedToken tells the rest"""
+        if self._add(jti, exp):
+            self.revoked_total += 1
+
+    def sync(self):
+        """Pull tokens revoked by other workers, at most once every sync_seconds"""
+        if self._synced_at is not None and time.monotonic() - self._synced_at < self.sync_seconds:
+            return
+        if not has_app_context() or not self._sync_lock.acquire(blocking=False):
+            return
+        try:
+            from api.models import RevokedToken
+
+            started = datetime.utcnow()
+            since = self._watermark - timedelta(seconds=SYNC_OVERLAP_SECONDS) if self._watermark else None
+            for jti, expires_at in RevokedToken.revoked_since(since):
+                self._add(jti, calendar.timegm(expires_at.timetuple()))
+            self._watermark = started
+        except Exception:
+            # Keep serving from what is already known; the next sync starts from the same watermark
+            logger.exception("Token denylist sync failed")
+        finally:
+            self._synced_at = time.monotonic()
+            self._sync_lock.release()
+
+    def is_revoked(self, jti):
+        self.sync()
+        if not jti or not self._entries:
+            return False
+        exp = self._entries.get(self._key(jti))
+        return exp is not None and exp > time.time()
+
+    def __len__(self):
+        return len(self._entries)
+
+
+token_denylist = TokenDenylist()
+if hasattr(os, 'register_at_fork'):
+    os.register_at_fork(after_in_child=token_denylist.reset_after_fork)
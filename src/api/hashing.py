@@ -0,0 +1,328 @@
+"""
+Runs password hashing on a bounded worker pool so pbkdf2 never blocks the request thread
+"""
+import asyncio
+import hashlib
+import multiprocessing
+import os
+import secrets
+import threading
+import time
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+from werkzeug.security import generate_password_hash, check_password_hash, DEFAULT_PBKDF2_ITERATIONS
+from api.utils import APIException
+from api.metrics import phase_timer
+
+
+class HashingQueueFull(APIException):
+    status_code = 503
+
+    def __init__(self, retry_after):
+        APIException.__init__(self, "Server is busy, please try again shortly")
+        self.headers = {"Retry-After": str(retry_after)}
+
+
+class Pbkdf2Hasher:
+    """werkzeug pbkdf2:sha256; cost is the iteration count"""
+    default_cost = DEFAULT_PBKDF2_ITERATIONS
+
+    def __init__(self, cost=None):
+        self.cost = int(cost or self.default_cost)
+        self.method = f"pbkdf2:sha256:{self.cost}"
+
+    def hash(self, password):
+        return generate_password_hash(password, method=self.method)
+
+    def needs_rehash(self, pwhash):
+        return pwhash.split('$', 1)[0] != self.method
+
+
+class ScryptHasher(Pbkdf2Hasher):
+    """werkzeug scrypt; cost is N (a power of two), with r=8 and p=1"""
+    default_cost = 2 ** 15
+
+    def __init__(self, cost=None):
+        self.cost = int(cost or self.default_cost)
+        self.method = f"scrypt:{self.cost}:8:1"
+
+
+class Argon2Hasher:
+    """argon2id through argon2-cffi; cost is the time cost (passes over memory)"""
+    default_cost = 3
+
+    def __init__(self, cost=None):
+        # Fail at startup rather than on the first login if the package is missing
+        import argon2  # noqa: F401
+        self.cost = int(cost or self.default_cost)
+        self.method = f"argon2id:t={self.cost}"
+
+    def _hasher(self):
+        import argon2
+        return argon2.PasswordHasher(time_cost=self.cost)
+
+    def hash(self, password):
+        return self._hasher().hash(password)
+
+    def needs_rehash(self, pwhash):
+        return not pwhash.startswith('$argon2') or self._hasher().check_needs_rehash(pwhash)
+
+
+PASSWORD_HASHERS = {
+    "pbkdf2": Pbkdf2Hasher,
+    "scrypt": ScryptHasher,
+    "argon2": Argon2Hasher,
+}
+
+
+def register_hasher(name, hasher_class):
+    """Make a hasher selectable through PASSWORD_HASH_SCHEME"""
+    PASSWORD_HASHERS[name] = hasher_class
+
+
+def available_hashers():
+    """Names of hashers whose dependencies are installed"""
+    names = []
+    for name, hasher_class in PASSWORD_HASHERS.items():
+        try:
+            hasher_class()
+        except ImportError:
+            continue
+        names.append(name)
+    return names
+
+
+def verify_password(pwhash, password):
+    """Check a password against any supported stored hash, whatever parameters it was made with"""
+    if pwhash.startswith('$argon2'):
+        import argon2
+        try:
+            return argon2.PasswordHasher().verify(pwhash, password)
+        except argon2.exceptions.VerificationError:
+            return False
+        except argon2.exceptions.InvalidHashError:
+            return False
+    return check_password_hash(pwhash, password)
+
+
+def is_supported_hash(pwhash):
+    """True when verify_password can check this stored hash: werkzeug pbkdf2/scrypt, or argon2 when installed
+
+    Only parses the method and fields, so it is cheap enough to run on every imported row.
+    """
+    if not isinstance(pwhash, str):
+        return False
+    if pwhash.startswith('$argon2'):
+        try:
+            import argon2
+        except ImportError:
+            return False
+        try:
+            argon2.extract_parameters(pwhash)
+        except argon2.exceptions.InvalidHashError:
+            return False
+        return True
+    method, _, rest = pwhash.partition('$')
+    salt, _, digest = rest.partition('$')
+    if not salt or not digest or '$' in digest:
+        return False
+    try:
+        int(digest, 16)
+    except ValueError:
+        return False
+    name, *args = method.split(':')
+    if name == 'pbkdf2':
+        return len(args) <= 2 and (not args or args[0] in hashlib.algorithms_available) \
+            and all(arg.isdigit() for arg in args[1:])
+    if name == 'scrypt':
+        return len(args) in (0, 3) and all(arg.isdigit() for arg in args)
+    return False
+
+
+def default_workers():
+    """One hashing process per CPU across all gunicorn workers (WEB_CONCURRENCY), each of which has a pool"""
+    return max(1, (os.cpu_count() or 1) // max(int(os.getenv('WEB_CONCURRENCY') or 1), 1))
+
+
+def _pool_context():
+    # Pool processes start from a clean interpreter rather than a fork of a worker with live
+    # threads and database connections; forkserver keeps that cheap where the platform has it
+    method = 'forkserver' if 'forkserver' in multiprocessing.get_all_start_methods() else 'spawn'
+    return multiprocessing.get_context(method)
+
+
+def _timed_call(func, *args):
+    """Run func in the worker and report when it started and how long it took"""
+    started = time.monotonic()
+    result = func(*args)
+    return result, started, time.monotonic() - started
+
+
+class HashExecutor:
+    """Hashing pool with a queue-depth limit, configured like any other Flask extension"""
+
+    def __init__(self, app=None):
+        self.hasher = Pbkdf2Hasher()
+        self._dummy_hash = None
+        self.mode = 'inline'
+        self.max_workers = 1
+        self.queue_depth = 0
+        self.retry_after = 1
+        self._executor = None
+        self._slots = None
+        self._lock = threading.Lock()
+        self._in_flight = 0
+        self._counters = {
+            "completed": 0,
+            "rejected": 0,
+            "queue_wait_seconds": 0.0,
+            "hash_seconds": 0.0,
+        }
+        if app is not None:
+            self.init_app(app)
+
+    def init_app(self, app):
+        scheme = app.config.get('PASSWORD_HASH_SCHEME', 'pbkdf2')
+        if scheme not in PASSWORD_HASHERS:
+            raise ValueError(f"Unknown PASSWORD_HASH_SCHEME: {scheme}")
+        self.hasher = PASSWORD_HASHERS[scheme](app.config.get('PASSWORD_HASH_COST'))
+        self.mode = app.config.get('HASH_EXECUTOR', 'process')
+        self.max_workers = int(app.config.get(
+            'HASH_WORKERS') or default_workers())
+        self.queue_depth = int(app.config.get(
+            'HASH_QUEUE_DEPTH', self.max_workers * 4))
+        self.retry_after = int(app.config.get('HASH_RETRY_AFTER', 1))
+        self._slots = threading.BoundedSemaphore(
+            self.max_workers + self.queue_depth)
+        self.shutdown()
+        app.extensions['hash_executor'] = self
+
+    def shutdown(self):
+        """Let go of the pool; the next job starts a new one with the current settings"""
+        with self._lock:
+            executor, self._executor = self._executor, None
+        if executor is not None:
+            executor.shutdown(wait=False)
+
+    def _get_executor(self):
+        # Created on first use so gunicorn workers each get their own pool after fork
+        if self._executor is None:
+            with self._lock:
+                if self._executor is None:
+                    if self.mode == 'thread':
+                        self._executor = ThreadPoolExecutor(
+                            max_workers=self.max_workers, thread_name_prefix='hash')
+                    else:
+                        self._executor = ProcessPoolExecutor(
+                            max_workers=self.max_workers, mp_context=_pool_context())
+        return self._executor
+
+    def _record(self, wait, elapsed):
+        with self._lock:
+            self._counters["completed"] += 1
+            self._counters["queue_wait_seconds"] += wait
+            self._counters["hash_seconds"] += elapsed
+
+    def run(self, func, *args):
+        """Run a hashing function on the pool, shedding load when the queue is full"""
+        with phase_timer('hash'):
+            return self._run(func, *args)
+
+    def _acquire_slot(self):
+        if not self._slots.acquire(blocking=False):
+            with self._lock:
+                self._counters["rejected"] += 1
+            raise HashingQueueFull(self.retry_after)
+        with self._lock:
+            self._in_flight += 1
+
+    def _release_slot(self):
+        with self._lock:
+            self._in_flight -= 1
+        self._slots.release()
+
+    def _run(self, func, *args):
+        if self.mode == 'inline' or self._slots is None:
+            result, started, elapsed = _timed_call(func, *args)
+            self._record(0.0, elapsed)
+            return result
+
+        self._acquire_slot()
+        submitted = time.monotonic()
+        try:
+            future = self._get_executor().submit(_timed_call, func, *args)
+            result, started, elapsed = future.result()
+        finally:
+            self._release_slot()
+
+        self._record(max(started - submitted, 0.0), elapsed)
+        return result
+
+    async def run_async(self, func, *args):
+        """run() for the ASGI app: awaits the pool so the event loop keeps serving other requests"""
+        with phase_timer('hash'):
+            return await self._run_async(func, *args)
+
+    async def _run_async(self, func, *args):
+        if self.mode == 'inline' or self._slots is None:
+            # Inline hashing would stall the loop, so borrow its default thread pool
+            result, started, elapsed = await asyncio.get_running_loop().run_in_executor(
+                None, _timed_call, func, *args)
+            self._record(0.0, elapsed)
+            return result
+
+        self._acquire_slot()
+        submitted = time.monotonic()
+        try:
+            future = self._get_executor().submit(_timed_call, func, *args)
+            result, started, elapsed = await asyncio.wrap_future(future)
+        finally:
+            self._release_slot()
+
+        self._record(max(started - submitted, 0.0), elapsed)
+        return result
+
+    def hash_password(self, password):
+        """Hash a password with the current scheme and cost"""
+        return self.run(self.hasher.hash, password)
+
+    def verify_password(self, pwhash, password):
+        """Check a password against a stored hash"""
+        return self.run(verify_password, pwhash, password)
+
+    def needs_rehash(self, pwhash):
+        """True when a stored hash was made with another scheme or cost than the current one"""
+        return self.hasher.needs_rehash(pwhash)
+
+    def verify_dummy(self, password):
+        """Spend the same hashing cost as a real check, for logins that have no user to check against"""
+        if self._dummy_hash is None or self.needs_rehash(self._dummy_hash):
+            self._dummy_hash = self.run(self.hasher.hash, secrets.token_hex(16))
+        self.verify_password(self._dummy_hash, password)
+        return False
+
+    async def verify_password_async(self, pwhash, password):
+        return await self.run_async(verify_password, pwhash, password)
+
+    async def verify_dummy_async(self, password):
+        if self._dummy_hash is None or self.needs_rehash(self._dummy_hash):
+            self._dummy_hash = await self.run_async(self.hasher.hash, secrets.token_hex(16))
+        await self.verify_password_async(self._dummy_hash, password)
+        return False
+
+    def queued(self):
+        """Number of hashing jobs waiting for a free worker"""
+        return max(self._in_flight - self.max_workers, 0)
+
+    def stats(self):
+        with self._lock:
+            stats = dict(self._counters)
+            stats["in_flight"] = self._in_flight
+        stats["mode"] = self.mode
+        stats["scheme"] = self.hasher.method
+        stats["workers"] = self.max_workers
+        stats["queue_limit"] = self.queue_depth
+        stats["queued"] = self.queued()
+        return stats
+
+
+hash_executor = HashExecutor()
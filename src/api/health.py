@@ -0,0 +1,96 @@
+"""
+Readiness checks for the load balancer, with the database probe cached between polls
+"""
+import threading
+import time
+from sqlalchemy import text
+from api.db_pool import pool_stats
+from api.hashing import hash_executor
+from api.models import db
+
+
+class ReadinessProbe:
+    """Decides whether this node should receive traffic; one DB probe per READY_CACHE_SECONDS"""
+
+    def __init__(self, app=None):
+        self.cache_seconds = 5.0
+        self.max_pool_saturation = 0.9
+        self._lock = threading.Lock()
+        self._last_probe = None
+        if app is not None:
+            self.init_app(app)
+
+    def init_app(self, app):
+        self.cache_seconds = float(app.config.get(
+            'READY_CACHE_SECONDS', self.cache_seconds))
+        self.max_pool_saturation = float(app.config.get(
+            'READY_MAX_POOL_SATURATION', self.max_pool_saturation))
+        app.extensions['readiness_probe'] = self
+
+    def _probe_database(self):
+        started = time.perf_counter()
+        try:
+            with db.engine.connect() as connection:
+                connection.execute(text("SELECT 1"))
+            return {"ok": True, "latency_ms": round((time.perf_counter() - started) * 1000, 2)}
+        except Exception as e:
+            return {"ok": False, "error": str(e).splitlines()[0]}
+
+    def database(self):
+        """Cached DB probe; concurrent polls reuse the last result instead of queueing up"""
+        now = time.monotonic()
+        last = self._last_probe
+        if last is not None and now - last["checked_at"] < self.cache_seconds:
+            return last
+        if not self._lock.acquire(blocking=False):
+            # Another thread is probing right now
+            if last is not None:
+                return last
+            self._lock.acquire()
+        try:
+            if self._last_probe is not last:
+                return self._last_probe
+            result = self._probe_database()
+            result["checked_at"] = time.monotonic()
+            self._last_probe = result
+            return result
+        finally:
+            self._lock.release()
+
+    def pool(self):
+        stats = pool_stats(db.engine)
+        capacity = stats.get("size", 0) + max(stats.get("max_overflow", 0), 0)
+        stats["saturation"] = round(stats["in_use"] / capacity, 3) if capacity else 0.0
+        stats["ok"] = stats["saturation"] < self.max_pool_saturation
+        return stats
+
+    def hashing(self):
+        stats = hash_executor.stats()
+        stats["ok"] = stats["queue_limit"] == 0 or stats["queued"] < stats["queue_limit"]
+        return stats
+
+    def report(self):
+        """Return (ready, checks)"""
+        pool = self.pool()
+        if pool["ok"]:
+            database = self.database()
+        else:
+            # Do not wait for a connection just to probe; a saturated pool already means drain
+            database = self._last_probe or {"ok": False, "error": "pool saturated"}
+        hashing = self.hashing()
+
+        checks = {
+            "database": {key: value for key, value in database.items() if key != "checked_at"},
+            "pool": pool,
+            "hashing": {
+                "ok": hashing["ok"],
+                "queued": hashing["queued"],
+                "queue_limit": hashing["queue_limit"],
+                "in_flight": hashing["in_flight"],
+            },
+        }
+        ready = all(check["ok"] for check in checks.values())
+        return ready, checks
+
+
+readiness_probe = ReadinessProbe()
@@ -0,0 +1,179 @@
+"""
+Streaming bulk import of users from CSV or JSONL files, used by the import-users command
+"""
+import csv
+import io
+import json
+import os
+import time
+from concurrent.futures import ProcessPoolExecutor
+from datetime import datetime
+from itertools import islice
+from api.models import db, User
+from api.hashing import hash_executor, is_supported_hash
+
+COPY_COLUMNS = ('email', 'password', 'is_active', 'created_at', 'updated_at')
+
+
+def read_records(path, fmt=None):
+    """Yield one dict per user record without loading the whole file; an unparseable JSONL line yields None"""
+    fmt = fmt or ('jsonl' if path.endswith(('.jsonl', '.ndjson')) else 'csv')
+    with open(path, newline='', encoding='utf-8') as f:
+        if fmt == 'jsonl':
+            for line in f:
+                line = line.strip()
+                if line:
+                    try:
+                        yield json.loads(line)
+                    except ValueError:
+                        yield None
+        else:
+            yield from csv.DictReader(f)
+
+
+def chunked(iterable, size):
+    iterator = iter(iterable)
+    while True:
+        chunk = list(islice(iterator, size))
+        if not chunk:
+            return
+        yield chunk
+
+
+def _parse_bool(value):
+    if isinstance(value, bool):
+        return value
+    if value is None or value == '':
+        return True
+    return str(value).strip().lower() in ('1', 'true', 't', 'yes', 'y')
+
+
+def load_checkpoint(path):
+    if not path or not os.path.exists(path):
+        return None
+    with open(path) as f:
+        return json.load(f)
+
+
+def save_checkpoint(path, state):
+    """Write the checkpoint atomically so a crash never leaves it half written"""
+    tmp_path = f"{path}.tmp"
+    with open(tmp_path, 'w') as f:
+        json.dump(state, f)
+    os.replace(tmp_path, path)
+
+
+def existing_emails(emails):
+    """Return which of the given emails are already registered, in one query"""
+    rows = db.session.connection().execute(
+        db.select(User.email_canonical).where(User.email_canonical.in_(emails)))
+    return {row[0] for row in rows}
+
+
+def insert_rows(rows):
+    """Insert a batch with COPY on PostgreSQL, executemany everywhere else"""
+    connection = db.session.connection()
+    if connection.dialect.name == 'postgresql':
+        cursor = connection.connection.cursor()
+        if hasattr(cursor, 'copy_expert'):
+            buffer = io.StringIO()
+            writer = csv.writer(buffer)
+            for row in rows:
+                writer.writerow([row[column] for column in COPY_COLUMNS])
+            buffer.seek(0)
+            cursor.copy_expert(
+                f"COPY users ({', '.join(COPY_COLUMNS)}) FROM STDIN WITH (FORMAT csv)", buffer)
+            return
+    connection.execute(db.insert(User.__table__), rows)
+
+
+def prepare_chunk(records, pool, workers):
+    """Normalize, de-duplicate and hash one chunk; returns (rows, skipped, invalid_hashes)
+
+    A password_hash that verify_password could not check (bcrypt, truncated, unknown method) would
+    make every login for that user fail with a 500, so those rows are rejected and counted instead.
+    """
+    candidates = {}
+    skipped = 0
+    invalid_hashes = 0
+    for record in records:
+        if not isinstance(record, dict):
+            skipped += 1
+            continue
+        email = record.get('email')
+        email = email.strip().lower() if isinstance(email, str) else ''
+        password, password_hash = record.get('password'), record.get('password_hash')
+        if not email or email in candidates or not (password or password_hash) \
+                or (not password_hash and not isinstance(password, str)):
+            skipped += 1
+            continue
+        if password_hash and not is_supported_hash(password_hash):
+            invalid_hashes += 1
+            continue
+        candidates[email] = record
+
+    if candidates:
+        for email in existing_emails(list(candidates)):
+            del candidates[email]
+            skipped += 1
+
+    # Hashes exported from the old IdP in werkzeug format are kept as they are
+    to_hash = [email for email, record in candidates.items()
+               if not record.get('password_hash')]
+    hashed = dict(zip(to_hash, pool.map(
+        hash_executor.hasher.hash,
+        [candidates[email]['password'] for email in to_hash],
+        chunksize=max(len(to_hash) // (workers * 4), 1))))
+
+    now = datetime.utcnow()
+    rows = [{
+        "email": email,
+        "password": hashed.get(email) or record['password_hash'],
+        "is_active": _parse_bool(record.get('is_active')),
+        "created_at": now,
+        "updated_at": now,
+    } for email, record in candidates.items()]
+    return rows, skipped, invalid_hashes
+
+
+def import_users(path, fmt=None, chunk_size=5000, workers=None, checkpoint_path=None):
+    """Stream users from a file into the database, resuming from checkpoint_path if present"""
+    state = {"path": os.path.abspath(path), "records_done": 0,
+             "imported": 0, "skipped": 0, "invalid_hashes": 0}
+    previous = load_checkpoint(checkpoint_path)
+    if previous and previous.get("path") == state["path"]:
+        state = previous
+        print(f"Resuming after {state['records_done']} records...")
+
+    records = islice(read_records(path, fmt), state["records_done"], None)
+    workers = workers or os.cpu_count() or 1
+    started = time.perf_counter()
+    processed = 0
+
+    with ProcessPoolExecutor(max_workers=workers) as pool:
+        for chunk in chunked(records, chunk_size):
+            rows, skipped, invalid_hashes = prepare_chunk(chunk, pool, workers)
+            try:
+                if rows:
+                    insert_rows(rows)
+                db.session.commit()
+            except Exception:
+                db.session.rollback()
+                raise
+
+            processed += len(chunk)
+            state["records_done"] += len(chunk)
+            state["imported"] += len(rows)
+            state["skipped"] += skipped
+            state["invalid_hashes"] = state.get("invalid_hashes", 0) + invalid_hashes
+            if checkpoint_path:
+                save_checkpoint(checkpoint_path, state)
+
+            elapsed = time.perf_counter() - started
+            print(f"{state['records_done']} records read, {state['imported']} imported, "
+                  f"{state['skipped']} skipped, {state['invalid_hashes']} rejected for unsupported "
+                  f"password hashes ({processed / elapsed:,.0f} rows/sec)")
+
+    if checkpoint_path and os.path.exists(checkpoint_path):
+        os.remove(checkpoint_path)
+    return state
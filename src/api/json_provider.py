@@ -0,0 +1,84 @@
+"""
+Flask JSON provider that encodes with orjson when it is installed, falling back to the stdlib json module
+"""
+import json
+from datetime import date
+from flask import current_app
+from flask.json.provider import DefaultJSONProvider
+
+try:
+    import orjson
+except ImportError:  # optional; responses are then encoded by the stdlib
+    orjson = None
+
+
+def _iso_default(o):
+    """stdlib fallback for iso_datetimes: format dates the way orjson does natively"""
+    if isinstance(o, date):
+        return o.isoformat()
+    return DefaultJSONProvider.default(o)
+
+
+class FastJSONProvider(DefaultJSONProvider):
+    """Same output types as Flask's provider, but responses are built from UTF-8 bytes directly"""
+
+    def __init__(self, app):
+        super().__init__(app)
+        self.backend = 'orjson' if orjson is not None else 'json'
+
+    def _orjson_option(self, indent, iso_datetimes):
+        option = orjson.OPT_NON_STR_KEYS
+        if not iso_datetimes:
+            # Hand dates to self.default so they keep Flask's HTTP-date format
+            option |= orjson.OPT_PASSTHROUGH_DATETIME
+        if self.sort_keys:
+            option |= orjson.OPT_SORT_KEYS
+        if indent:
+            option |= orjson.OPT_INDENT_2
+        return option
+
+    def dumps_bytes(self, obj, indent=False, iso_datetimes=False):
+        """Encode obj to UTF-8 JSON bytes
+
+        With iso_datetimes, datetime values are written as ISO 8601 (what User.serialize_fields
+        produces), so callers can pass raw rows and skip the per-field isoformat() calls.
+        """
+        default = _iso_default if iso_datetimes else self.default
+        if orjson is not None:
+            try:
+                return orjson.dumps(obj, default=default,
+                                    option=self._orjson_option(indent, iso_datetimes))
+            except orjson.JSONEncodeError:
+                # e.g. integers wider than 64 bits; let the stdlib have a go before failing
+                pass
+        return json.dumps(obj, default=default, ensure_ascii=self.ensure_ascii,
+                          sort_keys=self.sort_keys, indent=2 if indent else None,
+                          separators=None if indent else (',', ':')).encode('utf-8')
+
+    def dumps(self, obj, **kwargs):
+        if kwargs or orjson is None:
+            return super().dumps(obj, **kwargs)
+        return self.dumps_bytes(obj).decode('utf-8')
+
+    def loads(self, s, **kwargs):
+        if kwargs or orjson is None:
+            return super().loads(s, **kwargs)
+        return orjson.loads(s)
+
+    def _indent(self):
+        return self.compact is False or (self.compact is None and self._app.debug)
+
+    def response(self, *args, **kwargs):
+        obj = self._prepare_response_obj(args, kwargs)
+        return self.bytes_response(self.dumps_bytes(obj, indent=self._indent()))
+
+    def bytes_response(self, body, status=200):
+        """Wrap already-encoded JSON bytes in a response without decoding them again"""
+        return self._app.response_class(body + b'\n', status=status, mimetype=self.mimetype)
+
+
+def json_response(obj, status=200, iso_datetimes=False):
+    """jsonify for hot endpoints: encodes straight to bytes through the app's provider"""
+    provider = current_app.json
+    body = provider.dumps_bytes(obj, indent=provider._indent(), iso_datetimes=iso_datetimes)
+    return provider.bytes_response(body, status)
@@ -0,0 +1,167 @@
+"""
+Token signing keys: loaded and parsed once, selected by kid, and published as a JWKS
+"""
+import hashlib
+import json
+import os
+import jwt
+
+
+def _algorithm_for(key):
+    """Pick the JWS algorithm that matches a parsed private or public key"""
+    from cryptography.hazmat.primitives.asymmetric import ec, ed25519, rsa
+
+    if isinstance(key, (ed25519.Ed25519PrivateKey, ed25519.Ed25519PublicKey)):
+        return 'EdDSA'
+    if isinstance(key, (rsa.RSAPrivateKey, rsa.RSAPublicKey)):
+        return 'RS256'
+    if isinstance(key, (ec.EllipticCurvePrivateKey, ec.EllipticCurvePublicKey)):
+        return 'ES256'
+    raise ValueError(f"Unsupported signing key type: {type(key).__name__}")
+
+
+def load_pem(path):
+    """Parse a PEM file into (private_key or None, public_key)"""
+    from cryptography.hazmat.primitives import serialization
+
+    with open(path, 'rb') as f:
+        data = f.read()
+    if b'PRIVATE KEY' in data:
+        private_key = serialization.load_pem_private_key(data, password=None)
+        return private_key, private_key.public_key()
+    return None, serialization.load_pem_public_key(data)
+
+
+def generate_pem(algorithm='EdDSA'):
+    """New private key in PKCS8 PEM, for `flask generate-jwt-key`"""
+    from cryptography.hazmat.primitives import serialization
+    from cryptography.hazmat.primitives.asymmetric import ec, ed25519, rsa
+
+    if algorithm == 'EdDSA':
+        key = ed25519.Ed25519PrivateKey.generate()
+    elif algorithm == 'RS256':
+        key = rsa.generate_private_key(public_exponent=65537, key_size=2048)
+    elif algorithm == 'ES256':
+        key = ec.generate_private_key(ec.SECP256R1())
+    else:
+        raise ValueError(f"Unsupported algorithm: {algorithm}")
+    return key.private_bytes(
+        serialization.Encoding.PEM,
+        serialization.PrivateFormat.PKCS8,
+        serialization.NoEncryption())
+
+
+class KeyManager:
+    """Signs with the active key and verifies with any published one
+
+    Keys live in JWT_KEYS_DIR as <kid>.pem. Private keys can sign; public-only
+    files are retired keys kept so tokens they signed still verify until they
+    expire. The active kid is JWT_ACTIVE_KID, or the last private key by name.
+    Without a keys directory tokens fall back to HS256 with JWT_SECRET_KEY and
+    the JWKS is empty.
+    """
+
+    def __init__(self, app=None):
+        self.algorithm = 'HS256'
+        self.issuer = None
+        self.jwks_max_age = 3600
+        self._secret = None
+        self._signing_key = None
+        self._kid = None
+        self._verifying_keys = {}
+        self._jwks_body = b'{"keys": []}'
+        self._jwks_etag = None
+        if app is not None:
+            self.init_app(app)
+
+    def init_app(self, app):
+        self._secret = app.config.get('JWT_SECRET_KEY')
+        self.issuer = app.config.get('JWT_ISSUER') or None
+        self.jwks_max_age = int(app.config.get('JWKS_MAX_AGE', self.jwks_max_age))
+        keys_dir = app.config.get('JWT_KEYS_DIR')
+        if keys_dir:
+            self.load(keys_dir, app.config.get('JWT_ACTIVE_KID'))
+        else:
+            self.algorithm = 'HS256'
+            self._signing_key = self._secret
+            self._kid = None
+            self._verifying_keys = {}
+            self._publish([])
+        app.extensions['key_manager'] = self
+
+    def load(self, keys_dir, active_kid=None):
+        """Parse every <kid>.pem in keys_dir; raises if there is nothing to sign with"""
+        try:
+            import cryptography  # noqa: F401
+        except ImportError:
+            raise RuntimeError("JWT_KEYS_DIR is set but the 'cryptography' package is not installed")
+
+        private_keys = {}
+        verifying_keys = {}
+        for name in sorted(os.listdir(keys_dir)):
+            if not name.endswith('.pem'):
+                continue
+            kid = name[:-len('.pem')]
+            private_key, public_key = load_pem(os.path.join(keys_dir, name))
+            verifying_keys[kid] = (public_key, _algorithm_for(public_key))
+            if private_key is not None:
+                private_keys[kid] = private_key
+
+        if not private_keys:
+            raise RuntimeError(f"No private signing key found in {keys_dir}")
+        kid = active_kid or sorted(private_keys)[-1]
+        if kid not in private_keys:
+            raise RuntimeError(f"JWT_ACTIVE_KID {kid} has no private key in {keys_dir}")
+
+        self._signing_key = private_keys[kid]
+        self._kid = kid
+        self.algorithm = verifying_keys[kid][1]
+        self._verifying_keys = verifying_keys
+        self._publish(verifying_keys.items())
+
+    def _publish(self, keys):
+        jwks = []
+        for kid, (public_key, algorithm) in keys:
+            jwk = jwt.get_algorithm_by_name(algorithm).to_jwk(public_key, as_dict=True)
+            jwk.update(kid=kid, alg=algorithm, use='sig')
+            jwks.append(jwk)
+        self._jwks_body = json.dumps({"keys": jwks}, sort_keys=True).encode('utf-8')
+        self._jwks_etag = hashlib.sha256(self._jwks_body).hexdigest()[:32]
+
+    @property
+    def kid(self):
+        return self._kid
+
+    def encode(self, payload):
+        if self.issuer:
+            payload = dict(payload, iss=self.issuer)
+        headers = {'kid': self._kid} if self._kid else None
+        return jwt.encode(payload, self._signing_key, algorithm=self.algorithm, headers=headers)
+
+    def decode(self, token):
+        """Verify a token against the key named by its kid; raises jwt.InvalidTokenError"""
+        if self._kid is None:
+            key, algorithm = self._secret, 'HS256'
+        else:
+            kid = jwt.get_unverified_header(token).get('kid')
+            if kid not in self._verifying_keys:
+                raise jwt.InvalidTokenError(f"Unknown signing key: {kid}")
+            key, algorithm = self._verifying_keys[kid]
+        options = {'require': ['exp']}
+        if self.issuer:
+            options['require'].append('iss')
+        return jwt.decode(token, key, algorithms=[algorithm], issuer=self.issuer, options=options)
+
+    def jwks(self):
+        """(body bytes, etag) of the public key set, built once per key load"""
+        return self._jwks_body, self._jwks_etag
+
+    def stats(self):
+        return {
+            "algorithm": self.algorithm,
+            "active_kid": self._kid,
+            "published_keys": len(self._verifying_keys),
+        }
+
+
+key_manager = KeyManager()
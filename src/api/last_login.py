@@ -0,0 +1,142 @@
+"""
+Coalesces successful logins in memory and writes last-login times in batches off the request thread
+"""
+import atexit
+import logging
+import os
+import threading
+from datetime import datetime
+from sqlalchemy.exc import IntegrityError
+
+logger = logging.getLogger(__name__)
+
+
+class LastLoginRecorder:
+    """Keeps the newest login time per user and flushes them every LAST_LOGIN_FLUSH_INTERVAL seconds"""
+
+    def __init__(self, app=None):
+        self.app = None
+        self.interval = 5.0
+        self._pending = {}
+        self._lock = threading.Lock()
+        self._stop = threading.Event()
+        self._thread = None
+        self._pid = None
+        self._counters = {"recorded": 0, "flushes": 0, "rows_written": 0, "errors": 0}
+        if app is not None:
+            self.init_app(app)
+
+    def init_app(self, app):
+        self.app = app
+        self.interval = float(app.config.get(
+            'LAST_LOGIN_FLUSH_INTERVAL', self.interval))
+        app.extensions['last_login_recorder'] = self
+
+    def record(self, user_id, when=None):
+        """Remember a login; many logins by the same user collapse into one write"""
+        when = when or datetime.utcnow()
+        with self._lock:
+            previous = self._pending.get(user_id)
+            if previous is None or when > previous:
+                self._pending[user_id] = when
+            self._counters["recorded"] += 1
+        self._ensure_thread()
+
+    def _ensure_thread(self):
+        # Threads do not survive fork, so each gunicorn worker starts its own flusher
+        if self._thread is not None and self._pid == os.getpid():
+            return
+        with self._lock:
+            if self._thread is not None and self._pid == os.getpid():
+                return
+            self._pid = os.getpid()
+            self._stop = threading.Event()
+            self._thread = threading.Thread(
+                target=self._run, name='last-login-flusher', daemon=True)
+            self._thread.start()
+
+    def _run(self):
+        while not self._stop.wait(self.interval):
+            self.flush()
+
+    def flush(self):
+        """Write all pending login times in one statement"""
+        with self._lock:
+            pending, self._pending = self._pending, {}
+        if not pending or self.app is None:
+            return 0
+
+        rows = [{"user_id": user_id, "last_login_at": when}
+                for user_id, when in pending.items()]
+        try:
+            with self.app.app_context():
+                _write_last_logins(rows)
+        except Exception:
+            # Put the batch back so the next flush retries it
+            with self._lock:
+                for user_id, when in pending.items():
+                    newer = self._pending.get(user_id)
+                    if newer is None or when > newer:
+                        self._pending[user_id] = when
+                self._counters["errors"] += 1
+            logger.exception("Last login flush error")
+            return 0
+
+        with self._lock:
+            self._counters["flushes"] += 1
+            self._counters["rows_written"] += len(rows)
+        return len(rows)
+
+    def shutdown(self):
+        """Stop the flusher and drain whatever is still pending"""
+        self._stop.set()
+        if self._thread is not None and self._pid == os.getpid():
+            self._thread.join(timeout=self.interval + 1)
+        self.flush()
+
+    def stats(self):
+        with self._lock:
+            stats = dict(self._counters)
+            stats["pending"] = len(self._pending)
+        stats["interval"] = self.interval
+        return stats
+
+
+def _write_last_logins(rows):
+    from api.models import db, UserLogin
+
+    table = UserLogin.__table__
+    dialect = db.engine.dialect.name
+    if dialect == 'postgresql':
+        from sqlalchemy.dialects.postgresql import insert
+        newest = db.func.greatest
+    elif dialect == 'sqlite':
+        from sqlalchemy.dialects.sqlite import insert
+        newest = db.func.max
+    else:
+        for row in rows:
+            db.session.merge(UserLogin(**row))
+        db.session.commit()
+        return
+
+    stmt = insert(table)
+    stmt = stmt.on_conflict_do_update(
+        index_elements=[table.c.user_id],
+        set_={"last_login_at": newest(
+            table.c.last_login_at, stmt.excluded.last_login_at)}
+    )
+    try:
+        with db.engine.begin() as conn:
+            conn.execute(stmt, rows)
+    except IntegrityError:
+        # A user was deleted since logging in; write the rest row by row
+        for row in rows:
+            try:
+                with db.engine.begin() as conn:
+                    conn.execute(stmt, [row])
+            except IntegrityError:
+                pass
+
+
+last_login_recorder = LastLoginRecorder()
+atexit.register(last_login_recorder.shutdown)
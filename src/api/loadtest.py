@@ -0,0 +1,294 @@
+"""
+Load-test harness for the /api endpoints, run through `flask bench-api`
+
+Seeds users with the insert-test-users command, drives a weighted mix of
+signup/login/validate-token/protected/profile traffic from N threads, and
+writes throughput, latency percentiles and allocation figures to a JSON
+baseline that later runs can be compared against.
+"""
+import json
+import http.client
+import os
+import platform
+import random
+import subprocess
+import threading
+import time
+import tracemalloc
+import uuid
+from urllib.parse import urlsplit
+from api.models import db
+
+TEST_PASSWORD = "123456"
+DEFAULT_MIX = "signup=5,login=15,validate-token=30,protected=30,profile=20"
+OPERATIONS = ("signup", "login", "validate-token", "protected", "profile")
+
+
+def parse_mix(spec):
+    """'login=20,protected=80' -> {'login': 20, 'protected': 80}"""
+    mix = {}
+    for part in spec.split(','):
+        name, _, weight = part.strip().partition('=')
+        if name not in OPERATIONS:
+            raise ValueError(f"Unknown operation in mix: {name}")
+        mix[name] = int(weight or 1)
+    return {name: weight for name, weight in mix.items() if weight > 0}
+
+
+def percentile(sorted_values, fraction):
+    if not sorted_values:
+        return None
+    index = min(int(round(fraction * (len(sorted_values) - 1))), len(sorted_values) - 1)
+    return sorted_values[index]
+
+
+class TestClientTransport:
+    """Calls the app in-process through Flask's test client (no network in the way)"""
+
+    def __init__(self, app):
+        self.client = app.test_client()
+
+    def request(self, method, path, body=None, token=None):
+        headers = {"Authorization": f"Bearer {token}"} if token else {}
+        response = self.client.open(path, method=method, json=body, headers=headers)
+        return response.status_code, response.get_json(silent=True)
+
+
+class HTTPTransport:
+    """Calls a running server, e.g. gunicorn started from the Procfile"""
+
+    def __init__(self, base_url):
+        parts = urlsplit(base_url)
+        connection_class = http.client.HTTPSConnection if parts.scheme == 'https' else http.client.HTTPConnection
+        self.connection = connection_class(parts.netloc, timeout=30)
+        self.prefix = parts.path.rstrip('/')
+
+    def request(self, method, path, body=None, token=None):
+        headers = {"Content-Type": "application/json"}
+        if token:
+            headers["Authorization"] = f"Bearer {token}"
+        payload = json.dumps(body) if body is not None else None
+        self.connection.request(method, self.prefix + path, body=payload, headers=headers)
+        response = self.connection.getresponse()
+        data = response.read()
+        try:
+            return response.status, json.loads(data) if data else None
+        except ValueError:
+            return response.status, None
+
+
+def run_operation(transport, name, email, token):
+    """Run one request of the mix; returns (ok, new_token)"""
+    if name == "signup":
+        status, _ = transport.request(
+            "POST", "/api/signup", {"email": f"bench-{uuid.uuid4().hex}@bench.test", "password": TEST_PASSWORD})
+        return status == 201, token
+    if name == "login":
+        status, data = transport.request(
+            "POST", "/api/login", {"email": email, "password": TEST_PASSWORD})
+        return status == 200, (data or {}).get("token", token)
+    if name == "validate-token":
+        status, _ = transport.request("POST", "/api/validate-token", {"token": token})
+        return status == 200, token
+    if name == "protected":
+        status, _ = transport.request("GET", "/api/protected", token=token)
+        return status == 200, token
+    status, _ = transport.request("GET", "/api/user/profile", token=token)
+    return status == 200, token
+
+
+def seed_users(app, count):
+    """Create test_user1..N@test.com through the existing CLI command
+
+    Writes to the app's own database, so it refuses to run unless BENCH_DATABASE is set.
+    """
+    if not app.config.get('BENCH_DATABASE'):
+        raise RuntimeError("Refusing to seed a database not marked as a benchmark database (set BENCH_DATABASE=1)")
+    with app.app_context():
+        db.create_all()
+    result = app.test_cli_runner().invoke(args=["insert-test-users", str(count)])
+    if result.exception:
+        raise result.exception
+    return [f"test_user{i}@test.com" for i in range(1, count + 1)]
+
+
+def _worker(make_transport, emails, schedule, samples, errors, lock):
+    transport = make_transport()
+    email = random.choice(emails)
+    _, token = run_operation(transport, "login", email, None)
+    local_samples = {}
+    local_errors = {}
+    for name in schedule:
+        started = time.perf_counter()
+        try:
+            ok, token = run_operation(transport, name, email, token)
+        except Exception:
+            ok = False
+        local_samples.setdefault(name, []).append(time.perf_counter() - started)
+        if not ok:
+            local_errors[name] = local_errors.get(name, 0) + 1
+    with lock:
+        for name, values in local_samples.items():
+            samples.setdefault(name, []).extend(values)
+        for name, count in local_errors.items():
+            errors[name] = errors.get(name, 0) + count
+
+
+def measure_allocations(make_transport, emails, mix, per_operation=50):
+    """Peak traced bytes per operation, measured serially so threads do not blur the figures"""
+    transport = make_transport()
+    email = emails[0]
+    _, token = run_operation(transport, "login", email, None)
+    allocations = {}
+    tracemalloc.start()
+    try:
+        for name in mix:
+            tracemalloc.reset_peak()
+            baseline, _ = tracemalloc.get_traced_memory()
+            for _ in range(per_operation):
+                _, token = run_operation(transport, name, email, token)
+            _, peak = tracemalloc.get_traced_memory()
+            allocations[name] = max(peak - baseline, 0)
+    finally:
+        tracemalloc.stop()
+    return allocations
+
+
+def git_commit():
+    try:
+        return subprocess.check_output(
+            ["git", "rev-parse", "--short", "HEAD"], stderr=subprocess.DEVNULL, text=True).strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def run_benchmark(app, users=20, concurrency=8, requests=2000, mix=DEFAULT_MIX,
+                  base_url=None, seed=42, alloc_requests=50):
+    """Run the traffic mix and return the results as a JSON-ready dict"""
+    weights = parse_mix(mix)
+    emails = seed_users(app, users)
+
+    if base_url:
+        def make_transport():
+            return HTTPTransport(base_url)
+    else:
+        def make_transport():
+            return TestClientTransport(app)
+
+    rng = random.Random(seed)
+    names, counts = list(weights), list(weights.values())
+    per_worker = max(requests // concurrency, 1)
+    schedules = [rng.choices(names, counts, k=per_worker) for _ in range(concurrency)]
+
+    samples, errors, lock = {}, {}, threading.Lock()
+    threads = [threading.Thread(target=_worker, args=(make_transport, emails, schedule, samples, errors, lock))
+               for schedule in schedules]
+    started = time.perf_counter()
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    elapsed = time.perf_counter() - started
+
+    allocations = measure_allocations(make_transport, emails, weights, alloc_requests) if alloc_requests else {}
+
+    results = {}
+    all_samples = []
+    for name in names:
+        values = sorted(samples.get(name, []))
+        all_samples.extend(values)
+        results[name] = _summarize(values, elapsed, errors.get(name, 0))
+        results[name]["alloc_peak_bytes"] = allocations.get(name)
+    all_samples.sort()
+
+    with app.app_context():
+        dialect = db.engine.dialect.name
+    return {
+        "meta": {
+            "commit": git_commit(),
+            "timestamp": time.strftime("%Y-%m-%dT%H:%M:%S"),
+            "python": platform.python_version(),
+            "database": dialect,
+            "target": base_url or "in-process",
+            "users": users,
+            "concurrency": concurrency,
+            "requests": per_worker * concurrency,
+            "mix": weights,
+            "cpu_count": os.cpu_count(),
+        },
+        "total": _summarize(all_samples, elapsed, sum(errors.values())),
+        "operations": results,
+    }
+
+
+CAPACITY_MIX = "login=10,validate-token=30,protected=30,profile=30"
+
+
+def run_capacity(app, targets, levels=(8, 32, 128, 256), mix=CAPACITY_MIX, users=20,
+                 requests_per_connection=20, p99_budget_ms=500.0, max_error_rate=0.01):
+    """Ramp concurrent connections against each server and report the most one process sustains
+
+    targets maps a label to the base URL of a running single-worker server, e.g.
+    {"wsgi": "http://localhost:8001", "asgi": "http://localhost:8002"}. Every client
+    thread keeps one keep-alive connection, so a level is a number of open connections.
+    A level is sustained while p99 stays within p99_budget_ms and errors within max_error_rate.
+    """
+    report = {}
+    for label, base_url in targets.items():
+        steps = []
+        capacity = 0
+        for level in levels:
+            results = run_benchmark(app, users=users, concurrency=level,
+                                    requests=level * requests_per_connection, mix=mix,
+                                    base_url=base_url, alloc_requests=0)
+            total = results["total"]
+            error_rate = total["errors"] / total["count"] if total["count"] else 1.0
+            sustained = error_rate <= max_error_rate and total["p99_ms"] is not None \
+                and total["p99_ms"] <= p99_budget_ms
+            steps.append(dict(total, connections=level, error_rate=round(error_rate, 4), sustained=sustained))
+            if not sustained:
+                break
+            capacity = level
+        report[label] = {"target": base_url, "capacity_connections": capacity, "levels": steps}
+    return {
+        "meta": {
+            "commit": git_commit(),
+            "timestamp": time.strftime("%Y-%m-%dT%H:%M:%S"),
+            "python": platform.python_version(),
+            "mix": parse_mix(mix),
+            "p99_budget_ms": p99_budget_ms,
+            "max_error_rate": max_error_rate,
+            "cpu_count": os.cpu_count(),
+        },
+        "targets": report,
+    }
+
+
+def _summarize(values, elapsed, error_count):
+    def ms(value):
+        return round(value * 1000, 3) if value is not None else None
+
+    return {
+        "count": len(values),
+        "errors": error_count,
+        "throughput_rps": round(len(values) / elapsed, 1) if elapsed else None,
+        "p50_ms": ms(percentile(values, 0.50)),
+        "p95_ms": ms(percentile(values, 0.95)),
+        "p99_ms": ms(percentile(values, 0.99)),
+    }
+
+
+def compare(baseline, current):
+    """Percentage change per operation and metric (positive means higher than the baseline)"""
+    diff = {}
+    sections = dict(current["operations"], total=current["total"])
+    base_sections = dict(baseline["operations"], total=baseline["total"])
+    for name, result in sections.items():
+        base = base_sections.get(name)
+        if not base:
+            continue
+        for metric in ("throughput_rps", "p50_ms", "p95_ms", "p99_ms", "alloc_peak_bytes"):
+            old, new = base.get(metric), result.get(metric)
+            if old and new is not None:
+                diff.setdefault(name, {})[metric] = round((new - old) / old * 100, 1)
+    return diff
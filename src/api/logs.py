@@ -0,0 +1,237 @@
+"""
+Structured logging off the request path: records go onto a bounded queue and a listener thread
+writes them to stdout as JSON lines
+
+The request thread only interpolates the message, tags the record with the request id and
+endpoint, and does a non-blocking put; a full queue drops the record (and counts it) rather than
+wait. Noisy events (expired or invalid tokens) are sampled per endpoint before they are queued.
+"""
+import atexit
+import contextvars
+import itertools
+import json
+import logging
+import os
+import queue
+import re
+import sys
+import threading
+import uuid
+from datetime import datetime, timezone
+from logging.handlers import QueueHandler, QueueListener
+from flask import g, request
+from flask.logging import default_handler
+
+try:
+    import orjson
+except ImportError:  # optional; lines are then encoded by the stdlib
+    orjson = None
+
+# (request id, endpoint) of the request being served; a ContextVar so ASGI tasks get their own too
+request_context = contextvars.ContextVar('request_context', default=(None, None))
+REQUEST_ID_HEADER = 'X-Request-ID'
+VALID_REQUEST_ID = re.compile(r'^[A-Za-z0-9._:-]{1,128}$')
+DEFAULT_SAMPLE_RATES = 'token_expired=0.01,token_invalid=0.1,token_revoked=0.1'
+
+# Everything a bare LogRecord carries; any other attribute came from extra= and is written as a field
+_RECORD_ATTRS = frozenset(vars(logging.LogRecord('', 0, '', 0, '', (), None))) | {
+    'message', 'asctime', 'request_id', 'endpoint', 'event', 'sample_rate'}
+
+
+def request_id_from(header):
+    """The caller's request id when it is safe to echo back, otherwise a new one"""
+    if header and VALID_REQUEST_ID.match(header):
+        return header
+    return uuid.uuid4().hex
+
+
+def current_request_id():
+    return request_context.get()[0]
+
+
+def parse_sample_rates(value):
+    """'token_expired=0.01,token_invalid=0.1' -> {'token_expired': 0.01, 'token_invalid': 0.1}"""
+    rates = {}
+    for item in (value or '').split(','):
+        event, _, rate = item.partition('=')
+        if event.strip() and rate.strip():
+            rates[event.strip()] = min(max(float(rate), 0.0), 1.0)
+    return rates
+
+
+class JsonFormatter(logging.Formatter):
+    """One JSON object per line; runs on the listener thread"""
+
+    def format(self, record):
+        entry = {
+            'ts': datetime.fromtimestamp(record.created, timezone.utc).isoformat(timespec='milliseconds'),
+            'level': record.levelname,
+            'logger': record.name,
+            'msg': record.getMessage(),
+            'pid': record.process,
+        }
+        for name in ('request_id', 'endpoint', 'event', 'sample_rate'):
+            value = getattr(record, name, None)
+            if value is not None:
+                entry[name] = value
+        for name, value in vars(record).items():
+            if name not in _RECORD_ATTRS and not name.startswith('_'):
+                entry[name] = value
+        if record.exc_info:
+            entry['exc'] = self.formatException(record.exc_info)
+        elif record.exc_text:
+            entry['exc'] = record.exc_text
+        if record.stack_info:
+            entry['stack'] = self.formatStack(record.stack_info)
+        if orjson is not None:
+            try:
+                return orjson.dumps(entry, default=str).decode('utf-8')
+            except TypeError:
+                pass
+        return json.dumps(entry, default=str, separators=(',', ':'))
+
+
+class EventSampler(logging.Filter):
+    """Keeps 1 in 1/rate records of each sampled event, counted separately per endpoint"""
+
+    def __init__(self, rates=None):
+        super().__init__()
+        self.rates = rates or {}
+        self._counters = {}
+        self.sampled_out = 0
+
+    def filter(self, record):
+        event = getattr(record, 'event', None)
+        rate = self.rates.get(event) if event else None
+        if rate is None or rate >= 1.0:
+            return True
+        if rate <= 0.0:
+            self.sampled_out += 1
+            return False
+        key = (getattr(record, 'endpoint', None), event)
+        counter = self._counters.get(key)
+        if counter is None:
+            counter = self._counters.setdefault(key, itertools.count())
+        # next() on itertools.count is atomic under the GIL, so no lock on the request path
+        if next(counter) % round(1 / rate):
+            self.sampled_out += 1
+            return False
+        record.sample_rate = rate
+        return True
+
+
+class NonBlockingQueueHandler(QueueHandler):
+    """QueueHandler whose put never waits and whose listener is started in each process that logs"""
+
+    def __init__(self, pipeline):
+        super().__init__(queue.Queue(pipeline.queue_size))
+        self.pipeline = pipeline
+
+    def handle(self, record):
+        # Tag before filtering: the sampler counts per endpoint
+        record.request_id, record.endpoint = request_context.get()
+        return super().handle(record)
+
+    def prepare(self, record):
+        # Only the cheap part here; JSON encoding and tracebacks are the listener's job
+        record.msg = record.getMessage()
+        record.args = None
+        return record
+
+    def enqueue(self, record):
+        if self.pipeline._pid != os.getpid():
+            self.pipeline._start()
+        try:
+            self.queue.put_nowait(record)
+        except queue.Full:
+            self.pipeline.dropped += 1
+
+
+class LogPipeline:
+    """Routes the app's and the api package's loggers through one bounded queue"""
+
+    def __init__(self, app=None):
+        self.queue_size = 10000
+        self.level = logging.INFO
+        self.stream = sys.stdout
+        self.dropped = 0
+        self.handler = None
+        self.sampler = EventSampler()
+        self._listener = None
+        self._lock = threading.Lock()
+        self._pid = None
+        if app is not None:
+            self.init_app(app)
+
+    def init_app(self, app):
+        self.queue_size = int(app.config.get('LOG_QUEUE_SIZE', self.queue_size))
+        self.level = logging.getLevelName(str(app.config.get('LOG_LEVEL', 'INFO')).upper())
+        self.sampler.rates = parse_sample_rates(app.config.get('LOG_SAMPLE_RATES', DEFAULT_SAMPLE_RATES))
+
+        if self.handler is None:
+            self.handler = NonBlockingQueueHandler(self)
+            self.handler.addFilter(self.sampler)
+        for logger in (logging.getLogger('api'), app.logger):
+            logger.removeHandler(default_handler)
+            if self.handler not in logger.handlers:
+                logger.addHandler(self.handler)
+            logger.setLevel(self.level)
+            logger.propagate = False
+
+        @app.before_request
+        def bind_request_id():
+            request_id = request_id_from(request.headers.get(REQUEST_ID_HEADER))
+            g._request_context_token = request_context.set((request_id, request.endpoint))
+
+        @app.after_request
+        def send_request_id(response):
+            request_id = current_request_id()
+            if request_id:
+                response.headers[REQUEST_ID_HEADER] = request_id
+            return response
+
+        @app.teardown_request
+        def unbind_request_id(exc):
+            token = g.pop('_request_context_token', None)
+            if token is not None:
+                request_context.reset(token)
+
+        app.extensions['log_pipeline'] = self
+
+    def _start(self):
+        """A fresh queue and listener thread for this process; threads do not survive fork"""
+        with self._lock:
+            if self._pid == os.getpid():
+                return
+            self.handler.queue = queue.Queue(self.queue_size)
+            stream_handler = logging.StreamHandler(self.stream)
+            stream_handler.setFormatter(JsonFormatter())
+            self._listener = QueueListener(self.handler.queue, stream_handler)
+            self._listener.start()
+            self._pid = os.getpid()
+
+    def reset_after_fork(self):
+        """The child starts its own listener on its first record"""
+        self._lock = threading.Lock()
+        self._listener = None
+        self._pid = None
+
+    def shutdown(self):
+        """Write out what is still queued (atexit)"""
+        if self._listener is not None and self._pid == os.getpid():
+            self._listener.stop()
+            self._listener = None
+            self._pid = None
+
+    def stats(self):
+        return {
+            "queued": self.handler.queue.qsize() if self.handler is not None else 0,
+            "dropped": self.dropped,
+            "sampled_out": self.sampler.sampled_out,
+        }
+
+
+log_pipeline = LogPipeline()
+atexit.register(log_pipeline.shutdown)
+if hasattr(os, 'register_at_fork'):
+    os.register_at_fork(after_in_child=log_pipeline.reset_after_fork)
@@ -0,0 +1,467 @@
+"""
+Prometheus-style metrics: per-endpoint latency, status codes and hash/JWT/DB phase timings, served at /metrics (METRICS_ENABLED)
+
+Each thread records into its own shard, so the request path takes no lock. With
+PROMETHEUS_MULTIPROC_DIR set, every process periodically writes a snapshot there
+and /metrics sums the snapshots, so gunicorn workers aggregate correctly. The gunicorn
+master empties the directory at startup and folds each exited worker's snapshot into
+one dead-workers file, so counters stay monotonic without growing a file per pid.
+"""
+import atexit
+import contextvars
+import glob
+import json
+import logging
+import os
+import threading
+import time
+from bisect import bisect_left
+from flask import g, has_request_context, request
+from sqlalchemy import event
+from sqlalchemy.engine import Engine
+
+logger = logging.getLogger(__name__)
+DEFAULT_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+
+def _label_key(labels):
+    return tuple(sorted((name, str(value)) for name, value in labels.items()))
+
+
+def _format_labels(key, extra=()):
+    pairs = list(key) + list(extra)
+    if not pairs:
+        return ''
+    body = ','.join('{}="{}"'.format(
+        name, value.replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n'))
+        for name, value in pairs)
+    return '{' + body + '}'
+
+
+def _format_value(value):
+    if value == float('inf'):
+        return '+Inf'
+    return repr(float(value)) if isinstance(value, float) else str(value)
+
+
+class Counter:
+    kind = 'counter'
+
+    def __init__(self, registry, name, help):
+        self.registry = registry
+        self.name = name
+        self.help = help
+
+    def inc(self, amount=1, **labels):
+        values = self.registry._shard(self.name)
+        key = _label_key(labels)
+        values[key] = values.get(key, 0) + amount
+
+
+class Histogram:
+    kind = 'histogram'
+
+    def __init__(self, registry, name, help, buckets=DEFAULT_BUCKETS):
+        self.registry = registry
+        self.name = name
+        self.help = help
+        self.buckets = tuple(buckets)
+
+    def observe(self, value, **labels):
+        values = self.registry._shard(self.name)
+        key = _label_key(labels)
+        series = values.get(key)
+        if series is None:
+            # bucket counts (non-cumulative, last one is +Inf), sum, count
+            series = values[key] = [[0] * (len(self.buckets) + 1), 0.0, 0]
+        series[0][bisect_left(self.buckets, value)] += 1
+        series[1] += value
+        series[2] += 1
+
+
+class MetricsRegistry:
+    """Holds metric definitions and per-thread shards, and renders the text exposition format"""
+
+    def __init__(self):
+        self.metrics = {}
+        self.collectors = []
+        self.app = None
+        self.multiproc_dir = None
+        self.sync_seconds = 5.0
+        self._local = threading.local()
+        self._shards = []
+        self._shards_lock = threading.Lock()
+        self._writer = None
+        self._writer_pid = None
+
+    def reset_after_fork(self):
+        """A forked worker starts from zero; its parent's values are reported by the parent"""
+        self._local = threading.local()
+        self._shards = []
+        self._shards_lock = threading.Lock()
+        self._writer = None
+        self._writer_pid = None
+
+    def counter(self, name, help):
+        return self.metrics.setdefault(name, Counter(self, name, help))
+
+    def histogram(self, name, help, buckets=DEFAULT_BUCKETS):
+        return self.metrics.setdefault(name, Histogram(self, name, help, buckets))
+
+    def register_collector(self, collector):
+        """collector() returns (name, kind, help, labels, value) samples read at scrape time"""
+        self.collectors.append(collector)
+
+    def _shard(self, name):
+        shard = getattr(self._local, 'shard', None)
+        if shard is None or self._local.pid != os.getpid():
+            shard = {}
+            self._local.shard = shard
+            self._local.pid = os.getpid()
+            with self._shards_lock:
+                self._shards.append(shard)
+            self._ensure_writer()
+        values = shard.get(name)
+        if values is None:
+            values = shard[name] = {}
+        return values
+
+    def _merge_shards(self):
+        merged = {}
+        with self._shards_lock:
+            shards = list(self._shards)
+        for shard in shards:
+            for name, values in list(shard.items()):
+                metric = self.metrics[name]
+                target = merged.setdefault(name, {})
+                for key, value in values.copy().items():
+                    _merge_value(metric.kind, target, key, value)
+        return merged
+
+    def _collected(self):
+        """Collector samples split into counters (summed across processes) and live gauges"""
+        counters, gauges = {}, []
+        for collector in self.collectors:
+            try:
+                samples = collector()
+            except Exception:
+                continue
+            for name, kind, help, labels, value in samples:
+                if kind == 'counter':
+                    counters.setdefault(name, (help, {}))[1][_label_key(labels)] = value
+                else:
+                    gauges.append((name, help, _label_key(labels), value))
+        return counters, gauges
+
+    def snapshot(self):
+        """This process's values in a JSON-friendly form"""
+        counters, _ = self._collected()
+        data = {}
+        for name, values in self._merge_shards().items():
+            metric = self.metrics[name]
+            data[name] = {"kind": metric.kind, "help": metric.help,
+                          "buckets": list(getattr(metric, 'buckets', ())),
+                          "values": [[list(key), value] for key, value in values.items()]}
+        for name, (help, values) in counters.items():
+            data[name] = {"kind": "counter", "help": help, "buckets": [],
+                          "values": [[list(key), value] for key, value in values.items()]}
+        return data
+
+    def _snapshot_path(self, pid):
+        return os.path.join(self.multiproc_dir, f"metrics-{pid}.json")
+
+    def write_snapshot(self):
+        if not self.multiproc_dir:
+            return
+        path = self._snapshot_path(os.getpid())
+        tmp_path = f"{path}.tmp"
+        with open(tmp_path, 'w') as f:
+            json.dump(self.snapshot(), f)
+        os.replace(tmp_path, path)
+
+    def _ensure_writer(self):
+        if not self.multiproc_dir or self._writer_pid == os.getpid():
+            return
+        self._writer_pid = os.getpid()
+        self._writer = threading.Thread(
+            target=self._write_loop, name='metrics-writer', daemon=True)
+        self._writer.start()
+
+    def _write_loop(self):
+        while True:
+            time.sleep(self.sync_seconds)
+            try:
+                self.write_snapshot()
+            except Exception:
+                logger.exception("Metrics snapshot error")
+
+    def _aggregate(self):
+        """Sum this process's live values with the other processes' latest snapshots"""
+        snapshots = [self.snapshot()]
+        if self.multiproc_dir:
+            own_path = self._snapshot_path(os.getpid())
+            snapshots.extend(_read_snapshot(path) for path in _snapshot_files(self.multiproc_dir)
+                             if path != own_path)
+        return _sum_snapshots(snapshots)
+
+    def render(self):
+        """Text exposition format (version 0.0.4)"""
+        lines = []
+        for name, data in sorted(self._aggregate().items()):
+            lines.append(f"# HELP {name} {data['help']}")
+            lines.append(f"# TYPE {name} {data['kind']}")
+            for key, value in sorted(data["values"].items()):
+                if data["kind"] == 'histogram':
+                    counts, total, count = value
+                    cumulative = 0
+                    bounds = list(data["buckets"]) + [float('inf')]
+                    for bound, bucket_count in zip(bounds, counts):
+                        cumulative += bucket_count
+                        lines.append(f"{name}_bucket{_format_labels(key, [('le', _format_value(bound))])} {cumulative}")
+                    lines.append(f"{name}_sum{_format_labels(key)} {_format_value(total)}")
+                    lines.append(f"{name}_count{_format_labels(key)} {count}")
+                else:
+                    lines.append(f"{name}{_format_labels(key)} {_format_value(value)}")
+
+        _, gauges = self._collected()
+        seen = set()
+        pid = [('pid', str(os.getpid()))] if self.multiproc_dir else []
+        for name, help, key, value in sorted(gauges, key=lambda sample: sample[0]):
+            if name not in seen:
+                seen.add(name)
+                lines.append(f"# HELP {name} {help}")
+                lines.append(f"# TYPE {name} gauge")
+            lines.append(f"{name}{_format_labels(key, pid)} {_format_value(value)}")
+        return '\n'.join(lines) + '\n'
+
+
+def _merge_value(kind, target, key, value):
+    if kind == 'histogram':
+        current = target.get(key)
+        if current is None:
+            target[key] = [list(value[0]), value[1], value[2]]
+        else:
+            current[0] = [a + b for a, b in zip(current[0], value[0])]
+            current[1] += value[1]
+            current[2] += value[2]
+    else:
+        target[key] = target.get(key, 0) + value
+
+
+def _snapshot_files(multiproc_dir):
+    return glob.glob(os.path.join(multiproc_dir, 'metrics-*.json'))
+
+
+def _read_snapshot(path):
+    try:
+        with open(path) as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return {}
+
+
+def _sum_snapshots(snapshots):
+    aggregated = {}
+    for snapshot in snapshots:
+        for name, data in snapshot.items():
+            entry = aggregated.setdefault(name, {
+                "kind": data["kind"], "help": data["help"],
+                "buckets": data["buckets"], "values": {}})
+            for key, value in data["values"]:
+                _merge_value(data["kind"], entry["values"],
+                             tuple(tuple(pair) for pair in key), value)
+    return aggregated
+
+
+def clear_multiproc_dir(multiproc_dir):
+    """Drop every snapshot left by an earlier run (gunicorn on_starting)"""
+    for path in glob.glob(os.path.join(multiproc_dir, 'metrics-*.json*')):
+        try:
+            os.remove(path)
+        except FileNotFoundError:
+            pass
+
+
+def mark_process_dead(multiproc_dir, pid):
+    """Fold an exited worker's last snapshot into metrics-dead.json and remove its own file (gunicorn child_exit)"""
+    path = os.path.join(multiproc_dir, f"metrics-{pid}.json")
+    if not os.path.exists(path):
+        return
+    dead_path = os.path.join(multiproc_dir, 'metrics-dead.json')
+    summed = _sum_snapshots([_read_snapshot(dead_path), _read_snapshot(path)])
+    # Back to the snapshot layout, histograms and counters alike
+    dead = {name: dict(data, values=[[list(key), value] for key, value in data["values"].items()])
+            for name, data in summed.items()}
+    tmp_path = f"{dead_path}.tmp"
+    with open(tmp_path, 'w') as f:
+        json.dump(dead, f)
+    os.replace(tmp_path, dead_path)
+    os.remove(path)
+
+
+registry = MetricsRegistry()
+if hasattr(os, 'register_at_fork'):
+    os.register_at_fork(after_in_child=registry.reset_after_fork)
+atexit.register(registry.write_snapshot)
+
+REQUESTS = registry.counter(
+    'http_requests_total', 'HTTP requests by endpoint, method and status code')
+REQUEST_LATENCY = registry.histogram(
+    'http_request_duration_seconds', 'HTTP request latency by endpoint')
+PHASE_LATENCY = registry.histogram(
+    'auth_phase_duration_seconds', 'Time per request spent hashing, on JWT work and in the database')
+
+
+# Phase totals for a request served outside Flask's request context (the ASGI app's own handlers)
+phase_times = contextvars.ContextVar('phase_times', default=None)
+
+
+def add_phase_time(phase, seconds):
+    """Charge time to a phase of the current request; a no-op outside requests"""
+    phases = g.get('_phase_times') if has_request_context() else phase_times.get()
+    if phases is not None:
+        phases[phase] = phases.get(phase, 0.0) + seconds
+
+
+class phase_timer:
+    """Context manager that charges the enclosed block to a request phase"""
+
+    def __init__(self, phase):
+        self.phase = phase
+
+    def __enter__(self):
+        self.started = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc):
+        add_phase_time(self.phase, time.perf_counter() - self.started)
+        return False
+
+
+@event.listens_for(Engine, 'before_cursor_execute')
+def _before_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+    conn.info.setdefault('_query_started', []).append(time.perf_counter())
+
+
+@event.listens_for(Engine, 'after_cursor_execute')
+def _after_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+    started = conn.info.get('_query_started')
+    if started:
+        add_phase_time('db', time.perf_counter() - started.pop())
+
+
+def _component_collectors():
+    from api.bloom import email_filter
+    from api.denylist import token_denylist
+    from api.db_pool import pool_stats
+    from api.hashing import hash_executor
+    from api.last_login import last_login_recorder
+    from api.logs import log_pipeline
+    from api.models import db
+    from api.ratelimit import login_limiter
+    from api.replica import replica_router
+    from api.token_cache import token_cache
+
+    def hashing():
+        stats = hash_executor.stats()
+        return [
+            ('password_hash_completed_total', 'counter', 'Password hashes completed', {}, stats["completed"]),
+            ('password_hash_rejected_total', 'counter', 'Password hashes shed because the queue was full', {}, stats["rejected"]),
+            ('password_hash_seconds_total', 'counter', 'Time spent hashing passwords', {}, stats["hash_seconds"]),
+            ('password_hash_queue_wait_seconds_total', 'counter', 'Time hashing jobs waited for a worker', {}, stats["queue_wait_seconds"]),
+            ('password_hash_queued', 'gauge', 'Hashing jobs waiting for a worker', {}, stats["queued"]),
+        ]
+
+    def tokens():
+        stats = token_cache.stats()
+        samples = [(f'token_cache_{name}_total', 'counter', f'Verified-token cache {name}', {}, stats[name])
+                   for name in ('hits', 'misses', 'evictions', 'expirations', 'invalidations')]
+        samples.append(('token_cache_size', 'gauge', 'Entries in the verified-token cache', {}, stats["size"]))
+        samples.append(('token_denylist_revoked_total', 'counter', 'Access tokens revoked at logout', {}, token_denylist.revoked_total))
+        samples.append(('token_denylist_size', 'gauge', 'Revoked access tokens not yet expired', {}, len(token_denylist)))
+        return samples
+
+    def last_login():
+        stats = last_login_recorder.stats()
+        return [
+            ('last_login_rows_written_total', 'counter', 'Last-login rows flushed to the database', {}, stats["rows_written"]),
+            ('last_login_pending', 'gauge', 'Last-login updates waiting for the next flush', {}, stats["pending"]),
+        ]
+
+    def pool():
+        with registry.app.app_context():
+            stats = pool_stats(db.engine)
+        samples = [(f'db_pool_{name}', 'gauge', f'Database pool {name.replace("_", " ")}', {}, stats[name])
+                   for name in ('size', 'in_use', 'idle', 'overflow') if name in stats]
+        if "checkouts" in stats:
+            samples += [
+                ('db_pool_checkouts_total', 'counter', 'Database pool checkouts', {}, stats["checkouts"]),
+                ('db_pool_timeouts_total', 'counter', 'Database pool checkouts that timed out', {}, stats["timeouts"]),
+                ('db_pool_wait_seconds_total', 'counter', 'Time spent waiting for a pooled connection', {}, stats["wait_seconds"]),
+            ]
+        return samples
+
+    def rate_limits():
+        stats = login_limiter.stats()
+        samples = [('login_rate_limited_total', 'counter', 'Login attempts rejected by the rate limiter', {}, stats["rejected"])]
+        if stats["keys"] is not None:
+            samples.append(('login_rate_limit_keys', 'gauge', 'Keys tracked by the login rate limiter', {}, stats["keys"]))
+        return samples
+
+    def emails():
+        stats = email_filter.stats()
+        return [
+            ('email_filter_rejected_total', 'counter', 'Logins whose lookup the email filter narrowed to users created since its last refresh', {}, stats["rejected"]),
+            ('email_filter_false_positives_total', 'counter', 'Unknown emails the filter let through to the database', {}, stats["false_positives"]),
+            ('email_filter_entries', 'gauge', 'Emails in the filter', {}, stats["entries"]),
+            ('email_filter_late_commits_total', 'counter', 'Users found in ids an earlier scan skipped over', {}, stats["late_commits"]),
+        ]
+
+    def logs():
+        stats = log_pipeline.stats()
+        return [
+            ('log_records_dropped_total', 'counter', 'Log records dropped because the logging queue was full', {}, stats["dropped"]),
+            ('log_records_sampled_out_total', 'counter', 'Noisy log events skipped by sampling', {}, stats["sampled_out"]),
+            ('log_queue_depth', 'gauge', 'Log records waiting for the listener thread', {}, stats["queued"]),
+        ]
+
+    def replicas():
+        stats = replica_router.stats()
+        return [
+            ('db_replica_reads_total', 'counter', 'Read-only requests served from a replica', {}, stats["replica_reads"]),
+            ('db_replica_pinned_total', 'counter', 'Read-only requests kept on the primary to read their own writes', {}, stats["pinned"]),
+            ('db_replica_failovers_total', 'counter', 'Read-only requests sent to the primary because no replica was healthy', {}, stats["failovers"]),
+            ('db_replicas_healthy', 'gauge', 'Replicas not currently marked down', {}, stats["healthy"]),
+        ]
+
+    return [hashing, tokens, last_login, pool, rate_limits, emails, logs, replicas]
+
+
+def init_app(app):
+    # Collectors read the most recently initialised app, so building another app adds none
+    if registry.app is None:
+        for collector in _component_collectors():
+            registry.register_collector(collector)
+    registry.app = app
+    registry.multiproc_dir = app.config.get('PROMETHEUS_MULTIPROC_DIR') or None
+    registry.sync_seconds = float(app.config.get('METRICS_SYNC_SECONDS', 5))
+    if registry.multiproc_dir:
+        os.makedirs(registry.multiproc_dir, exist_ok=True)
+
+    @app.before_request
+    def start_request_timer():
+        g._request_started = time.perf_counter()
+        g._phase_times = {}
+
+    @app.after_request
+    def record_request_metrics(response):
+        started = g.get('_request_started')
+        if started is not None:
+            endpoint = request.endpoint or 'unmatched'
+            REQUESTS.inc(endpoint=endpoint, method=request.method,
+                         status=response.status_code)
+            REQUEST_LATENCY.observe(
+                time.perf_counter() - started, endpoint=endpoint)
+            for phase, seconds in g.get('_phase_times', {}).items():
+                PHASE_LATENCY.observe(seconds, endpoint=endpoint, phase=phase)
+        return response
@@ -1,13 +1,34 @@
 from flask_sqlalchemy import SQLAlchemy
-from sqlalchemy import String, Boolean
+from sqlalchemy import String, Boolean, event
+from sqlalchemy.dialects import postgresql, sqlite
+from sqlalchemy.exc import IntegrityError
 from sqlalchemy.orm import Mapped, mapped_column
-from werkzeug.security import generate_password_hash, check_password_hash
 import jwt
 from datetime import datetime, timedelta
-import os
+from flask import current_app
+import hashlib
+import logging
+import secrets
+import uuid
+from api.hashing import hash_executor
+from api.metrics import phase_timer
+from api.utils import APIException
+from api.token_cache import token_cache
+from api.last_login import last_login_recorder
+from api.denylist import token_denylist
+from api.keys import key_manager
+from api.replica import RoutingSession, execute_read
 
 
-db = SQLAlchemy()
+# Reads in @read_only views may go to a replica; see api/replica.py
+db = SQLAlchemy(session_options={"class_": RoutingSession})
+logger = logging.getLogger(__name__)
+
+# users.email_canonical is generated from email with this expression
+CANONICAL_EMAIL_SQL = 'lower(trim(email))'
+
+# Dialects whose INSERT supports ON CONFLICT DO NOTHING
+INSERT_IF_ABSENT = {'postgresql': postgresql.insert, 'sqlite': sqlite.insert}
 
 
 class User(db.Model):
@@ -15,78 +36,195 @@ class User(db.Model):
 
     id = db.Column(db.Integer, primary_key=True)
     email = db.Column(db.String(120), unique=True, nullable=False, index=True)
+    # Computed by the database, so every writer (ORM, COPY, raw SQL) agrees on the lookup key
+    email_canonical = db.Column(db.String(120), db.Computed(
+        CANONICAL_EMAIL_SQL, persisted=True), nullable=False)
     password = db.Column(db.String(255), nullable=False)
     is_active = db.Column(db.Boolean(), unique=False,
                           nullable=False, default=True)
+    # May list every account through GET /api/users; granted by `flask create-admin`
+    is_admin = db.Column(db.Boolean(), nullable=False, default=False,
+                         server_default=db.false())
     created_at = db.Column(
         db.DateTime, default=datetime.utcnow, nullable=False)
     updated_at = db.Column(
         db.DateTime, default=datetime.utcnow, onupdate=datetime.utcnow)
 
+    __table_args__ = (
+        # Unique lookup key for login; on PostgreSQL it also carries the columns login reads,
+        # so the lookup is an index-only scan
+        db.Index('ix_users_email_canonical', 'email_canonical', unique=True,
+                 postgresql_include=['id', 'password', 'is_active']),
+        # SQLite has no INCLUDE; a composite index covers the same query there
+        db.Index('ix_users_login', 'email_canonical', 'id', 'password',
+                 'is_active').ddl_if(dialect='sqlite'),
+    )
+
     def __repr__(self):
         return f'<User {self.email}>'
 
     def serialize(self):
+        """Serialized user, memoized until a serialized column is set or the instance expires"""
+        serialized = self.__dict__.get('_serialized')
+        if serialized is None:
+            serialized = self._serialized = User.serialize_fields(self)
+        return serialized
+
+    @staticmethod
+    def serialize_fields(source):
+        """Serialize a User or a row holding the same columns"""
         return {
-            "id": self.id,
-            "email": self.email,
-            "is_active": self.is_active,
-            "created_at": self.created_at.isoformat() if self.created_at else None,
-            "updated_at": self.updated_at.isoformat() if self.updated_at else None
+            "id": source.id,
+            "email": source.email,
+            "is_active": source.is_active,
+            "is_admin": source.is_admin,
+            "created_at": source.created_at.isoformat() if source.created_at else None,
+            "updated_at": source.updated_at.isoformat() if source.updated_at else None
         }
 
     def set_password(self, password):
         """Hash and set password"""
-        self.password = generate_password_hash(
-            password, method='pbkdf2:sha256')
-
-    def check_password(self, password):
-        """Check if provided password matches hash"""
-        return check_password_hash(self.password, password)
+        self.password = hash_executor.hash_password(password)
 
     def generate_token(self):
-        """Generate JWT token for user"""
+        """Generate a short-lived JWT access token for user"""
         try:
+            now = datetime.utcnow()
             payload = {
                 'user_id': self.id,
                 'email': self.email,
-                'iat': datetime.utcnow(),
-                'exp': datetime.utcnow() + timedelta(hours=24)
+                'jti': uuid.uuid4().hex,
+                'iat': now,
+                'exp': now + timedelta(seconds=current_app.config.get('ACCESS_TOKEN_TTL', 900))
             }
-            token = jwt.encode(
-                payload,
-                os.getenv('FLASK_APP_KEY', 'default-secret-key'),
-                algorithm='HS256'
-            )
+            with phase_timer('jwt'):
+                token = key_manager.encode(payload)
             return token
-        except Exception as e:
-            print(f"Token generation error: {e}")
+        except Exception:
+            logger.exception("Token generation error")
             return None
 
     @staticmethod
     def decode_token(token):
         """Decode JWT token and return user data"""
         try:
-            payload = jwt.decode(
-                token,
-                os.getenv('FLASK_APP_KEY', 'default-secret-key'),
-                algorithms=['HS256']
-            )
+            with phase_timer('jwt'):
+                payload = key_manager.decode(token)
+            if token_denylist.is_revoked(payload.get('jti')):
+                logger.info("Token has been revoked", extra={"event": "token_revoked"})
+                return None
             return payload
         except jwt.ExpiredSignatureError:
-            print("Token has expired")
+            logger.info("Token has expired", extra={"event": "token_expired"})
             return None
         except jwt.InvalidTokenError as e:
-            print(f"Invalid token: {e}")
+            logger.info("Invalid token: %s", e, extra={"event": "token_invalid"})
             return None
-        except Exception as e:
-            print(f"Token decode error: {e}")
+        except Exception:
+            logger.exception("Token decode error")
             return None
 
     @staticmethod
     def get_user_by_email(email):
         """Get user by email address"""
-        return User.query.filter_by(email=email.lower().strip()).first()
+        return User.query.filter_by(email_canonical=canonical_email(email)).first()
+
+    @staticmethod
+    def get_login_row(email):
+        """(id, password, is_active) for an email, read from the covering login index only"""
+        return db.session.connection().execute(
+            LOGIN_USER_BY_EMAIL, {"email": canonical_email(email)}).first()
+
+    @staticmethod
+    def upgrade_password_hash(user_id, stored_hash, password):
+        """After a successful check, re-hash the password if its stored hash uses an old scheme or cost"""
+        if not hash_executor.needs_rehash(stored_hash):
+            return
+        try:
+            db.session.execute(
+                db.update(User).where(User.id == user_id)
+                .values(password=hash_executor.hash_password(password), updated_at=datetime.utcnow()))
+            db.session.commit()
+            token_cache.invalidate_user(user_id)
+        except APIException:
+            # Hashing queue is full; keep the old hash and upgrade on a later login
+            db.session.rollback()
+        except Exception:
+            db.session.rollback()
+            logger.exception("Password rehash error")
+
+    @staticmethod
+    def get_row(user_id):
+        """The columns serialize() needs as a row, without building a User object"""
+        return execute_read(db.session, SERIALIZED_USER_BY_ID, {"user_id": user_id}).first()
+
+    @staticmethod
+    def get_serialized(user_id):
+        """Load only the columns serialize() needs, without building a User object"""
+        row = User.get_row(user_id)
+        return User.serialize_fields(row) if row else None
+
+    @staticmethod
+    def get_serialized_many(user_ids):
+        """Serialized users for a batch of ids in one IN query, keyed by id"""
+        if not user_ids:
+            return {}
+        rows = execute_read(db.session, SERIALIZED_USERS_BY_IDS, {"user_ids": list(user_ids)})
+        return {row.id: User.serialize_fields(row) for row in rows}
+
+    @staticmethod
+    def get_page(after_id=0, limit=100):
+        """Return up to limit users with id > after_id, as rows in id order"""
+        return execute_read(
+            db.session, SERIALIZED_USERS_AFTER_ID, {"after_id": after_id, "limit": limit}).all()
+
+    @staticmethod
+    def iter_rows(after_id=0, batch_size=1000, bind=None):
+        """Yield every user row by keyset pagination, one batch in memory at a time
+
+        bind reads from that engine (e.g. a replica) instead of the session's default.
+        """
+        connection = db.session.connection(bind_arguments={"bind": bind} if bind is not None else None)
+        if connection.dialect.name == 'postgresql':
+            # Server-side cursor: rows stream from Postgres instead of being buffered
+            connection = connection.execution_options(
+                stream_results=True, max_row_buffer=batch_size)
+        while True:
+            rows = connection.execute(
+                SERIALIZED_USERS_AFTER_ID, {"after_id": after_id, "limit": batch_size})
+            count = 0
+            for row in rows:
+                count += 1
+                after_id = row.id
+                yield row
+            if count < batch_size:
+                return
+
+    @staticmethod
+    def insert_if_absent(email, password_hash):
+        """Insert a user unless the email is taken, in one statement; returns the new row or None
+
+        Relies on the unique email indexes instead of a lookup first, so concurrent
+        signups for one email cannot both get past a check. The caller commits.
+        """
+        now = datetime.utcnow()
+        values = {"email": email, "password": password_hash, "is_active": True,
+                  "created_at": now, "updated_at": now}
+        dialect = db.session.get_bind().dialect.name
+        if dialect in ('postgresql', 'sqlite'):
+            # INSERT ... ON CONFLICT DO NOTHING RETURNING ...; no row back means a duplicate
+            # (no conflict target, so ix_users_email and ix_users_email_canonical both count)
+            insert = INSERT_IF_ABSENT[dialect]
+            return db.session.execute(
+                insert(User).values(values)
+                .on_conflict_do_nothing()
+                .returning(*SERIALIZED_COLUMNS)).first()
+        try:
+            with db.session.begin_nested():
+                return db.session.execute(
+                    db.insert(User).values(values).returning(*SERIALIZED_COLUMNS)).first()
+        except IntegrityError:
+            return None
 
     @staticmethod
     def create_user(email, password):
@@ -98,6 +236,189 @@ class User(db.Model):
         return user
 
     def update_last_login(self):
-        """Update the user's last login timestamp"""
-        self.updated_at = datetime.utcnow()
+        """Queue the user's last login timestamp for the batched flusher"""
+        last_login_recorder.record(self.id)
+
+
+class UserLogin(db.Model):
+    __tablename__ = 'user_last_logins'
+
+    user_id = db.Column(db.Integer, db.ForeignKey(
+        'users.id', ondelete='CASCADE'), primary_key=True)
+    last_login_at = db.Column(db.DateTime, nullable=False)
+
+    def __repr__(self):
+        return f'<UserLogin {self.user_id} {self.last_login_at}>'
+
+
+class RefreshToken(db.Model):
+    __tablename__ = 'refresh_tokens'
+
+    id = db.Column(db.Integer, primary_key=True)
+    user_id = db.Column(db.Integer, db.ForeignKey(
+        'users.id', ondelete='CASCADE'), nullable=False, index=True)
+    token_hash = db.Column(db.String(64), unique=True, nullable=False, index=True)
+    family_id = db.Column(db.String(32), nullable=False, index=True)
+    created_at = db.Column(
+        db.DateTime, default=datetime.utcnow, nullable=False)
+    expires_at = db.Column(db.DateTime, nullable=False)
+    revoked_at = db.Column(db.DateTime, nullable=True)
+
+    def __repr__(self):
+        return f'<RefreshToken {self.id} user={self.user_id}>'
+
+    @staticmethod
+    def hash_token(raw_token):
+        return hashlib.sha256(raw_token.encode('utf-8')).hexdigest()
+
+    @staticmethod
+    def new_values(user_id, family_id=None):
+        """(raw token, column values) for a new refresh token; only the hash is stored"""
+        raw_token = secrets.token_urlsafe(32)
+        return raw_token, {
+            "user_id": user_id,
+            "token_hash": RefreshToken.hash_token(raw_token),
+            "family_id": family_id or uuid.uuid4().hex,
+            "created_at": datetime.utcnow(),
+            "expires_at": datetime.utcnow() + timedelta(
+                seconds=current_app.config.get('REFRESH_TOKEN_TTL', 30 * 24 * 3600))
+        }
+
+    @staticmethod
+    def issue(user_id, family_id=None):
+        """Create a refresh token; only its hash is stored. Returns the raw token (caller commits)"""
+        raw_token, values = RefreshToken.new_values(user_id, family_id)
+        db.session.add(RefreshToken(**values))
+        return raw_token
+
+    @staticmethod
+    def rotate(raw_token):
+        """Spend a refresh token and issue its successor; returns (user_id, new_token) or (None, None)
+
+        Presenting a token that was already spent means it leaked, so its whole family is revoked.
+        """
+        token = RefreshToken.query.filter_by(
+            token_hash=RefreshToken.hash_token(raw_token)).first()
+        if not token:
+            return None, None
+
+        now = datetime.utcnow()
+        if token.revoked_at is not None:
+            RefreshToken.revoke_family(token.family_id)
+            db.session.commit()
+            return None, None
+        if token.expires_at <= now:
+            return None, None
+
+        # Conditional update so two concurrent refreshes cannot both win
+        spent = db.session.execute(
+            db.update(RefreshToken)
+            .where(RefreshToken.id == token.id, RefreshToken.revoked_at.is_(None))
+            .values(revoked_at=now)
+        ).rowcount
+        if spent != 1:
+            db.session.rollback()
+            return None, None
+
+        new_token = RefreshToken.issue(token.user_id, token.family_id)
         db.session.commit()
+        return token.user_id, new_token
+
+    @staticmethod
+    def revoke_family(family_id):
+        db.session.execute(
+            db.update(RefreshToken)
+            .where(RefreshToken.family_id == family_id, RefreshToken.revoked_at.is_(None))
+            .values(revoked_at=datetime.utcnow())
+        )
+
+    @staticmethod
+    def revoke(raw_token):
+        """Revoke the token's whole family, i.e. end that login session (caller commits)"""
+        token = RefreshToken.query.filter_by(
+            token_hash=RefreshToken.hash_token(raw_token)).first()
+        if token:
+            RefreshToken.revoke_family(token.family_id)
+        return token is not None
+
+
+class RevokedToken(db.Model):
+    """Access tokens revoked at logout; every worker pulls these into its token_denylist"""
+    __tablename__ = 'revoked_tokens'
+
+    jti = db.Column(db.String(32), primary_key=True)
+    expires_at = db.Column(db.DateTime, nullable=False, index=True)
+    revoked_at = db.Column(db.DateTime, default=datetime.utcnow, nullable=False, index=True)
+
+    def __repr__(self):
+        return f'<RevokedToken {self.jti}>'
+
+    @staticmethod
+    def revoke(jti, exp):
+        """Record a revoked access token until its exp (seconds since the epoch); the caller commits
+
+        Rows past their exp are no use to anyone, so they are cleared out here as well.
+        """
+        now = datetime.utcnow()
+        db.session.execute(db.delete(RevokedToken).where(RevokedToken.expires_at <= now))
+        values = {"jti": jti, "expires_at": datetime.utcfromtimestamp(exp), "revoked_at": now}
+        dialect = db.session.get_bind().dialect.name
+        if dialect in ('postgresql', 'sqlite'):
+            # Logging out twice with one token is not an error
+            db.session.execute(INSERT_IF_ABSENT[dialect](RevokedToken).values(values).on_conflict_do_nothing())
+            return
+        try:
+            with db.session.begin_nested():
+                db.session.execute(db.insert(RevokedToken).values(values))
+        except IntegrityError:
+            pass
+
+    @staticmethod
+    def revoked_since(since=None):
+        """(jti, expires_at) of unexpired revocations recorded at or after since, read from the primary"""
+        query = db.select(RevokedToken.jti, RevokedToken.expires_at).where(
+            RevokedToken.expires_at > datetime.utcnow())
+        if since is not None:
+            query = query.where(RevokedToken.revoked_at >= since)
+        with db.engine.connect() as connection:
+            return connection.execute(query).all()
+
+
+# Columns User.serialize_fields reads; statements are built once so hot paths skip construction
+SERIALIZED_COLUMNS = (User.id, User.email, User.is_active, User.is_admin,
+                      User.created_at, User.updated_at)
+SERIALIZED_USER_BY_ID = db.select(*SERIALIZED_COLUMNS).where(
+    User.id == db.bindparam("user_id"))
+SERIALIZED_USERS_BY_IDS = db.select(*SERIALIZED_COLUMNS).where(
+    User.id.in_(db.bindparam("user_ids", expanding=True)))
+SERIALIZED_USERS_AFTER_ID = db.select(*SERIALIZED_COLUMNS).where(
+    User.id > db.bindparam("after_id")).order_by(User.id).limit(db.bindparam("limit"))
+# Only columns in the covering login index, so no heap/table fetch is needed
+LOGIN_USER_BY_EMAIL = db.select(User.id, User.password, User.is_active).where(
+    User.email_canonical == db.bindparam("email"))
+# The same, among users the email filter has not seen yet
+LOGIN_USER_BY_EMAIL_AFTER_ID = LOGIN_USER_BY_EMAIL.where(User.id > db.bindparam("after_id"))
+
+
+def canonical_email(email):
+    """Python side of CANONICAL_EMAIL_SQL, for building lookup keys"""
+    return email.strip().lower()
+
+
+def forget_serialized(target, *args):
+    """Drop the memoized serialize() result once the instance may hold different values"""
+    target.__dict__.pop('_serialized', None)
+
+
+event.listen(User, 'expire', forget_serialized)
+event.listen(User, 'refresh', forget_serialized)
+for column in SERIALIZED_COLUMNS:
+    event.listen(column, 'set', forget_serialized)
+
+
+@event.listens_for(User, 'after_update')
+@event.listens_for(User, 'after_delete')
+def invalidate_cached_tokens(mapper, connection, target):
+    """Drop cached tokens when a user is deactivated, deleted or changes password"""
+    forget_serialized(target)
+    token_cache.invalidate_user(target.id)
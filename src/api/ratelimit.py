@@ -0,0 +1,218 @@
+"""
+Login throttling: a per-IP token bucket and a per-account sliding window, checked before any hashing
+
+The bucket counts every attempt from an IP. The windows count only failed attempts: per account
+and IP, so one source is stopped after a few guesses without locking the owner out, and per
+account from every IP, with a higher limit, so password spraying from many addresses is stopped
+as well.
+"""
+import importlib
+import math
+import threading
+import time
+from collections import OrderedDict
+from api.utils import APIException
+
+
+class RateLimited(APIException):
+    status_code = 429
+
+    def __init__(self, retry_after):
+        APIException.__init__(self, "Too many login attempts, please try again later")
+        self.headers = {"Retry-After": str(max(int(math.ceil(retry_after)), 1))}
+
+
+class InMemoryBackend:
+    """Single-node backend; keeps at most max_keys entries and evicts the least recently used"""
+
+    def __init__(self, max_keys=100000):
+        self.max_keys = max_keys
+        self.evictions = 0
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+
+    def _store(self, key, value):
+        self._entries[key] = value
+        self._entries.move_to_end(key)
+        while len(self._entries) > self.max_keys:
+            self._entries.popitem(last=False)
+            self.evictions += 1
+
+    def take_token(self, key, capacity, rate, now):
+        """Token bucket: returns (allowed, seconds until a token is available)"""
+        with self._lock:
+            tokens, updated = self._entries.get(key, (capacity, now))
+            tokens = min(capacity, tokens + (now - updated) * rate)
+            if tokens >= 1:
+                self._store(key, (tokens - 1, now))
+                return True, 0.0
+            self._store(key, (tokens, now))
+            return False, (1 - tokens) / rate
+
+    def _window(self, key, window, now):
+        bucket = int(now // window)
+        current_bucket, current, previous = self._entries.get(key, (bucket, 0, 0))
+        if current_bucket != bucket:
+            # Roll forward; anything older than one window no longer counts
+            previous = current if bucket - current_bucket == 1 else 0
+            current = 0
+        return bucket, current, previous
+
+    def peek_window(self, key, limit, window, now):
+        """Sliding window counter: returns (allowed, seconds until the weighted count drops below limit)"""
+        with self._lock:
+            bucket, current, previous = self._window(key, window, now)
+        elapsed = now - bucket * window
+        if previous * (1 - elapsed / window) + current >= limit:
+            return False, window - elapsed
+        return True, 0.0
+
+    def add_to_window(self, key, window, now):
+        with self._lock:
+            bucket, current, previous = self._window(key, window, now)
+            self._store(key, (bucket, current + 1, previous))
+
+    def size(self):
+        return len(self._entries)
+
+
+class LocalStore:
+    """Stand-in for a shared store such as Redis: incr with expiry and get, bounded like InMemoryBackend"""
+
+    def __init__(self, max_keys=100000):
+        self.max_keys = max_keys
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+
+    def incr(self, key, ttl):
+        now = time.time()
+        with self._lock:
+            value, expires_at = self._entries.get(key, (0, now + ttl))
+            if expires_at <= now:
+                value, expires_at = 0, now + ttl
+            self._entries[key] = (value + 1, expires_at)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_keys:
+                self._entries.popitem(last=False)
+            return value + 1
+
+    def get(self, key):
+        with self._lock:
+            entry = self._entries.get(key)
+        if entry is None or entry[1] <= time.time():
+            return 0
+        return entry[0]
+
+    def size(self):
+        return len(self._entries)
+
+
+class SharedBackend:
+    """Multi-node backend over any store exposing incr(key, ttl) and get(key)
+
+    Both limits are enforced with sliding windows of fixed buckets, so the store
+    only needs atomic increments. The token bucket becomes a window of `capacity`
+    requests per `capacity / rate` seconds.
+    """
+
+    def __init__(self, store):
+        self.store = store
+
+    def take_token(self, key, capacity, rate, now):
+        window = capacity / rate
+        allowed, retry_after = self.peek_window(key, capacity, window, now)
+        if allowed:
+            self.add_to_window(key, window, now)
+        return allowed, retry_after
+
+    def peek_window(self, key, limit, window, now):
+        bucket = int(now // window)
+        weight = 1 - (now - bucket * window) / window
+        previous = self.store.get(f"{key}:{bucket - 1}")
+        current = self.store.get(f"{key}:{bucket}")
+        if previous * weight + current >= limit:
+            return False, (bucket + 1) * window - now
+        return True, 0.0
+
+    def add_to_window(self, key, window, now):
+        self.store.incr(f"{key}:{int(now // window)}", ttl=window * 2)
+
+    def size(self):
+        return self.store.size() if hasattr(self.store, 'size') else None
+
+
+def _load_store(spec):
+    """'package.module:factory' -> factory()"""
+    module_name, _, attr = spec.partition(':')
+    return getattr(importlib.import_module(module_name), attr)()
+
+
+class LoginRateLimiter:
+    """Per-IP token bucket plus sliding windows of failed logins per account and IP and per account"""
+
+    def __init__(self, app=None):
+        self.enabled = True
+        self.backend = InMemoryBackend()
+        self.ip_rate = 1.0
+        self.ip_burst = 20
+        self.account_limit = 10
+        self.account_total_limit = 100
+        self.account_window = 300
+        self.rejected = 0
+        if app is not None:
+            self.init_app(app)
+
+    def init_app(self, app):
+        config = app.config
+        self.enabled = bool(config.get('RATE_LIMIT_ENABLED', True))
+        self.ip_rate = float(config.get('LOGIN_IP_RATE', self.ip_rate))
+        self.ip_burst = int(config.get('LOGIN_IP_BURST', self.ip_burst))
+        self.account_limit = int(config.get('LOGIN_ACCOUNT_LIMIT', self.account_limit))
+        self.account_total_limit = int(config.get('LOGIN_ACCOUNT_TOTAL_LIMIT', self.account_total_limit))
+        self.account_window = float(config.get('LOGIN_ACCOUNT_WINDOW', self.account_window))
+        max_keys = int(config.get('RATE_LIMIT_MAX_KEYS', 100000))
+
+        backend = config.get('RATE_LIMIT_BACKEND', 'memory')
+        if backend == 'memory':
+            self.backend = InMemoryBackend(max_keys)
+        elif backend == 'shared':
+            store = config.get('RATE_LIMIT_STORE')
+            self.backend = SharedBackend(_load_store(store) if store else LocalStore(max_keys))
+        else:
+            raise ValueError(f"Unknown RATE_LIMIT_BACKEND: {backend}")
+        app.extensions['login_rate_limiter'] = self
+
+    def check(self, ip, email):
+        """Raise RateLimited if this IP, its failures for the account, or all failures for the account are over the limit"""
+        if not self.enabled:
+            return
+        now = time.time()
+        allowed, retry_after = self.backend.take_token(
+            f"login:ip:{ip}", self.ip_burst, self.ip_rate, now)
+        if allowed and email:
+            allowed, retry_after = self.backend.peek_window(
+                f"login:account:{email}:{ip}", self.account_limit, self.account_window, now)
+        if allowed and email:
+            allowed, retry_after = self.backend.peek_window(
+                f"login:account:{email}", self.account_total_limit, self.account_window, now)
+        if not allowed:
+            self.rejected += 1
+            raise RateLimited(retry_after)
+
+    def record_failure(self, ip, email):
+        """Count a wrong email or password against the account, for this IP and in total"""
+        if not self.enabled or not email:
+            return
+        now = time.time()
+        self.backend.add_to_window(f"login:account:{email}:{ip}", self.account_window, now)
+        self.backend.add_to_window(f"login:account:{email}", self.account_window, now)
+
+    def stats(self):
+        return {
+            "backend": type(self.backend).__name__,
+            "keys": self.backend.size(),
+            "rejected": self.rejected,
+        }
+
+
+login_limiter = LoginRateLimiter()
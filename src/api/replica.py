@@ -0,0 +1,201 @@
+"""
+Read-replica routing: read-only endpoints read from a replica pool, everything else uses the primary
+
+Replicas are SQLALCHEMY_BINDS named replica_0, replica_1, ... (from REPLICA_DATABASE_URLS). A view
+marked @read_only has its session reads sent to a healthy replica, picked round-robin once per
+request. Writes and flushes always go to the primary. A caller whose token was issued in the last
+REPLICA_READ_YOUR_WRITES_SECONDS has just signed up, logged in or refreshed, so that request stays
+on the primary and sees its own writes on every worker and node without shared state. A replica
+that fails its probe or drops a connection is skipped for REPLICA_RETRY_SECONDS. Probes run on a
+background thread, never on the request; a read that fails on a replica is retried on the primary.
+"""
+import functools
+import itertools
+import logging
+import os
+import threading
+import time
+from flask import g, has_request_context
+from flask_sqlalchemy.session import Session
+from sqlalchemy import event, text
+from sqlalchemy.exc import OperationalError
+from sqlalchemy.sql.dml import UpdateBase
+
+logger = logging.getLogger(__name__)
+
+REPLICA_BIND_PREFIX = 'replica_'
+
+
+class RoutingSession(Session):
+    """Flask-SQLAlchemy's session, asking the replica router first for reads"""
+
+    def get_bind(self, mapper=None, clause=None, bind=None, **kwargs):
+        if bind is None and not self._flushing and not isinstance(clause, UpdateBase):
+            engine = replica_router.engine_for_read()
+            if engine is not None:
+                return engine
+        return super().get_bind(mapper=mapper, clause=clause, bind=bind, **kwargs)
+
+
+def read_only(view):
+    """Let this view's reads go to a replica; put it above require_auth so the token can pin it"""
+    @functools.wraps(view)
+    def wrapper(*args, **kwargs):
+        g.db_read_only = True
+        return view(*args, **kwargs)
+    return wrapper
+
+
+def execute_read(session, statement, params=None):
+    """session.connection().execute() for a read, retried on the primary if the replica fails mid-query"""
+    try:
+        return session.connection().execute(statement, params)
+    except OperationalError:
+        key = g.get('db_replica_key') if has_request_context() else None
+        if not key:
+            raise
+        session.rollback()
+        replica_router.fail_over(key)
+        return session.connection().execute(statement, params)
+
+
+class ReplicaRouter:
+    """Picks the engine for read-only requests and tracks replica health"""
+
+    def __init__(self, app=None):
+        self.app = None
+        self.keys = []
+        self.read_your_writes_seconds = 5.0
+        self.health_check_seconds = 5.0
+        self.retry_seconds = 30.0
+        self._engines = {}
+        self._down_until = {}
+        self._next = itertools.count()
+        self._lock = threading.Lock()
+        self._prober_pid = None
+        self._counters = {"replica_reads": 0, "pinned": 0, "failovers": 0, "marked_down": 0}
+        if app is not None:
+            self.init_app(app)
+
+    def init_app(self, app):
+        self.app = app
+        self.keys = sorted(key for key in app.config.get('SQLALCHEMY_BINDS') or {}
+                           if key and key.startswith(REPLICA_BIND_PREFIX))
+        self.read_your_writes_seconds = float(app.config.get(
+            'REPLICA_READ_YOUR_WRITES_SECONDS', self.read_your_writes_seconds))
+        self.health_check_seconds = float(app.config.get(
+            'REPLICA_HEALTH_CHECK_SECONDS', self.health_check_seconds))
+        self.retry_seconds = float(app.config.get('REPLICA_RETRY_SECONDS', self.retry_seconds))
+        self._engines = {}
+        if self.keys:
+            with app.app_context():
+                engines = app.extensions['sqlalchemy'].engines
+                for key in self.keys:
+                    self._engines[key] = engines[key]
+                    event.listen(engines[key], 'handle_error', functools.partial(self._on_error, key))
+        app.extensions['replica_router'] = self
+
+    def _count(self, name):
+        with self._lock:
+            self._counters[name] += 1
+
+    def _on_error(self, key, context):
+        # A connect failure has no connection yet; a dropped one is a disconnect
+        if context.is_disconnect or context.connection is None:
+            self.mark_down(key)
+
+    def mark_down(self, key):
+        """Send reads for this replica to the others (or the primary) for retry_seconds"""
+        now = time.monotonic()
+        was_down = self._down_until.get(key, 0) > now
+        self._down_until[key] = now + self.retry_seconds
+        if was_down:
+            return
+        self._count("marked_down")
+        logger.warning("Replica %s marked down for %ss", key, self.retry_seconds,
+                       extra={"event": "replica_down"})
+
+    def fail_over(self, key):
+        """The current request's replica failed mid-query: mark it down and read from the primary"""
+        self.mark_down(key)
+        g.db_replica_key = ''
+        self._count("failovers")
+
+    def healthy(self, key):
+        return self._down_until.get(key, 0) <= time.monotonic()
+
+    def probe(self, key, engine):
+        try:
+            with engine.connect() as connection:
+                connection.execute(text('SELECT 1'))
+        except Exception:
+            self.mark_down(key)
+            return False
+        return True
+
+    def _probe_loop(self):
+        while True:
+            for key, engine in list(self._engines.items()):
+                self.probe(key, engine)
+            time.sleep(self.health_check_seconds)
+
+    def _ensure_prober(self):
+        """One probe thread per process, started by the first routed read; threads do not survive fork"""
+        if self._prober_pid == os.getpid():
+            return
+        with self._lock:
+            if self._prober_pid == os.getpid():
+                return
+            threading.Thread(target=self._probe_loop, name='replica-probe', daemon=True).start()
+            self._prober_pid = os.getpid()
+
+    def reset_after_fork(self):
+        self._lock = threading.Lock()
+        self._prober_pid = None
+
+    def pick_replica(self):
+        """Key of the next healthy replica round-robin, or '' when none is"""
+        self._ensure_prober()
+        for _ in range(len(self.keys)):
+            candidate = self.keys[next(self._next) % len(self.keys)]
+            if self.healthy(candidate):
+                return candidate
+        return ''
+
+    def pin_recent_writer(self, payload):
+        """Keep this request on the primary when its token was issued moments ago"""
+        if not payload or not has_request_context() or not g.get('db_read_only'):
+            return
+        issued_at = payload.get('iat')
+        if issued_at is not None and time.time() - issued_at < self.read_your_writes_seconds:
+            g.db_primary_pinned = True
+            self._count("pinned")
+
+    def engine_for_read(self):
+        """A replica engine for the current request, or None for the primary"""
+        if not self.keys or not has_request_context() or not g.get('db_read_only') \
+                or g.get('db_primary_pinned'):
+            return None
+        key = g.get('db_replica_key')
+        if key is None:
+            # Chosen once, so every read in the request sees the same snapshot source
+            key = self.pick_replica()
+            g.db_replica_key = key
+            self._count("replica_reads" if key else "failovers")
+        return self._engines[key] if key else None
+
+    def engine(self, key):
+        return self._engines[key]
+
+    def stats(self):
+        now = time.monotonic()
+        with self._lock:
+            stats = dict(self._counters)
+        stats["replicas"] = len(self.keys)
+        stats["healthy"] = sum(1 for key in self.keys if self._down_until.get(key, 0) <= now)
+        return stats
+
+
+replica_router = ReplicaRouter()
+if hasattr(os, 'register_at_fork'):
+    os.register_at_fork(after_in_child=replica_router.reset_after_fork)
@@ -1,12 +1,29 @@
 """
 This module takes care of starting the API Server, Loading the DB and Adding the endpoints
 """
-from flask import request, jsonify, Blueprint
-from api.models import db, User
+from flask import request, jsonify, Blueprint, g, current_app, has_request_context
+from api.models import db, User, RefreshToken, RevokedToken, LOGIN_USER_BY_EMAIL, \
+    LOGIN_USER_BY_EMAIL_AFTER_ID, SERIALIZED_USER_BY_ID, canonical_email
+from api.steps import ReadRow, VerifyPassword, UpgradePasswordHash, IssueRefreshToken, run_steps
 from api.utils import generate_sitemap, APIException
+from api.token_cache import token_cache
+from api.denylist import token_denylist
+from api.ratelimit import login_limiter
+from api.bloom import email_filter
+from api.hashing import hash_executor
+from api.last_login import last_login_recorder
+from api.json_provider import json_response
+from api.replica import read_only, replica_router
+import functools
+import logging
 import re
 
 api = Blueprint('api', __name__)
+logger = logging.getLogger(__name__)
+
+USERS_PAGE_DEFAULT = 100
+USERS_PAGE_MAX = 1000
+VALIDATE_TOKENS_MAX = 100
 
 def validate_email(email):
     """Validate email format"""
@@ -17,6 +34,102 @@ def validate_password(password):
     """Validate password strength"""
     return len(password) >= 6
 
+def client_ip():
+    """Client address; behind a proxy ProxyFix (PROXY_FIX_X_FOR) has set it from the trusted hop"""
+    return request.remote_addr
+
+def cached_auth(token):
+    """(claims, user) from the verified-token cache, unless the token was revoked since"""
+    cached = token_cache.get(token)
+    if cached and not token_denylist.is_revoked(cached[0].get('jti')):
+        return cached
+    return None
+
+def authenticate_steps(token):
+    """Resolve a token to its claims and serialized user, once per request (a flow, see api.steps)"""
+    in_request = has_request_context()
+    if in_request and g.get('auth_token') == token:
+        return g.token_payload, g.current_user
+
+    cached = cached_auth(token)
+    if cached:
+        payload, user = cached
+        replica_router.pin_recent_writer(payload)
+    else:
+        payload = User.decode_token(token)
+        # Decided before the lookup: a just-issued token must find its user on the primary
+        replica_router.pin_recent_writer(payload)
+        row = (yield ReadRow(SERIALIZED_USER_BY_ID, {"user_id": payload['user_id']})) if payload else None
+        user = User.serialize_fields(row) if row else None
+        if user:
+            token_cache.put(token, payload, user,
+                            from_replica=in_request and bool(g.get('db_replica_key')))
+
+    if in_request:
+        g.auth_token = token
+        g.token_payload = payload
+        g.current_user = user
+    return payload, user
+
+def authenticate(token):
+    return run_steps(authenticate_steps(token))
+
+def bearer_token(auth_header):
+    """The token from an "Authorization: Bearer <token>" header, or None if the header is malformed"""
+    parts = (auth_header or '').split(" ")
+    if len(parts) < 2:
+        return None
+    return parts[1] or None
+
+def check_auth_steps(auth_header, active_only=True, admin_only=False):
+    """require_auth's checks: (user, None), or (None, (body, status)) to send back instead"""
+    if not auth_header:
+        return None, ({"message": "Authorization header is required"}, 401)
+
+    token = bearer_token(auth_header)
+    if not token:
+        return None, ({"message": "Invalid authorization header format"}, 401)
+
+    try:
+        payload, user = yield from authenticate_steps(token)
+    except Exception:
+        logger.exception("Authentication error")
+        return None, ({"message": "Internal server error"}, 500)
+
+    if not payload:
+        return None, ({"message": "Invalid or expired token"}, 401)
+
+    if not user:
+        if active_only:
+            return None, ({"message": "User not found or inactive"}, 401)
+        return None, ({"message": "User not found"}, 404)
+
+    if active_only and not user['is_active']:
+        return None, ({"message": "User not found or inactive"}, 401)
+
+    if admin_only and not user['is_admin']:
+        return None, ({"message": "Admin access required"}, 403)
+
+    return user, None
+
+def check_auth(auth_header, active_only=True, admin_only=False):
+    return run_steps(check_auth_steps(auth_header, active_only, admin_only))
+
+def require_auth(view=None, active_only=True, admin_only=False):
+    """Require a valid Bearer token; the user is available as g.current_user"""
+    if view is None:
+        return functools.partial(require_auth, active_only=active_only, admin_only=admin_only)
+
+    @functools.wraps(view)
+    def wrapper(*args, **kwargs):
+        user, error = check_auth(request.headers.get('Authorization'), active_only, admin_only)
+        if error:
+            body, status = error
+            return jsonify(body), status
+        return view(*args, **kwargs)
+
+    return wrapper
+
 @api.route('/hello', methods=['POST', 'GET'])
 def handle_hello():
     """Test endpoint"""
@@ -48,183 +161,317 @@ def signup():
         if not validate_password(password):
             return jsonify({"message": "Password must be at least 6 characters long"}), 400
 
-        # Check if user already exists
-        existing_user = User.get_user_by_email(email)
-        if existing_user:
+        # Hash only once the input is valid, then insert in one statement; the unique
+        # email index rejects duplicates, including concurrent ones, without a lookup first
+        password_hash = hash_executor.hash_password(password)
+        new_user = User.insert_if_absent(email, password_hash)
+        if not new_user:
+            db.session.rollback()
             return jsonify({"message": "User with this email already exists"}), 409
 
-        # Create new user using your static method
-        new_user = User.create_user(email, password)
-
-        # Save to database
-        db.session.add(new_user)
+        # Commit together with the refresh token for the new session
+        refresh_token = RefreshToken.issue(new_user.id)
         db.session.commit()
+        email_filter.add(new_user.email)
 
-        # Generate token for immediate login after signup
-        token = new_user.generate_token()
+        # Generate token for immediate login after signup (the row carries the id and email it reads)
+        token = User.generate_token(new_user)
 
         return jsonify({
             "message": "User created successfully",
             "token": token,
-            "user": new_user.serialize()
+            "refresh_token": refresh_token,
+            "expires_in": current_app.config.get('ACCESS_TOKEN_TTL', 900),
+            "user": User.serialize_fields(new_user)
         }), 201
 
-    except Exception as e:
+    except APIException:
+        raise
+    except Exception:
         db.session.rollback()
-        print(f"Signup error: {str(e)}")
+        logger.exception("Signup error")
         return jsonify({"message": "Internal server error"}), 500
 
-@api.route('/login', methods=['POST'])
-def login():
-    """User login endpoint"""
-    try:
-        # Get data from request
-        data = request.get_json()
+def login_steps(data, ip):
+    """The login endpoint for a parsed body and client address; returns (body, status)
 
+    A flow (api.steps) shared with the ASGI app, so both servers throttle, hash and issue tokens alike.
+    """
+    try:
         if not data:
-            return jsonify({"message": "No data provided"}), 400
+            return {"message": "No data provided"}, 400
 
         email = data.get('email', '').strip().lower()
         password = data.get('password', '')
 
         # Validate input
         if not email or not password:
-            return jsonify({"message": "Email and password are required"}), 400
+            return {"message": "Email and password are required"}, 400
 
-        # Find user using your static method
-        user = User.get_user_by_email(email)
+        # Throttle per IP and per account before any lookup or hashing
+        login_limiter.check(ip, email)
 
-        if not user or not user.check_password(password):
-            return jsonify({"message": "Invalid email or password"}), 401
+        # Only id, password and is_active, served from the covering index. When the email filter
+        # rules the email out, only users created since its last refresh (on any process) can match
+        params = {"email": canonical_email(email)}
+        filtered_out = not email_filter.might_exist(email)
+        if filtered_out:
+            params["after_id"] = email_filter.unseen_after()
+        login_row = yield ReadRow(LOGIN_USER_BY_EMAIL_AFTER_ID if filtered_out else LOGIN_USER_BY_EMAIL, params)
 
-        if not user.is_active:
-            return jsonify({"message": "Account is deactivated"}), 401
+        # Unknown emails still pay for one hash, so timing does not reveal them
+        if not login_row:
+            if not filtered_out:
+                email_filter.record_false_positive()
+            yield VerifyPassword(None, password)
+            login_limiter.record_failure(ip, email)
+            return {"message": "Invalid email or password"}, 401
 
-        # Update last login
-        user.update_last_login()
+        if filtered_out:
+            email_filter.add(email)
 
-        # Generate token
-        token = user.generate_token()
+        if not (yield VerifyPassword(login_row.password, password)):
+            login_limiter.record_failure(ip, email)
+            return {"message": "Invalid email or password"}, 401
+
+        if not login_row.is_active:
+            return {"message": "Account is deactivated"}, 401
+
+        yield UpgradePasswordHash(login_row.id, login_row.password, password)
+
+        # Record last login (flushed in the background, no write here)
+        last_login_recorder.record(login_row.id)
+
+        # The rest of the user is read by primary key only once the password checked out
+        user = yield ReadRow(SERIALIZED_USER_BY_ID, {"user_id": login_row.id})
+        if user is None:
+            # Deleted between the two reads
+            return {"message": "Invalid email or password"}, 401
+
+        # Generate a short-lived access token and a rotating refresh token
+        token = User.generate_token(user)
 
         if not token:
-            return jsonify({"message": "Could not generate token"}), 500
+            return {"message": "Could not generate token"}, 500
 
-        return jsonify({
+        user_data = User.serialize_fields(user)
+        refresh_token = yield IssueRefreshToken(user.id)
+
+        return {
             "message": "Login successful",
             "token": token,
-            "user": user.serialize()
-        }), 200
+            "refresh_token": refresh_token,
+            "expires_in": current_app.config.get('ACCESS_TOKEN_TTL', 900),
+            "user": user_data
+        }, 200
 
-    except Exception as e:
-        print(f"Login error: {str(e)}")
-        return jsonify({"message": "Internal server error"}), 500
+    except APIException:
+        raise
+    except Exception:
+        logger.exception("Login error")
+        return {"message": "Internal server error"}, 500
 
-@api.route('/validate-token', methods=['POST'])
-def validate_token():
-    """Validate if token is still valid"""
+def login_user(data, ip):
+    return run_steps(login_steps(data, ip))
+
+@api.route('/login', methods=['POST'])
+def login():
+    """User login endpoint"""
+    body, status = login_user(request.get_json(silent=True), client_ip())
+    return jsonify(body), status
+
+def check_token_steps(data):
+    """The validate-token endpoint for a parsed body; returns (body, status), a flow shared with api.asgi"""
     try:
-        data = request.get_json()
         token = data.get('token') if data else None
 
         if not token:
-            return jsonify({"valid": False, "message": "Token is required"}), 400
+            return {"valid": False, "message": "Token is required"}, 400
 
-        # Decode token using your static method
-        payload = User.decode_token(token)
+        payload, user = yield from authenticate_steps(token)
 
         if not payload:
-            return jsonify({"valid": False, "message": "Invalid or expired token"}), 401
+            return {"valid": False, "message": "Invalid or expired token"}, 401
 
-        # Get user from database
-        user = User.query.get(payload['user_id'])
-
-        if not user or not user.is_active:
-            return jsonify({"valid": False, "message": "User not found or inactive"}), 401
+        if not user or not user['is_active']:
+            return {"valid": False, "message": "User not found or inactive"}, 401
 
-        return jsonify({
+        return {
             "valid": True,
-            "user": user.serialize()
-        }), 200
+            "user": user
+        }, 200
+
+    except Exception:
+        logger.exception("Token validation error")
+        return {"valid": False, "message": "Internal server error"}, 500
+
+def check_token(data):
+    return run_steps(check_token_steps(data))
+
+@api.route('/validate-token', methods=['POST'])
+@read_only
+def validate_token():
+    """Validate if token is still valid"""
+    body, status = check_token(request.get_json(silent=True))
+    return jsonify(body), status
 
-    except Exception as e:
-        print(f"Token validation error: {str(e)}")
-        return jsonify({"valid": False, "message": "Internal server error"}), 500
+@api.route('/validate-tokens', methods=['POST'])
+def validate_tokens():
+    """Validate a batch of tokens; users are loaded in one query and results keep the input order"""
+    try:
+        data = request.get_json(silent=True)
+        tokens = data.get('tokens') if data else None
+
+        if not isinstance(tokens, list) or not tokens:
+            return jsonify({"message": "tokens must be a non-empty list"}), 400
+
+        batch_max = current_app.config.get('VALIDATE_TOKENS_MAX', VALIDATE_TOKENS_MAX)
+        if len(tokens) > batch_max:
+            return jsonify({"message": f"At most {batch_max} tokens per request"}), 400
+
+        # Decode everything first, remembering which positions wait on which user
+        resolved = [(None, None)] * len(tokens)
+        pending = {}
+        for index, token in enumerate(tokens):
+            if not isinstance(token, str) or not token:
+                continue
+            cached = cached_auth(token)
+            if cached:
+                resolved[index] = cached
+                continue
+            payload = User.decode_token(token)
+            if payload:
+                resolved[index] = (payload, None)
+                pending.setdefault(payload['user_id'], []).append(index)
+
+        users = User.get_serialized_many(pending)
+        for user_id, indexes in pending.items():
+            user = users.get(user_id)
+            for index in indexes:
+                payload = resolved[index][0]
+                resolved[index] = (payload, user)
+                if user:
+                    token_cache.put(tokens[index], payload, user)
+
+        results = []
+        for payload, user in resolved:
+            if not payload:
+                results.append({"valid": False, "message": "Invalid or expired token"})
+            elif not user or not user['is_active']:
+                results.append({"valid": False, "message": "User not found or inactive"})
+            else:
+                results.append({"valid": True, "user": user})
+
+        return json_response({"results": results})
+
+    except Exception:
+        logger.exception("Batch token validation error")
+        return jsonify({"message": "Internal server error"}), 500
 
 @api.route('/protected', methods=['GET'])
+@read_only
+@require_auth
 def protected():
     """Protected route that requires authentication"""
+    return jsonify({
+        "message": "Access granted to protected route",
+        "user": g.current_user
+    }), 200
+
+@api.route('/user/profile', methods=['GET'])
+@read_only
+@require_auth(active_only=False)
+def get_profile():
+    """Get current user profile"""
+    return jsonify({
+        "user": g.current_user
+    }), 200
+
+@api.route('/users', methods=['GET'])
+@read_only
+@require_auth(admin_only=True)
+def list_users():
+    """List users a page at a time, ordered by id (pass next_after_id back as after_id); admins only"""
     try:
-        # Get token from Authorization header
-        auth_header = request.headers.get('Authorization')
+        after_id = request.args.get('after_id', 0, type=int)
+        limit = request.args.get('limit', USERS_PAGE_DEFAULT, type=int)
+        if after_id < 0 or limit < 1:
+            return jsonify({"message": "after_id must be >= 0 and limit must be >= 1"}), 400
+        limit = min(limit, USERS_PAGE_MAX)
+
+        # Rows go to the encoder as-is; it writes the timestamps in serialize_fields' ISO format
+        rows = User.get_page(after_id, limit)
+        return json_response({
+            "users": [row._asdict() for row in rows],
+            "next_after_id": rows[-1].id if len(rows) == limit else None
+        }, iso_datetimes=True)
+
+    except Exception:
+        logger.exception("List users error")
+        return jsonify({"message": "Internal server error"}), 500
 
-        if not auth_header:
-            return jsonify({"message": "Authorization header is required"}), 401
+@api.route('/token/refresh', methods=['POST'])
+def refresh_access_token():
+    """Exchange a refresh token for a new access token; the refresh token is rotated"""
+    try:
+        data = request.get_json(silent=True)
+        raw_token = data.get('refresh_token') if data else None
 
-        # Extract token from "Bearer <token>"
-        try:
-            token = auth_header.split(" ")[1]
-        except IndexError:
-            return jsonify({"message": "Invalid authorization header format"}), 401
+        if not raw_token:
+            return jsonify({"message": "Refresh token is required"}), 400
 
-        # Decode token
-        payload = User.decode_token(token)
+        user_id, new_refresh_token = RefreshToken.rotate(raw_token)
 
-        if not payload:
-            return jsonify({"message": "Invalid or expired token"}), 401
+        if not user_id:
+            return jsonify({"message": "Invalid or expired refresh token"}), 401
 
-        # Get user from database
-        user = User.query.get(payload['user_id'])
+        user = User.query.get(user_id)
 
         if not user or not user.is_active:
+            RefreshToken.revoke(new_refresh_token)
+            db.session.commit()
             return jsonify({"message": "User not found or inactive"}), 401
 
+        token = user.generate_token()
+
+        if not token:
+            return jsonify({"message": "Could not generate token"}), 500
+
         return jsonify({
-            "message": "Access granted to protected route",
-            "user": user.serialize()
+            "token": token,
+            "refresh_token": new_refresh_token,
+            "expires_in": current_app.config.get('ACCESS_TOKEN_TTL', 900)
         }), 200
 
-    except Exception as e:
-        print(f"Protected route error: {str(e)}")
+    except Exception:
+        db.session.rollback()
+        logger.exception("Token refresh error")
         return jsonify({"message": "Internal server error"}), 500
 
-@api.route('/user/profile', methods=['GET'])
-def get_profile():
-    """Get current user profile"""
+@api.route('/logout', methods=['POST'])
+def logout():
+    """Logout endpoint: revokes the access token and, if given, the refresh token's session"""
     try:
-        # Get token from Authorization header
-        auth_header = request.headers.get('Authorization')
-
-        if not auth_header:
-            return jsonify({"message": "Authorization header is required"}), 401
-
-        try:
-            token = auth_header.split(" ")[1]
-        except IndexError:
-            return jsonify({"message": "Invalid authorization header format"}), 401
-
-        # Decode token
-        payload = User.decode_token(token)
-
-        if not payload:
-            return jsonify({"message": "Invalid or expired token"}), 401
-
-        # Get user from database
-        user = User.query.get(payload['user_id'])
-
-        if not user:
-            return jsonify({"message": "User not found"}), 404
+        token = bearer_token(request.headers.get('Authorization'))
+        if token:
+            payload = User.decode_token(token)
+            if payload:
+                token_denylist.revoke(payload.get('jti'), payload['exp'])
+                token_cache.discard(token)
+                # Other workers pick the revocation up from here on their next denylist sync
+                if payload.get('jti'):
+                    RevokedToken.revoke(payload['jti'], payload['exp'])
+
+        data = request.get_json(silent=True) or {}
+        if data.get('refresh_token'):
+            RefreshToken.revoke(data['refresh_token'])
+        db.session.commit()
 
         return jsonify({
-            "user": user.serialize()
+            "message": "Logout successful. Please remove token from client storage."
         }), 200
 
-    except Exception as e:
-        print(f"Profile error: {str(e)}")
-        return jsonify({"message": "Internal server error"}), 500
-
-@api.route('/logout', methods=['POST'])
-def logout():
-    """Logout endpoint (client-side token removal)"""
-    return jsonify({
-        "message": "Logout successful. Please remove token from client storage."
-    }), 200
\ No newline at end of file
+    except Exception:
+        db.session.rollback()
+        logger.exception("Logout error")
+        return jsonify({"message": "Internal server error"}), 500
\ No newline at end of file
@@ -0,0 +1,162 @@
+"""
+Front-end file serving from a manifest built once at startup, with ETags, long-lived caching
+for content-hashed assets and precompressed .br/.gz siblings
+"""
+import gzip
+import hashlib
+import mimetypes
+import os
+import re
+from werkzeug.wsgi import wrap_file
+
+# vite build writes fingerprinted files like assets/index-4f2a1b3c.js; only those are immutable
+HASHED_DIR = 'assets/'
+HASHED_NAME = re.compile(r'[.-][A-Za-z0-9_-]{8,}\.[A-Za-z0-9]+$')
+ENCODINGS = (('br', '.br'), ('gzip', '.gz'))
+COMPRESSIBLE_TYPES = ('text/', 'application/javascript', 'application/json', 'image/svg+xml',
+                      'application/xml', 'image/x-icon', 'image/vnd.microsoft.icon')
+IMMUTABLE_MAX_AGE = 365 * 24 * 3600
+
+
+def _etag(path):
+    digest = hashlib.blake2b(digest_size=16)
+    with open(path, 'rb') as f:
+        for chunk in iter(lambda: f.read(65536), b''):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+def accepted_encodings(header):
+    """Codings the client accepts, from an Accept-Encoding header (q=0 means refused)"""
+    accepted = set()
+    for part in (header or '').split(','):
+        coding, _, params = part.strip().partition(';')
+        quality = params.strip()
+        if quality.startswith('q=') and quality[2:].strip() in ('0', '0.0', '0.00', '0.000'):
+            continue
+        if coding:
+            accepted.add(coding.strip().lower())
+    return accepted
+
+
+class StaticAsset:
+    """One servable file: its variants as (path, size, etag) keyed by content coding ('' = identity)"""
+
+    def __init__(self, name, path, mimetype, immutable):
+        self.name = name
+        self.mimetype = mimetype
+        self.immutable = immutable
+        self.variants = {'': (path, os.path.getsize(path), _etag(path))}
+
+    def add_variant(self, coding, path):
+        base_etag = self.variants[''][2]
+        self.variants[coding] = (path, os.path.getsize(path), f"{base_etag}-{coding}")
+
+    def pick(self, accept_encoding):
+        """(coding, path, size, etag) of the best variant for this Accept-Encoding"""
+        if len(self.variants) > 1:
+            accepted = accepted_encodings(accept_encoding)
+            for coding, _ in ENCODINGS:
+                if coding in self.variants and coding in accepted:
+                    return (coding,) + self.variants[coding]
+        return ('',) + self.variants['']
+
+
+class StaticFiles:
+    """Serves a directory of built front-end files without touching the filesystem metadata per request"""
+
+    def __init__(self, app=None, directory=None):
+        self.directory = None
+        self.index = 'index.html'
+        self.reload = False
+        self.manifest = {}
+        if app is not None:
+            self.init_app(app, directory)
+
+    def init_app(self, app, directory):
+        self.directory = os.path.realpath(directory)
+        # In debug the front-end is rebuilt under us, so rescan on a miss
+        self.reload = bool(app.config.get('STATIC_FILES_RELOAD', app.debug))
+        self.build_manifest()
+        app.extensions['static_files'] = self
+
+    def build_manifest(self):
+        """Index every file under directory, pairing each with its precompressed siblings"""
+        manifest = {}
+        if os.path.isdir(self.directory):
+            siblings = []
+            for root, _, files in os.walk(self.directory):
+                for filename in files:
+                    path = os.path.join(root, filename)
+                    name = os.path.relpath(path, self.directory).replace(os.sep, '/')
+                    if filename.endswith(tuple(suffix for _, suffix in ENCODINGS)):
+                        siblings.append((name, path))
+                        continue
+                    mimetype = mimetypes.guess_type(filename)[0] or 'application/octet-stream'
+                    immutable = name.startswith(HASHED_DIR) and bool(HASHED_NAME.search(filename))
+                    manifest[name] = StaticAsset(name, path, mimetype, immutable)
+            for name, path in siblings:
+                for coding, suffix in ENCODINGS:
+                    if name.endswith(suffix) and name[:-len(suffix)] in manifest:
+                        manifest[name[:-len(suffix)]].add_variant(coding, path)
+        self.manifest = manifest
+        return len(manifest)
+
+    def lookup(self, name):
+        asset = self.manifest.get(name)
+        if asset is None and self.reload:
+            self.build_manifest()
+            asset = self.manifest.get(name)
+        return asset
+
+    def response(self, name, request, response_class):
+        """Serve name, or index.html for unknown paths so client-side routes still load"""
+        asset = self.lookup(name) or self.lookup(self.index)
+        if asset is None:
+            return None
+
+        coding, path, size, etag = asset.pick(request.headers.get('Accept-Encoding'))
+        response = response_class(wrap_file(request.environ, open(path, 'rb')),
+                                  mimetype=asset.mimetype, direct_passthrough=True)
+        response.content_length = size
+        if coding:
+            response.content_encoding = coding
+        if len(asset.variants) > 1:
+            response.vary.add('Accept-Encoding')
+        response.set_etag(etag)
+        if asset.immutable:
+            response.cache_control.public = True
+            response.cache_control.max_age = IMMUTABLE_MAX_AGE
+            response.cache_control.immutable = True
+        else:
+            # index.html and unhashed files: cache, but ask with If-None-Match every time
+            response.cache_control.no_cache = True
+        return response.make_conditional(request)
+
+    def compress(self, min_size=1024):
+        """Write .gz (and .br, when the brotli package is installed) siblings; returns files written"""
+        try:
+            import brotli
+        except ImportError:
+            brotli = None
+
+        written = 0
+        for asset in list(self.manifest.values()):
+            path, size, _ = asset.variants['']
+            if size < min_size or not asset.mimetype.startswith(COMPRESSIBLE_TYPES):
+                continue
+            with open(path, 'rb') as f:
+                data = f.read()
+            outputs = [('.gz', gzip.compress(data, compresslevel=9, mtime=0))]
+            if brotli is not None:
+                outputs.append(('.br', brotli.compress(data, quality=11)))
+            for suffix, compressed in outputs:
+                if len(compressed) < size:
+                    with open(path + suffix, 'wb') as f:
+                        f.write(compressed)
+                    written += 1
+        self.build_manifest()
+        return written
+
+
+static_files = StaticFiles()
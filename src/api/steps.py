@@ -0,0 +1,67 @@
+"""
+I/O steps of the shared auth flows in api.routes, so one copy of the logic serves both servers
+
+A flow is a generator: wherever it needs the database or the password hashing pool it yields one
+of these steps and is sent the result back (or has the step's exception thrown into it).
+run_steps() performs them inline for the Flask views; api.asgi awaits the same steps on the async
+engine and the hash pool.
+"""
+from typing import NamedTuple
+from api.hashing import hash_executor
+from api.models import db, User, RefreshToken
+from api.replica import execute_read
+
+
+class ReadRow(NamedTuple):
+    """First row of a read-only statement, or None"""
+    statement: object
+    params: dict
+
+
+class VerifyPassword(NamedTuple):
+    """Check a password against a stored hash; pwhash None pays for a dummy check and is False"""
+    pwhash: object
+    password: str
+
+
+class UpgradePasswordHash(NamedTuple):
+    """User.upgrade_password_hash after a successful check"""
+    user_id: int
+    stored_hash: str
+    password: str
+
+
+class IssueRefreshToken(NamedTuple):
+    """Store a new refresh token for a user and commit; the result is the raw token"""
+    user_id: int
+
+
+def perform(step):
+    if isinstance(step, ReadRow):
+        return execute_read(db.session, step.statement, step.params).first()
+    if isinstance(step, VerifyPassword):
+        if step.pwhash is None:
+            return hash_executor.verify_dummy(step.password)
+        return hash_executor.verify_password(step.pwhash, step.password)
+    if isinstance(step, UpgradePasswordHash):
+        return User.upgrade_password_hash(step.user_id, step.stored_hash, step.password)
+    if isinstance(step, IssueRefreshToken):
+        refresh_token = RefreshToken.issue(step.user_id)
+        db.session.commit()
+        return refresh_token
+    raise TypeError(f"Unknown step {step!r}")
+
+
+def run_steps(flow):
+    """Drive a flow to completion with blocking I/O and return its result"""
+    value, error = None, None
+    while True:
+        try:
+            step = flow.throw(error) if error is not None else flow.send(value)
+        except StopIteration as done:
+            return done.value
+        try:
+            value, error = perform(step), None
+        except Exception as e:
+            db.session.rollback()
+            value, error = None, e
@@ -0,0 +1,140 @@
+"""
+In-process LRU+TTL cache of verified tokens, so repeat requests skip jwt.decode and the user lookup
+
+Invalidation only reaches this worker's cache, so TOKEN_CACHE_TTL is kept short: it is how long
+other workers may go on serving a deactivated user.
+"""
+import hashlib
+import threading
+import time
+from collections import OrderedDict
+
+
+class TokenCache:
+    """Maps a token digest to its decoded claims and a serialized user snapshot"""
+
+    def __init__(self, app=None):
+        self.maxsize = 10000
+        self.ttl = 5
+        self.replica_lag_seconds = 5.0
+        self._entries = OrderedDict()
+        self._by_user = {}
+        self._invalidated_at = {}
+        self._lock = threading.Lock()
+        self._counters = {
+            "hits": 0,
+            "misses": 0,
+            "evictions": 0,
+            "expirations": 0,
+            "invalidations": 0,
+        }
+        if app is not None:
+            self.init_app(app)
+
+    def init_app(self, app):
+        self.maxsize = int(app.config.get('TOKEN_CACHE_SIZE', self.maxsize))
+        self.ttl = int(app.config.get('TOKEN_CACHE_TTL', self.ttl))
+        # Replicas are assumed to catch up within the read-your-writes window
+        self.replica_lag_seconds = float(app.config.get(
+            'REPLICA_READ_YOUR_WRITES_SECONDS', self.replica_lag_seconds))
+        app.extensions['token_cache'] = self
+
+    @staticmethod
+    def _key(token):
+        return hashlib.sha256(token.encode('utf-8')).digest()
+
+    def _drop(self, key):
+        entry = self._entries.pop(key, None)
+        if entry is not None:
+            keys = self._by_user.get(entry[3])
+            if keys is not None:
+                keys.discard(key)
+                if not keys:
+                    del self._by_user[entry[3]]
+        return entry
+
+    def get(self, token):
+        """Return (claims, user) for a cached token, or None"""
+        if self.maxsize <= 0:
+            return None
+        key = self._key(token)
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                self._counters["misses"] += 1
+                return None
+            if entry[0] <= time.time():
+                self._drop(key)
+                self._counters["expirations"] += 1
+                self._counters["misses"] += 1
+                return None
+            self._entries.move_to_end(key)
+            self._counters["hits"] += 1
+            return entry[1], entry[2]
+
+    def put(self, token, claims, user, from_replica=False):
+        """Cache a verified token until the earlier of the TTL and the token's own exp
+
+        A user read from a replica just after this worker invalidated them may be the row from
+        before the change, so it is not cached until the replica has had time to catch up.
+        """
+        if self.maxsize <= 0:
+            return
+        if from_replica:
+            invalidated_at = self._invalidated_at.get(user["id"])
+            if invalidated_at is not None and time.monotonic() - invalidated_at < self.replica_lag_seconds:
+                return
+        expires_at = time.time() + self.ttl
+        if claims.get('exp') is not None:
+            expires_at = min(expires_at, float(claims['exp']))
+        if expires_at <= time.time():
+            return
+
+        key = self._key(token)
+        user_id = user["id"]
+        with self._lock:
+            self._drop(key)
+            self._entries[key] = (expires_at, claims, user, user_id)
+            self._by_user.setdefault(user_id, set()).add(key)
+            while len(self._entries) > self.maxsize:
+                oldest = next(iter(self._entries))
+                self._drop(oldest)
+                self._counters["evictions"] += 1
+
+    def discard(self, token):
+        """Forget a single token, e.g. after logout"""
+        with self._lock:
+            self._drop(self._key(token))
+
+    def invalidate_user(self, user_id):
+        """Forget every cached token that belongs to a user"""
+        now = time.monotonic()
+        with self._lock:
+            if self.replica_lag_seconds > 0:
+                # Only recent invalidations matter to put(); older ones are dropped as new ones arrive
+                horizon = now - self.replica_lag_seconds
+                for stale in [uid for uid, at in self._invalidated_at.items() if at < horizon]:
+                    del self._invalidated_at[stale]
+                self._invalidated_at[user_id] = now
+            keys = self._by_user.pop(user_id, ())
+            for key in keys:
+                self._entries.pop(key, None)
+            if keys:
+                self._counters["invalidations"] += len(keys)
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            self._by_user.clear()
+            self._invalidated_at.clear()
+
+    def stats(self):
+        with self._lock:
+            stats = dict(self._counters)
+            stats["size"] = len(self._entries)
+        stats["maxsize"] = self.maxsize
+        stats["ttl"] = self.ttl
+        return stats
+
+
+token_cache = TokenCache()
@@ -1,107 +1,301 @@
+import hmac
 import os
-from flask import Flask, jsonify, send_from_directory
-from flask_migrate import Migrate
-from flask_cors import CORS
+from flask import Flask, Response, jsonify, request
+from werkzeug.middleware.proxy_fix import ProxyFix
 from api.models import db
+from api.db_pool import engine_options, pool_stats, dispose_engines_after_fork, replica_binds
+from api.hashing import default_workers, hash_executor
+from api.token_cache import token_cache
+from api.denylist import token_denylist
+from api.last_login import last_login_recorder
+from api.health import readiness_probe
+from api.ratelimit import login_limiter
+from api.bloom import email_filter
+from api.keys import key_manager
+from api.json_provider import FastJSONProvider
+from api.static_files import static_files
+from api.cors import cors, DEFAULT_ORIGINS
+from api.logs import log_pipeline, DEFAULT_SAMPLE_RATES
+from api.replica import replica_router
+from api import metrics
 from api.routes import api
 from api.utils import APIException, generate_sitemap
-from api.commands import setup_commands
 
 ENV = os.getenv("FLASK_DEBUG", "0") == "1"
+# vite build output (vite.config.js outDir): index.html plus content-hashed assets/
 static_file_dir = os.path.join(os.path.dirname(
-    os.path.realpath(__file__)), '../public/')
+    os.path.realpath(__file__)), '../dist/')
 
-app = Flask(__name__)
-app.url_map.strict_slashes = False
 
-# Database configuration
-db_url = os.getenv("DATABASE_URL")
-if db_url is not None and db_url.startswith("postgres://"):
-    db_url = db_url.replace("postgres://", "postgresql://", 1)
+def create_app(config=None):
+    """Build the app. Safe to call in a gunicorn --preload master: nothing here opens a connection
+    or starts a thread, and the CLI-only and admin-only modules are imported only when needed."""
+    app = Flask(__name__)
+    app.url_map.strict_slashes = False
+    # orjson-backed when installed; jsonify and request.get_json() go through it
+    app.json = FastJSONProvider(app)
 
-app.config['SQLALCHEMY_DATABASE_URI'] = db_url
-app.config['SQLALCHEMY_TRACK_MODIFICATIONS'] = False
-app.config['JWT_SECRET_KEY'] = os.getenv(
-    'FLASK_APP_KEY', 'your-secret-key-change-in-production')
-app.config['DEBUG'] = ENV
+    configure(app)
+    if config:
+        app.config.update(config)
+        if 'SQLALCHEMY_ENGINE_OPTIONS' not in config:
+            app.config['SQLALCHEMY_ENGINE_OPTIONS'] = engine_options(app.config['SQLALCHEMY_DATABASE_URI'])
 
-# Initialize CORS with proper origins
-CORS(app, origins=[
-    "http://localhost:3000",
-    "https://*.gitpod.io",
-    "https://*.github.dev",
-    # Your specific Codespaces URL (fixed spelling)
-    "https://fuzzy-enigma-q7xp59vrgwggcwx6-3000.app.github.dev"
-])
+    # Initialize extensions; logging first so the others' startup errors are captured
+    log_pipeline.init_app(app)
+    db.init_app(app)
+    replica_router.init_app(app)
+    hash_executor.init_app(app)
+    token_cache.init_app(app)
+    token_denylist.init_app(app)
+    last_login_recorder.init_app(app)
+    readiness_probe.init_app(app)
+    login_limiter.init_app(app)
+    email_filter.init_app(app)
+    key_manager.init_app(app)
+    metrics.init_app(app)
+    static_files.init_app(app, app.config['STATIC_FILES_DIR'])
+    cors.init_app(app)
+    # Forked workers must not share the master's pooled connections
+    dispose_engines_after_fork(app)
+    if app.config['PROXY_FIX_X_FOR']:
+        # Outermost, so everything below sees the client address the trusted proxy recorded
+        app.wsgi_app = ProxyFix(app.wsgi_app, x_for=app.config['PROXY_FIX_X_FOR'])
 
-# Initialize extensions
-db.init_app(app)
-Migrate(app, db)
+    if app.config['ADMIN_ENABLED']:
+        from api.admin import setup_admin
+        setup_admin(app)
 
-# Setup CLI commands
-setup_commands(app)
+    # Migrate and the CLI commands (alembic, csv, the benchmarks) are only needed by `flask ...`
+    if os.environ.get('FLASK_RUN_FROM_CLI') == 'true':
+        from flask_migrate import Migrate
+        from api.commands import setup_commands
+        Migrate(app, db)
+        setup_commands(app)
 
-# Register blueprints
-app.register_blueprint(api, url_prefix='/api')
+    # Register blueprints
+    app.register_blueprint(api, url_prefix='/api')
+    register_routes(app)
+    return app
 
-# Error handlers
 
+def configure(app):
+    """app.config from the environment"""
+    # Database configuration
+    db_url = os.getenv("DATABASE_URL")
+    if db_url is not None and db_url.startswith("postgres://"):
+        db_url = db_url.replace("postgres://", "postgresql://", 1)
 
-@app.errorhandler(APIException)
-def handle_invalid_usage(error):
-    return jsonify(error.to_dict()), error.status_code
+    app.config['SQLALCHEMY_DATABASE_URI'] = db_url
+    app.config['SQLALCHEMY_TRACK_MODIFICATIONS'] = False
+    app.config['SQLALCHEMY_ENGINE_OPTIONS'] = engine_options(db_url)
 
+    # Read replicas (comma-separated URLs) for the read-only endpoints. A caller whose token is
+    # younger than REPLICA_READ_YOUR_WRITES_SECONDS reads from the primary; a replica failing its
+    # background probe (every REPLICA_HEALTH_CHECK_SECONDS) or a read is skipped for REPLICA_RETRY_SECONDS
+    app.config['SQLALCHEMY_BINDS'] = replica_binds(os.getenv('REPLICA_DATABASE_URLS'))
+    app.config['REPLICA_READ_YOUR_WRITES_SECONDS'] = float(os.getenv('REPLICA_READ_YOUR_WRITES_SECONDS', 5))
+    app.config['REPLICA_HEALTH_CHECK_SECONDS'] = float(os.getenv('REPLICA_HEALTH_CHECK_SECONDS', 5))
+    app.config['REPLICA_RETRY_SECONDS'] = float(os.getenv('REPLICA_RETRY_SECONDS', 30))
+    app.config['JWT_SECRET_KEY'] = os.getenv(
+        'FLASK_APP_KEY', 'your-secret-key-change-in-production')
 
-@app.errorhandler(404)
-def not_found(error):
-    return jsonify({"error": "Endpoint not found"}), 404
+    # Token signing; with JWT_KEYS_DIR set tokens are signed with the asymmetric key
+    # named by JWT_ACTIVE_KID and verifiable by anyone through /.well-known/jwks.json
+    app.config['JWT_KEYS_DIR'] = os.getenv('JWT_KEYS_DIR')
+    app.config['JWT_ACTIVE_KID'] = os.getenv('JWT_ACTIVE_KID')
+    app.config['JWT_ISSUER'] = os.getenv('JWT_ISSUER')
+    app.config['JWKS_MAX_AGE'] = int(os.getenv('JWKS_MAX_AGE', 3600))
+    app.config['DEBUG'] = ENV
 
+    # Password hashing pool ("process", "thread" or "inline"); HASH_WORKERS is per gunicorn worker and
+    # defaults to the CPUs shared out over WEB_CONCURRENCY
+    app.config['HASH_EXECUTOR'] = os.getenv('HASH_EXECUTOR', 'process')
+    app.config['HASH_WORKERS'] = int(os.getenv('HASH_WORKERS', default_workers()))
+    app.config['HASH_QUEUE_DEPTH'] = int(os.getenv('HASH_QUEUE_DEPTH', 64))
+    app.config['HASH_RETRY_AFTER'] = int(os.getenv('HASH_RETRY_AFTER', 1))
 
-@app.errorhandler(500)
-def internal_error(error):
-    return jsonify({"error": "Internal server error"}), 500
+    # Password hash scheme ("pbkdf2", "scrypt" or "argon2") and its cost; see `flask bench-hash`
+    app.config['PASSWORD_HASH_SCHEME'] = os.getenv('PASSWORD_HASH_SCHEME', 'pbkdf2')
+    app.config['PASSWORD_HASH_COST'] = os.getenv('PASSWORD_HASH_COST')
 
-# Routes
+    # Access tokens are short-lived and verified statelessly; refresh tokens rotate and are stored hashed
+    app.config['ACCESS_TOKEN_TTL'] = int(os.getenv('ACCESS_TOKEN_TTL', 900))
+    app.config['REFRESH_TOKEN_TTL'] = int(os.getenv('REFRESH_TOKEN_TTL', 30 * 24 * 3600))
 
+    # Largest batch accepted by POST /api/validate-tokens
+    app.config['VALIDATE_TOKENS_MAX'] = int(os.getenv('VALIDATE_TOKENS_MAX', 100))
 
-@app.route('/')
-def sitemap():
-    if ENV:
-        return generate_sitemap(app)
-    return send_from_directory(static_file_dir, 'index.html')
+    # ASGI mode (SERVER_MODE=asgi): async database URL, defaults to DATABASE_URL through asyncpg/aiosqlite,
+    # and the threads that serve the routes it hands to the Flask app
+    app.config['ASGI_DATABASE_URL'] = os.getenv('ASGI_DATABASE_URL')
+    app.config['ASGI_WSGI_THREADS'] = int(os.getenv('ASGI_WSGI_THREADS', 16))
 
+    # Verified-token cache (entries never outlive the token's exp). Each worker has its own, so the TTL
+    # is also how long another worker may keep serving a user after deactivation or a password change
+    app.config['TOKEN_CACHE_SIZE'] = int(os.getenv('TOKEN_CACHE_SIZE', 10000))
+    app.config['TOKEN_CACHE_TTL'] = int(os.getenv('TOKEN_CACHE_TTL', 5))
+    # How often each worker pulls tokens revoked at logout on other workers from revoked_tokens
+    app.config['TOKEN_DENYLIST_SYNC_SECONDS'] = float(os.getenv('TOKEN_DENYLIST_SYNC_SECONDS', 5))
 
-@app.route('/health')
-def health_check():
-    return jsonify({
-        "status": "healthy",
-        "database": "connected" if db_url else "not configured",
-        "environment": "development" if ENV else "production"
-    }), 200
+    # Last-login times are coalesced and written in one batch every N seconds
+    app.config['LAST_LOGIN_FLUSH_INTERVAL'] = float(
+        os.getenv('LAST_LOGIN_FLUSH_INTERVAL', 5))
 
+    # Readiness: DB probe result is reused for this many seconds across LB polls
+    app.config['READY_CACHE_SECONDS'] = float(os.getenv('READY_CACHE_SECONDS', 5))
+    app.config['READY_MAX_POOL_SATURATION'] = float(
+        os.getenv('READY_MAX_POOL_SATURATION', 0.9))
 
-@app.route('/<path:path>', methods=['GET'])
-def serve_any_other_file(path):
-    if not os.path.isfile(os.path.join(static_file_dir, path)):
-        path = 'index.html'
-    response = send_from_directory(static_file_dir, path)
-    response.cache_control.max_age = 0  # avoid cache memory
-    return response
+    # Login throttling: per-IP token bucket and sliding windows of failed logins per account and IP
+    # (LOGIN_ACCOUNT_LIMIT) and per account from all IPs (LOGIN_ACCOUNT_TOTAL_LIMIT, against spraying)
+    # RATE_LIMIT_BACKEND is "memory" (per process) or "shared" (RATE_LIMIT_STORE="module:factory")
+    app.config['RATE_LIMIT_ENABLED'] = os.getenv('RATE_LIMIT_ENABLED', '1') == '1'
+    app.config['RATE_LIMIT_BACKEND'] = os.getenv('RATE_LIMIT_BACKEND', 'memory')
+    app.config['RATE_LIMIT_STORE'] = os.getenv('RATE_LIMIT_STORE')
+    app.config['RATE_LIMIT_MAX_KEYS'] = int(os.getenv('RATE_LIMIT_MAX_KEYS', 100000))
+    app.config['LOGIN_IP_RATE'] = float(os.getenv('LOGIN_IP_RATE', 1))
+    app.config['LOGIN_IP_BURST'] = int(os.getenv('LOGIN_IP_BURST', 20))
+    app.config['LOGIN_ACCOUNT_LIMIT'] = int(os.getenv('LOGIN_ACCOUNT_LIMIT', 10))
+    app.config['LOGIN_ACCOUNT_TOTAL_LIMIT'] = int(os.getenv('LOGIN_ACCOUNT_TOTAL_LIMIT', 100))
+    app.config['LOGIN_ACCOUNT_WINDOW'] = float(os.getenv('LOGIN_ACCOUNT_WINDOW', 300))
 
+    # Proxies in front of the app that append to X-Forwarded-For: the client address is taken that
+    # many entries from the right, never from the client-controlled left. 0 (the default) ignores the
+    # header, since without a proxy the client writes all of it; render.yaml sets 1
+    app.config['PROXY_FIX_X_FOR'] = int(os.getenv('PROXY_FIX_X_FOR', 0))
 
-@app.after_request
-def after_request(response):
-    # Additional CORS headers for extra compatibility
-    response.headers.add('Access-Control-Allow-Origin', '*')
-    response.headers.add('Access-Control-Allow-Headers',
-                         'Content-Type,Authorization')
-    response.headers.add('Access-Control-Allow-Methods',
-                         'GET,PUT,POST,DELETE,OPTIONS')
-    response.headers.add('Access-Control-Allow-Credentials', 'true')
-    return response
+    # Bloom filter of registered emails; unknown emails only look up users created since its last
+    # refresh instead of scanning the whole table. Each worker refreshes it in the background, and
+    # rechecks ids a scan skipped for EMAIL_FILTER_GAP_SECONDS in case they belong to a transaction
+    # that had not committed yet
+    app.config['EMAIL_FILTER_ENABLED'] = os.getenv('EMAIL_FILTER_ENABLED', '1') == '1'
+    app.config['EMAIL_FILTER_CAPACITY'] = int(os.getenv('EMAIL_FILTER_CAPACITY', 1000000))
+    app.config['EMAIL_FILTER_ERROR_RATE'] = float(os.getenv('EMAIL_FILTER_ERROR_RATE', 0.01))
+    app.config['EMAIL_FILTER_REFRESH_SECONDS'] = float(
+        os.getenv('EMAIL_FILTER_REFRESH_SECONDS', 5))
+    app.config['EMAIL_FILTER_GAP_SECONDS'] = float(os.getenv('EMAIL_FILTER_GAP_SECONDS', 60))
+
+    # Front-end files are indexed once at startup; in debug the index is rebuilt when a file is missing
+    app.config['STATIC_FILES_DIR'] = os.getenv('STATIC_FILES_DIR', static_file_dir)
+    app.config['STATIC_FILES_RELOAD'] = os.getenv('STATIC_FILES_RELOAD', '1' if ENV else '0') == '1'
+
+    # /metrics and /metrics/pool are only served with METRICS_ENABLED=1, and with METRICS_TOKEN set
+    # only to "Authorization: Bearer <token>"; set PROMETHEUS_MULTIPROC_DIR under gunicorn so all
+    # workers are aggregated
+    app.config['METRICS_ENABLED'] = os.getenv('METRICS_ENABLED', '0') == '1'
+    app.config['METRICS_TOKEN'] = os.getenv('METRICS_TOKEN')
+    app.config['PROMETHEUS_MULTIPROC_DIR'] = os.getenv('PROMETHEUS_MULTIPROC_DIR')
+    app.config['METRICS_SYNC_SECONDS'] = float(os.getenv('METRICS_SYNC_SECONDS', 5))
+
+    # CORS: comma-separated origins, "*" matches subdomains; preflights are cached for CORS_MAX_AGE seconds
+    cors_origins = os.getenv('CORS_ORIGINS')
+    app.config['CORS_ORIGINS'] = [origin.strip() for origin in cors_origins.split(',')] \
+        if cors_origins else list(DEFAULT_ORIGINS)
+    app.config['CORS_MAX_AGE'] = int(os.getenv('CORS_MAX_AGE', 600))
+
+    # Logs: JSON lines written by a listener thread; records are dropped, never waited on, when
+    # LOG_QUEUE_SIZE are pending. LOG_SAMPLE_RATES keeps that fraction of each noisy event per endpoint
+    app.config['LOG_LEVEL'] = os.getenv('LOG_LEVEL', 'INFO')
+    app.config['LOG_QUEUE_SIZE'] = int(os.getenv('LOG_QUEUE_SIZE', 10000))
+    app.config['LOG_SAMPLE_RATES'] = os.getenv('LOG_SAMPLE_RATES', DEFAULT_SAMPLE_RATES)
+
+    # Marks a throwaway database that benchmarks may seed and VACUUM (flask bench-login-lookup,
+    # bench-api and bench-capacity)
+    app.config['BENCH_DATABASE'] = os.getenv('BENCH_DATABASE', '0') == '1'
+
+    # flask_admin at /admin; off by default so the serving path never imports it
+    app.config['ADMIN_ENABLED'] = os.getenv('ADMIN_ENABLED', '0') == '1'
+
+
+def register_metrics_routes(app):
+    """/metrics and /metrics/pool, behind METRICS_TOKEN when one is configured"""
+
+    def unauthorized():
+        token = app.config.get('METRICS_TOKEN')
+        if token and not hmac.compare_digest(request.headers.get('Authorization', ''), f'Bearer {token}'):
+            return jsonify({"message": "Invalid or missing metrics token"}), 401
+        return None
+
+    @app.route('/metrics')
+    def prometheus_metrics():
+        return unauthorized() or Response(metrics.registry.render(),
+                                          mimetype='text/plain; version=0.0.4')
+
+    @app.route('/metrics/pool')
+    def pool_metrics():
+        return unauthorized() or (jsonify(pool_stats(db.engine)), 200)
+
+
+def register_routes(app):
+    """Error handlers and the routes outside the /api blueprint"""
+
+    # Error handlers
+    @app.errorhandler(APIException)
+    def handle_invalid_usage(error):
+        return jsonify(error.to_dict()), error.status_code, getattr(error, 'headers', None)
+
+    @app.errorhandler(404)
+    def not_found(error):
+        return jsonify({"error": "Endpoint not found"}), 404
+
+    @app.errorhandler(500)
+    def internal_error(error):
+        return jsonify({"error": "Internal server error"}), 500
+
+    # Routes
+
+    @app.route('/')
+    def sitemap():
+        if ENV:
+            return generate_sitemap(app)
+        return serve_any_other_file('index.html')
+
+    @app.route('/health')
+    def health_check():
+        """Liveness: the process is up and serving; never touches the database"""
+        return jsonify({
+            "status": "healthy",
+            "database": "configured" if app.config['SQLALCHEMY_DATABASE_URI'] else "not configured",
+            "environment": "development" if ENV else "production",
+            "hashing": hash_executor.stats(),
+            "token_cache": token_cache.stats(),
+            "last_login": last_login_recorder.stats(),
+            "replicas": replica_router.stats()
+        }), 200
+
+    @app.route('/ready')
+    def readiness_check():
+        """Readiness: 503 tells the load balancer to drain this node"""
+        ready, checks = readiness_probe.report()
+        return jsonify({
+            "status": "ready" if ready else "not ready",
+            "checks": checks
+        }), 200 if ready else 503
+
+    @app.route('/.well-known/jwks.json')
+    def jwks():
+        """Public signing keys, so other services can verify access tokens locally"""
+        body, etag = key_manager.jwks()
+        response = Response(body, mimetype='application/json')
+        response.set_etag(etag)
+        response.cache_control.public = True
+        response.cache_control.max_age = key_manager.jwks_max_age
+        return response.make_conditional(request)
+
+    if app.config['METRICS_ENABLED']:
+        register_metrics_routes(app)
+
+    @app.route('/<path:path>', methods=['GET'])
+    def serve_any_other_file(path):
+        """Front-end files from the startup manifest; unknown paths get index.html"""
+        response = static_files.response(path, request, app.response_class)
+        if response is None:
+            return jsonify({"error": "Endpoint not found"}), 404
+        return response
 
 
 # This only runs if `$ python src/app.py` is executed
 if __name__ == '__main__':
     PORT = int(os.environ.get('PORT', 3001))
-    app.run(host='0.0.0.0', port=PORT, debug=ENV)
+    create_app().run(host='0.0.0.0', port=PORT, debug=ENV)
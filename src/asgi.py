@@ -0,0 +1,8 @@
+# ASGI entry point, the async counterpart of wsgi.py. Selected with SERVER_MODE=asgi (see gunicorn.conf.py)
+# or run directly: uvicorn asgi:application --app-dir src
+
+from app import create_app
+from api.asgi import AsyncAuthAPI
+
+# The async engine and the email filter build are started by the lifespan, in each worker
+application = AsyncAuthAPI(create_app())
@@ -1,7 +1,12 @@
 # This file was created to run the application on heroku using gunicorn.
 # Read more about it here: https://devcenter.heroku.com/articles/python-gunicorn
+#
+# Importing this must stay preload-safe: no threads or connections. The email filter
+# build starts in each worker (gunicorn.conf.py post_worker_init, or on first login).
 
-from app import app as application
+from app import create_app
+
+application = create_app()
 
 if __name__ == "__main__":
     application.run()
@@ -0,0 +1,60 @@
+import pytest
+from app import create_app
+from api.models import db, User
+from api.token_cache import token_cache
+
+TEST_PASSWORD = "123456"
+
+
+def make_app(tmp_path, **config):
+    """The app against a throwaway SQLite file, with cheap hashing and no login throttling"""
+    settings = {
+        "TESTING": True,
+        "SQLALCHEMY_DATABASE_URI": f"sqlite:///{tmp_path / 'primary.db'}",
+        "SQLALCHEMY_BINDS": {},
+        "HASH_EXECUTOR": "thread",
+        "PASSWORD_HASH_SCHEME": "pbkdf2",
+        "PASSWORD_HASH_COST": 1000,
+        "RATE_LIMIT_ENABLED": False,
+        "EMAIL_FILTER_ENABLED": False,
+        "PROMETHEUS_MULTIPROC_DIR": None,
+    }
+    settings.update(config)
+    app = create_app(settings)
+    with app.app_context():
+        db.create_all(bind_key=None)
+    token_cache.clear()
+    return app
+
+
+@pytest.fixture
+def app(tmp_path):
+    app = make_app(tmp_path)
+    yield app
+    with app.app_context():
+        db.session.remove()
+        for engine in db.engines.values():
+            engine.dispose()
+
+
+@pytest.fixture
+def client(app):
+    return app.test_client()
+
+
+def signup(client, email, password=TEST_PASSWORD):
+    return client.post("/api/signup", json={"email": email, "password": password})
+
+
+def login(client, email, password=TEST_PASSWORD):
+    return client.post("/api/login", json={"email": email, "password": password})
+
+
+def make_admin(app, email):
+    with app.app_context():
+        db.session.execute(db.update(User).where(User.email == email).values(is_admin=True))
+        db.session.commit()
+
+
+def bearer(token):
+    return {"Authorization": f"Bearer {token}"}
@@ -0,0 +1,91 @@
+import asyncio
+import json
+import pytest
+from werkzeug.security import generate_password_hash
+from api.asgi import AsyncAuthAPI
+from api.metrics import registry
+from api.models import db, User
+from conftest import signup, bearer
+
+
+def asgi_request(application, method, path, body=None, headers=None):
+    """Send one http request through the ASGI app; returns (status, json body)"""
+    raw_body = json.dumps(body).encode() if body is not None else b''
+    scope = {
+        'type': 'http', 'method': method, 'path': path, 'query_string': b'',
+        'client': ('10.0.0.1', 40000),
+        'headers': [(b'content-type', b'application/json')]
+        + [(name.lower().encode(), value.encode()) for name, value in (headers or {}).items()],
+    }
+    messages = [{'type': 'http.request', 'body': raw_body, 'more_body': False}]
+    sent = []
+
+    async def receive():
+        return messages.pop(0)
+
+    async def send(message):
+        sent.append(message)
+
+    application.loop.run_until_complete(application(scope, receive, send))
+    return sent[0]['status'], json.loads(sent[1]['body'])
+
+
+@pytest.fixture
+def application(app):
+    application = AsyncAuthAPI(app)
+    # One loop for the whole test, as under uvicorn, so the async engine's pool stays usable
+    application.loop = asyncio.new_event_loop()
+    yield application
+    if application.engine is not None:
+        application.loop.run_until_complete(application.engine.dispose())
+    application.loop.close()
+    application.wsgi_executor.shutdown()
+
+
+def test_native_login_matches_the_flask_view(application, client):
+    signup(client, "asgi@example.com")
+    status, body = asgi_request(application, 'POST', '/api/login',
+                                {"email": "asgi@example.com", "password": "123456"})
+    assert status == 200 and body["user"]["email"] == "asgi@example.com"
+    # Served on the async engine, not by handing the request to a thread
+    assert application.engine is not None
+
+    status, body = asgi_request(application, 'POST', '/api/login',
+                                {"email": "asgi@example.com", "password": "wrong-password"})
+    assert (status, body) == (401, {"message": "Invalid email or password"})
+    rendered = registry.render()
+    for phase in ("hash", "db", "jwt"):
+        assert f'auth_phase_duration_seconds_count{{endpoint="api.login",phase="{phase}"}}' in rendered
+
+
+def test_native_login_upgrades_an_outdated_hash(app, application, client):
+    signup(client, "old@example.com")
+    with app.app_context():
+        db.session.execute(db.update(User).where(User.email == "old@example.com").values(
+            password=generate_password_hash("123456", method="pbkdf2:sha256:500")))
+        db.session.commit()
+
+    status, _ = asgi_request(application, 'POST', '/api/login',
+                             {"email": "old@example.com", "password": "123456"})
+    assert status == 200
+    with app.app_context():
+        stored = db.session.execute(db.select(User.password).where(User.email == "old@example.com")).scalar()
+    assert stored.startswith("pbkdf2:sha256:1000$")
+
+
+@pytest.mark.parametrize("authorization", [None, "Bearer", "Bearer ", "Bearer not-a-token"])
+def test_native_auth_errors_match_the_flask_view(application, client, authorization):
+    headers = {"Authorization": authorization} if authorization is not None else {}
+    expected = client.get('/api/protected', headers=headers)
+    status, body = asgi_request(application, 'GET', '/api/protected', headers=headers)
+    assert (status, body) == (expected.status_code, expected.get_json())
+
+
+def test_native_protected_and_profile(application, client):
+    token = signup(client, "asgi@example.com").get_json()["token"]
+    status, body = asgi_request(application, 'GET', '/api/protected', headers=bearer(token))
+    assert status == 200 and body["user"]["email"] == "asgi@example.com"
+    status, body = asgi_request(application, 'GET', '/api/user/profile', headers=bearer(token))
+    assert status == 200 and body["user"]["email"] == "asgi@example.com"
+    status, body = asgi_request(application, 'POST', '/api/validate-token', {"token": token})
+    assert status == 200 and body["valid"]
@@ -0,0 +1,20 @@
+from flask import Flask
+from api.cors import Cors
+
+
+def test_preflight_headers_survive_eviction_by_another_thread():
+    app = Flask(__name__)
+    app.config['CORS_ORIGINS'] = ["https://*.example.com"]
+    cors = Cors(app)
+    build = cors._build
+
+    def build_then_evict(origin):
+        built = build(origin)
+        # Another thread's _build filled the cache in between and started it over
+        cors._preflight.clear()
+        return built
+
+    cors._build = build_then_evict
+    headers = dict(cors.preflight_headers("https://app.example.com"))
+    assert headers['Access-Control-Allow-Origin'] == "https://app.example.com"
+    assert 'Access-Control-Allow-Methods' in headers
@@ -0,0 +1,78 @@
+import os
+from datetime import datetime
+import pytest
+from werkzeug.security import generate_password_hash
+from api.bloom import email_filter
+from api.models import db, User
+from conftest import make_app, signup, login
+
+
+@pytest.fixture
+def filtered_app(tmp_path):
+    app = make_app(tmp_path, EMAIL_FILTER_ENABLED=True)
+    yield app
+    # Unready the filter so the next app builds its own
+    email_filter._pid = None
+    email_filter._filter = None
+
+
+def build_filter():
+    """What start() does in its background thread, inline, so no refresh from that thread races the test"""
+    email_filter._pid = os.getpid()
+    email_filter.rebuild()
+
+
+def insert_user(user_id, email):
+    now = datetime.utcnow()
+    db.session.execute(db.insert(User.__table__).values(
+        id=user_id, email=email, password='unused', is_active=True, created_at=now, updated_at=now))
+    db.session.commit()
+
+
+def test_unknown_email_is_rejected_and_canonical_email_found(filtered_app):
+    client = filtered_app.test_client()
+    assert signup(client, "Known@Example.com").status_code == 201
+    with filtered_app.app_context():
+        build_filter()
+    assert not email_filter.might_exist("unknown@example.com")
+    assert email_filter.might_exist(" known@EXAMPLE.com")
+    assert login(client, "KNOWN@example.com").status_code == 200
+
+
+def test_lower_id_committed_after_a_higher_one_is_picked_up(filtered_app):
+    with filtered_app.app_context():
+        insert_user(1, "first@example.com")
+        insert_user(3, "third@example.com")
+        build_filter()
+        assert not email_filter.might_exist("second@example.com")
+
+        # id 2 was allocated before id 3 but its transaction commits later
+        insert_user(2, "second@example.com")
+        email_filter.refresh()
+    assert email_filter.might_exist("second@example.com")
+    assert email_filter.stats()["gaps"] == 0
+
+
+def test_signup_on_another_process_is_picked_up_by_refresh(filtered_app):
+    with filtered_app.app_context():
+        build_filter()
+        insert_user(1, "elsewhere@example.com")
+        email_filter.refresh()
+    assert email_filter.might_exist("elsewhere@example.com")
+
+
+def test_user_created_since_the_last_refresh_can_log_in(filtered_app):
+    client = filtered_app.test_client()
+    with filtered_app.app_context():
+        insert_user(1, "old@example.com")
+        build_filter()
+        # Created by another worker or import-users; this filter has not refreshed since
+        db.session.execute(db.insert(User.__table__).values(
+            id=2, email="new@example.com", password=generate_password_hash("123456", method="pbkdf2:sha256:1000"),
+            is_active=True, created_at=datetime.utcnow(), updated_at=datetime.utcnow()))
+        db.session.commit()
+    assert not email_filter.might_exist("new@example.com")
+
+    assert login(client, "new@example.com").status_code == 200
+    assert email_filter.might_exist("new@example.com")
+    assert login(client, "unknown@example.com").status_code == 401
@@ -0,0 +1,47 @@
+"""Cold start of create_app() as a preloading gunicorn master sees it"""
+import json
+import os
+import statistics
+import subprocess
+import sys
+import pytest
+
+SRC_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'src')
+BUDGET_SECONDS = float(os.getenv('IMPORT_TIME_BUDGET_MS', 1500)) / 1000
+RUNS = 3
+
+# Modules only the flask CLI or /admin need; serving processes must start without them
+CLI_ONLY_MODULES = ('flask_migrate', 'alembic', 'api.commands', 'api.benchmarks', 'api.loadtest')
+ADMIN_ONLY_MODULES = ('flask_admin', 'wtforms', 'api.admin')
+
+PROBE = """
+import json, sys, time
+started = time.perf_counter()
+from app import create_app
+create_app()
+print(json.dumps({"seconds": time.perf_counter() - started,
+                  "loaded": [name for name in %r if name in sys.modules]}))
+""" % (CLI_ONLY_MODULES + ADMIN_ONLY_MODULES,)
+
+
+@pytest.fixture(scope='module')
+def reports(tmp_path_factory):
+    env = dict(os.environ)
+    # Set by the flask CLI; without it create_app takes the serving path
+    env.pop('FLASK_RUN_FROM_CLI', None)
+    env['ADMIN_ENABLED'] = '0'
+    env['DATABASE_URL'] = f"sqlite:///{tmp_path_factory.mktemp('import') / 'app.db'}"
+    results = []
+    for _ in range(RUNS):
+        probe = subprocess.run([sys.executable, '-c', PROBE], cwd=SRC_DIR, env=env,
+                               capture_output=True, text=True, check=True)
+        results.append(json.loads(probe.stdout.strip().splitlines()[-1]))
+    return results
+
+
+def test_serving_path_skips_cli_and_admin_modules(reports):
+    assert sorted({name for report in reports for name in report["loaded"]}) == []
+
+
+def test_cold_start_within_budget(reports):
+    assert statistics.median(report["seconds"] for report in reports) <= BUDGET_SECONDS
@@ -0,0 +1,38 @@
+import json
+from werkzeug.security import generate_password_hash
+from api.hashing import is_supported_hash
+from api.importer import import_users
+from conftest import login
+
+BCRYPT_HASH = "$2b$12$R9h/cIPz0gi.URNNX3kh2OPST9/PgBkqquzi.Ss7KIUgO2t0jWMUW"
+
+
+def test_unsupported_hashes_are_not_recognised():
+    assert is_supported_hash(generate_password_hash("123456", method="pbkdf2:sha256:1000"))
+    assert is_supported_hash(generate_password_hash("123456", method="scrypt"))
+    assert not is_supported_hash(BCRYPT_HASH)
+    assert not is_supported_hash("pbkdf2:sha256:1000$salt")
+    assert not is_supported_hash("md5$salt$5f4dcc3b5aa765d61d8327deb882cf99")
+    assert not is_supported_hash(None)
+
+
+def test_import_rejects_bad_rows_and_unsupported_hashes(app, client, tmp_path):
+    records = [
+        {"email": "plain@example.com", "password": "123456"},
+        {"email": "hashed@example.com",
+         "password_hash": generate_password_hash("123456", method="pbkdf2:sha256:1000")},
+        {"email": "bcrypt@example.com", "password_hash": BCRYPT_HASH},
+        {"email": "truncated@example.com", "password_hash": "pbkdf2:sha256:1000$salt"},
+        {"email": 12345, "password": "123456"},
+        {"email": "number@example.com", "password": 123456},
+    ]
+    path = tmp_path / "users.jsonl"
+    path.write_text("\n".join([json.dumps(record) for record in records] + ["{not json", "[1, 2]"]))
+
+    with app.app_context():
+        state = import_users(str(path), workers=1)
+
+    assert (state["imported"], state["skipped"], state["invalid_hashes"]) == (2, 4, 2)
+    assert login(client, "plain@example.com").status_code == 200
+    assert login(client, "hashed@example.com").status_code == 200
+    assert login(client, "bcrypt@example.com").status_code == 401
@@ -0,0 +1,89 @@
+import os
+import pytest
+from werkzeug.security import generate_password_hash
+from api.benchmarks import bench_login_lookup
+from api.hashing import default_workers, hash_executor
+from api.loadtest import run_benchmark
+from api.models import db, User, SERIALIZED_USER_BY_ID
+from api.routes import login_steps
+from api.steps import ReadRow, perform
+from conftest import make_app, signup, login
+
+
+def stored_hash(app, email):
+    with app.app_context():
+        return db.session.execute(db.select(User.password).where(User.email == email)).scalar()
+
+
+def test_login_upgrades_an_outdated_hash(app, client):
+    signup(client, "old@example.com")
+    old_hash = generate_password_hash("123456", method="pbkdf2:sha256:500")
+    with app.app_context():
+        db.session.execute(db.update(User).where(User.email == "old@example.com").values(password=old_hash))
+        db.session.commit()
+
+    assert login(client, "old@example.com").status_code == 200
+    assert stored_hash(app, "old@example.com").startswith("pbkdf2:sha256:1000$")
+    assert login(client, "old@example.com").status_code == 200
+
+
+def test_wrong_password_is_401(client):
+    signup(client, "user@example.com")
+    assert login(client, "user@example.com", "not-the-password").status_code == 401
+
+
+def test_login_lookup_benchmark_needs_a_bench_database(app):
+    with app.app_context(), pytest.raises(RuntimeError):
+        bench_login_lookup(seed_rows=10)
+    with app.app_context():
+        assert db.session.execute(db.select(db.func.count(User.id))).scalar() == 0
+
+
+def test_login_through_the_process_pool(tmp_path):
+    app = make_app(tmp_path, HASH_EXECUTOR="process", HASH_WORKERS=1)
+    client = app.test_client()
+    try:
+        signup(client, "pool@example.com")
+        assert login(client, "pool@example.com").status_code == 200
+        assert hash_executor._executor._mp_context.get_start_method() in ("forkserver", "spawn")
+    finally:
+        hash_executor.shutdown()
+
+
+def test_hash_workers_default_shares_cpus_between_web_workers(monkeypatch):
+    monkeypatch.setattr(os, "cpu_count", lambda: 8)
+    monkeypatch.setenv("WEB_CONCURRENCY", "4")
+    assert default_workers() == 2
+    monkeypatch.setenv("WEB_CONCURRENCY", "16")
+    assert default_workers() == 1
+
+
+def test_deactivated_account_is_refused_before_its_hash_is_upgraded(app, client):
+    signup(client, "gone@example.com")
+    old_hash = generate_password_hash("123456", method="pbkdf2:sha256:500")
+    with app.app_context():
+        db.session.execute(db.update(User).where(User.email == "gone@example.com")
+                           .values(password=old_hash, is_active=False))
+        db.session.commit()
+
+    assert login(client, "gone@example.com").status_code == 401
+    assert stored_hash(app, "gone@example.com") == old_hash
+
+
+def test_user_deleted_between_the_login_reads_gets_the_generic_401(app, client):
+    signup(client, "racing@example.com")
+    with app.test_request_context():
+        flow = login_steps({"email": "racing@example.com", "password": "123456"}, "127.0.0.1")
+        step = flow.send(None)
+        while not (isinstance(step, ReadRow) and step.statement is SERIALIZED_USER_BY_ID):
+            step = flow.send(perform(step))
+        with pytest.raises(StopIteration) as done:
+            flow.send(None)
+    assert done.value.value == ({"message": "Invalid email or password"}, 401)
+
+
+def test_load_test_seeding_needs_a_bench_database(app):
+    with pytest.raises(RuntimeError):
+        run_benchmark(app, users=5, requests=10, alloc_requests=0)
+    with app.app_context():
+        assert db.session.execute(db.select(db.func.count(User.id))).scalar() == 0
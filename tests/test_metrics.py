@@ -0,0 +1,78 @@
+import json
+import os
+from api.metrics import clear_multiproc_dir, mark_process_dead, registry
+from conftest import make_app
+
+
+def write_snapshot(directory, pid, requests, latency_count):
+    snapshot = {
+        "http_requests_total": {"kind": "counter", "help": "HTTP requests", "buckets": [],
+                                "values": [[[["endpoint", "api.login"]], requests]]},
+        "http_request_duration_seconds": {"kind": "histogram", "help": "Latency", "buckets": [0.1],
+                                          "values": [[[], [[latency_count, 0], 0.01 * latency_count,
+                                                           latency_count]]]},
+    }
+    with open(os.path.join(directory, f"metrics-{pid}.json"), 'w') as f:
+        json.dump(snapshot, f)
+
+
+def test_exited_workers_are_folded_into_one_file(tmp_path):
+    write_snapshot(tmp_path, 101, 3, 2)
+    write_snapshot(tmp_path, 102, 4, 5)
+    mark_process_dead(tmp_path, 101)
+    mark_process_dead(tmp_path, 102)
+
+    assert sorted(os.listdir(tmp_path)) == ["metrics-dead.json"]
+    with open(tmp_path / "metrics-dead.json") as f:
+        dead = json.load(f)
+    assert dead["http_requests_total"]["values"] == [[[["endpoint", "api.login"]], 7]]
+    assert dead["http_request_duration_seconds"]["values"][0][1][2] == 7
+
+    # A new worker reusing a pid starts its own series
+    write_snapshot(tmp_path, 101, 1, 1)
+    mark_process_dead(tmp_path, 101)
+    with open(tmp_path / "metrics-dead.json") as f:
+        assert json.load(f)["http_requests_total"]["values"][0][1] == 8
+
+
+def test_startup_clears_earlier_runs(tmp_path):
+    write_snapshot(tmp_path, 101, 3, 2)
+    mark_process_dead(tmp_path, 101)
+    write_snapshot(tmp_path, 102, 3, 2)
+    clear_multiproc_dir(tmp_path)
+    assert os.listdir(tmp_path) == []
+
+
+def test_render_sums_dead_workers(tmp_path, app):
+    write_snapshot(tmp_path, 101, 3, 2)
+    mark_process_dead(tmp_path, 101)
+    registry.multiproc_dir = str(tmp_path)
+    try:
+        assert 'http_requests_total{endpoint="api.login"} 3' in registry.render()
+    finally:
+        registry.multiproc_dir = None
+
+
+def test_building_another_app_registers_no_more_collectors(tmp_path, app):
+    collectors = len(registry.collectors)
+    (tmp_path / "second").mkdir()
+    second = make_app(tmp_path / "second")
+    assert len(registry.collectors) == collectors
+    assert registry.app is second
+    assert 'db_pool_size' in registry.render()
+
+
+def test_metrics_routes_are_off_by_default(app, client):
+    # Unknown paths fall through to the front end
+    assert client.get('/metrics').mimetype != 'text/plain'
+    assert client.get('/metrics/pool').mimetype != 'application/json'
+    assert 'prometheus_metrics' not in app.view_functions
+
+
+def test_metrics_token_is_required_when_configured(tmp_path):
+    client = make_app(tmp_path, METRICS_ENABLED=True, METRICS_TOKEN="scrape-secret").test_client()
+    assert client.get('/metrics').status_code == 401
+    assert client.get('/metrics/pool', headers={"Authorization": "Bearer wrong"}).status_code == 401
+    response = client.get('/metrics', headers={"Authorization": "Bearer scrape-secret"})
+    assert response.status_code == 200
+    assert b'http_requests_total' in response.data
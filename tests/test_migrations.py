@@ -0,0 +1,25 @@
+import os
+import flask_migrate
+from sqlalchemy import inspect
+from app import create_app
+from api.models import db
+
+MIGRATIONS_DIR = os.path.join(os.path.dirname(__file__), '..', 'migrations')
+
+
+def test_migrations_upgrade_a_fresh_sqlite_database(tmp_path):
+    # conftest builds the schema with create_all, which never runs the migrations themselves
+    app = create_app({
+        "TESTING": True,
+        "SQLALCHEMY_DATABASE_URI": f"sqlite:///{tmp_path / 'migrated.db'}",
+        "SQLALCHEMY_BINDS": {},
+        "PROMETHEUS_MULTIPROC_DIR": None,
+    })
+    flask_migrate.Migrate(app, db)
+    with app.app_context():
+        flask_migrate.upgrade(directory=MIGRATIONS_DIR)
+        inspector = inspect(db.engine)
+        for table in db.metadata.sorted_tables:
+            columns = {column['name'] for column in inspector.get_columns(table.name)}
+            assert columns == set(table.columns.keys()), table.name
+        db.engine.dispose()
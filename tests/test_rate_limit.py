@@ -0,0 +1,57 @@
+import pytest
+from conftest import make_app, signup, login
+
+
+@pytest.fixture
+def limited_app(tmp_path):
+    return make_app(tmp_path, RATE_LIMIT_ENABLED=True, LOGIN_IP_RATE=1, LOGIN_IP_BURST=100,
+                    LOGIN_ACCOUNT_LIMIT=3, LOGIN_ACCOUNT_WINDOW=300, PROXY_FIX_X_FOR=1)
+
+
+def login_from(client, forwarded_for, password):
+    return client.post("/api/login", json={"email": "victim@example.com", "password": password},
+                       headers={"X-Forwarded-For": forwarded_for})
+
+
+def test_failed_logins_lock_only_that_ip_out_of_the_account(limited_app):
+    client = limited_app.test_client()
+    signup(client, "victim@example.com")
+    for _ in range(3):
+        assert login_from(client, "203.0.113.9", "wrong-password").status_code == 401
+    assert login_from(client, "203.0.113.9", "123456").status_code == 429
+    # The owner, elsewhere, still gets in
+    assert login_from(client, "198.51.100.7", "123456").status_code == 200
+
+
+def test_successful_logins_do_not_count(limited_app):
+    client = limited_app.test_client()
+    signup(client, "victim@example.com")
+    for _ in range(5):
+        assert login(client, "victim@example.com").status_code == 200
+
+
+def test_spoofed_leftmost_forwarded_for_does_not_get_a_fresh_bucket(tmp_path):
+    app = make_app(tmp_path, RATE_LIMIT_ENABLED=True, LOGIN_IP_RATE=0.001, LOGIN_IP_BURST=2,
+                   PROXY_FIX_X_FOR=1)
+    client = app.test_client()
+    statuses = [login_from(client, f"10.0.0.{attempt}, 203.0.113.9", "wrong-password").status_code
+                for attempt in range(3)]
+    assert statuses == [401, 401, 429]
+
+
+def test_spraying_one_account_from_many_ips_is_throttled(tmp_path):
+    app = make_app(tmp_path, RATE_LIMIT_ENABLED=True, LOGIN_IP_BURST=100, LOGIN_ACCOUNT_LIMIT=3,
+                   LOGIN_ACCOUNT_TOTAL_LIMIT=5, PROXY_FIX_X_FOR=1)
+    client = app.test_client()
+    signup(client, "victim@example.com")
+    statuses = [login_from(client, f"203.0.113.{attempt}", "wrong-password").status_code
+                for attempt in range(6)]
+    assert statuses == [401] * 5 + [429]
+
+
+def test_forwarded_for_is_ignored_without_a_configured_proxy(tmp_path):
+    app = make_app(tmp_path, RATE_LIMIT_ENABLED=True, LOGIN_IP_RATE=0.001, LOGIN_IP_BURST=2)
+    client = app.test_client()
+    statuses = [login_from(client, f"203.0.113.{attempt}", "wrong-password").status_code
+                for attempt in range(3)]
+    assert statuses == [401, 401, 429]
@@ -0,0 +1,69 @@
+"""Read routing against a replica that is NOT fed from the primary (a second SQLite file)
+
+The replica gets a copy of the first user only. A second user signed up on the primary never
+reaches it, so whether GET /api/users lists that user tells which database served the read.
+"""
+import pytest
+from api.db_pool import replica_binds
+from api.models import db, User
+from api.replica import replica_router
+from conftest import make_app, make_admin, signup, bearer
+
+
+@pytest.fixture
+def replicated_app(tmp_path):
+    def _make(read_your_writes_seconds):
+        app = make_app(tmp_path, SQLALCHEMY_BINDS=replica_binds(f"sqlite:///{tmp_path / 'replica.db'}"),
+                       REPLICA_READ_YOUR_WRITES_SECONDS=read_your_writes_seconds)
+        client = app.test_client()
+        replicated = signup(client, "replicated@example.com").get_json()
+        make_admin(app, "replicated@example.com")
+        with app.app_context():
+            replica = db.engines['replica_0']
+            db.metadata.create_all(replica)
+            row = db.session.execute(db.select(User.__table__)).mappings().one()
+            with replica.begin() as connection:
+                connection.execute(db.insert(User.__table__).values(
+                    {key: value for key, value in row.items() if key != 'email_canonical'}))
+        unreplicated = signup(client, "primary-only@example.com").get_json()
+        make_admin(app, "primary-only@example.com")
+        apps.append(app)
+        return app, replicated["token"], unreplicated
+    apps = []
+    yield _make
+    replica_router._down_until.clear()
+    for app in apps:
+        with app.app_context():
+            for engine in db.engines.values():
+                engine.dispose()
+
+
+def sees_user(app, token, user_id):
+    response = app.test_client().get(f"/api/users?after_id={user_id - 1}&limit=1", headers=bearer(token))
+    assert response.status_code == 200
+    return any(user["id"] == user_id for user in response.get_json()["users"])
+
+
+def test_read_within_window_uses_primary(replicated_app):
+    app, _, new_user = replicated_app(60)
+    assert sees_user(app, new_user["token"], new_user["user"]["id"])
+
+
+def test_read_after_window_uses_replica(replicated_app):
+    app, token, new_user = replicated_app(0)
+    assert not sees_user(app, token, new_user["user"]["id"])
+
+
+def test_replica_down_fails_over_to_primary(replicated_app):
+    app, token, new_user = replicated_app(0)
+    replica_router.mark_down('replica_0')
+    assert sees_user(app, token, new_user["user"]["id"])
+
+
+def test_read_failing_on_replica_is_retried_on_primary(replicated_app):
+    app, token, new_user = replicated_app(0)
+    with app.app_context():
+        db.metadata.drop_all(db.engines['replica_0'])
+    assert sees_user(app, token, new_user["user"]["id"])
+    assert not replica_router.healthy('replica_0')
+    assert replica_router.stats()["failovers"] >= 1
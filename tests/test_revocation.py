@@ -0,0 +1,46 @@
+import time
+from api.models import db, User, RevokedToken
+from api.token_cache import TokenCache
+from conftest import make_app, signup, bearer
+
+
+def test_logout_revokes_the_token_for_every_worker(tmp_path):
+    app = make_app(tmp_path, TOKEN_DENYLIST_SYNC_SECONDS=0)
+    client = app.test_client()
+    token = signup(client, "user@example.com").get_json()["token"]
+    assert client.get("/api/protected", headers=bearer(token)).status_code == 200
+    with app.app_context():
+        jti = User.decode_token(token)["jti"]
+
+    assert client.post("/api/logout", headers=bearer(token)).status_code == 200
+    assert client.post("/api/logout", headers=bearer(token)).status_code == 200
+    with app.app_context():
+        assert [row.jti for row in RevokedToken.revoked_since()] == [jti]
+    assert client.get("/api/protected", headers=bearer(token)).status_code == 401
+
+
+def test_revocations_from_another_worker_reach_cached_tokens(tmp_path):
+    app = make_app(tmp_path, TOKEN_DENYLIST_SYNC_SECONDS=0)
+    client = app.test_client()
+    token = signup(client, "user@example.com").get_json()["token"]
+    # Cached in this worker before the revocation
+    assert client.get("/api/protected", headers=bearer(token)).status_code == 200
+
+    # Another worker's logout only reaches this one through the table
+    with app.app_context():
+        payload = User.decode_token(token)
+        RevokedToken.revoke(payload["jti"], payload["exp"])
+        db.session.commit()
+    assert client.get("/api/protected", headers=bearer(token)).status_code == 401
+
+
+def test_replica_rows_are_not_cached_right_after_invalidation():
+    cache = TokenCache()
+    claims = {"exp": time.time() + 60}
+    user = {"id": 1, "is_active": True}
+
+    cache.invalidate_user(1)
+    cache.put("replica-token", claims, user, from_replica=True)
+    cache.put("primary-token", claims, user)
+    assert cache.get("replica-token") is None
+    assert cache.get("primary-token") == (claims, user)
@@ -0,0 +1,39 @@
+import threading
+import uuid
+from conftest import signup, login
+
+
+def test_signup_then_login(client):
+    assert signup(client, "new@example.com").status_code == 201
+    response = login(client, "New@Example.com ")
+    assert response.status_code == 200
+    assert response.get_json()["token"]
+
+
+def test_duplicate_signup_is_409(client):
+    assert signup(client, "dup@example.com").status_code == 201
+    assert signup(client, "DUP@example.com").status_code == 409
+
+
+def test_parallel_duplicate_signups_give_one_201(app):
+    """Simultaneous signups for one email: exactly one 201, the rest 409"""
+    parallel = 16
+    for _ in range(3):
+        email = f"race-{uuid.uuid4().hex}@example.com"
+        barrier = threading.Barrier(parallel)
+        statuses = []
+        lock = threading.Lock()
+
+        def _signup(client):
+            barrier.wait()
+            status = signup(client, email).status_code
+            with lock:
+                statuses.append(status)
+
+        threads = [threading.Thread(target=_signup, args=(app.test_client(),)) for _ in range(parallel)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+
+        assert sorted(statuses) == [201] + [409] * (parallel - 1)
@@ -0,0 +1,34 @@
+import pytest
+from conftest import make_app
+
+
+@pytest.fixture
+def built_client(tmp_path):
+    """A front end laid out the way `vite build` writes dist/"""
+    dist = tmp_path / "dist"
+    (dist / "assets").mkdir(parents=True)
+    (dist / "index.html").write_text('<script type="module" src="/assets/index-4f2a1b3c.js"></script>')
+    (dist / "assets" / "index-4f2a1b3c.js").write_text("console.log('app')")
+    (dist / "4geeks.ico").write_bytes(b"\x00\x00\x01\x00")
+    return make_app(tmp_path, STATIC_FILES_DIR=str(dist)).test_client()
+
+
+def test_hashed_assets_are_immutable(built_client):
+    response = built_client.get("/assets/index-4f2a1b3c.js")
+    assert response.status_code == 200
+    assert response.cache_control.immutable
+    assert response.cache_control.max_age == 365 * 24 * 3600
+
+
+def test_index_and_unhashed_files_revalidate(built_client):
+    for path in ("/index.html", "/4geeks.ico"):
+        response = built_client.get(path)
+        assert response.status_code == 200
+        assert response.cache_control.no_cache
+        assert not response.cache_control.immutable
+
+
+def test_client_side_routes_get_index(built_client):
+    response = built_client.get("/some/page")
+    assert response.status_code == 200
+    assert b"/assets/index-4f2a1b3c.js" in response.data
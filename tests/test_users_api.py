@@ -0,0 +1,26 @@
+from conftest import make_admin, signup, bearer
+
+
+def test_users_list_needs_admin(app, client):
+    token = signup(client, "someone@example.com").get_json()["token"]
+    response = client.get("/api/users", headers=bearer(token))
+    assert response.status_code == 403
+
+
+def test_admin_pages_through_users(app, client):
+    for index in range(3):
+        signup(client, f"user{index}@example.com")
+    token = signup(client, "admin@example.com").get_json()["token"]
+    make_admin(app, "admin@example.com")
+
+    response = client.get("/api/users?limit=2", headers=bearer(token))
+    assert response.status_code == 200
+    body = response.get_json()
+    assert [user["email"] for user in body["users"]] == ["user0@example.com", "user1@example.com"]
+
+    response = client.get(f"/api/users?limit=2&after_id={body['next_after_id']}", headers=bearer(token))
+    assert [user["email"] for user in response.get_json()["users"]] == ["user2@example.com", "admin@example.com"]
+
+
+def test_users_list_needs_a_token(client):
+    assert client.get("/api/users").status_code == 401
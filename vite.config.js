@@ -9,6 +9,9 @@ export default defineConfig({
         port: 3000
     },
     build: {
-        outDir: 'dist'
+        // Served by Flask (src/api/static_files.py); assets/ names carry a content hash
+        // and get Cache-Control: immutable
+        outDir: 'dist',
+        assetsDir: 'assets'
     }
 })
\ No newline at end of file